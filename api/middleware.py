@@ -0,0 +1,73 @@
+"""
+API中间件
+"""
+import asyncio
+from typing import Tuple
+
+import orjson
+from loguru import logger
+
+
+_OVERLOADED_BODY = orjson.dumps({"detail": "Server is busy, please retry later"})
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    并发上限中间件（纯ASGI实现，流式响应在发送完毕后才释放名额）
+
+    仅作用于模型/数据库密集的路径。信号量由lifespan根据连接池大小创建并挂载到
+    app.state.concurrency_limiter；超出上限的请求短暂排队，超时后返回503。
+    """
+
+    def __init__(
+        self,
+        app,
+        path_prefixes: Tuple[str, ...] = ("/api/v1/query", "/api/v1/confirm"),
+        queue_timeout: float = 1.0
+    ):
+        """
+        初始化中间件
+
+        Args:
+            app: 下游ASGI应用
+            path_prefixes: 受限路径前缀
+            queue_timeout: 排队等待的最长时间（秒）
+        """
+        self.app = app
+        self.path_prefixes = path_prefixes
+        self.queue_timeout = queue_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        limiter: asyncio.Semaphore = getattr(scope["app"].state, "concurrency_limiter", None)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(limiter.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Concurrency limit reached, rejecting {}", scope["path"])
+            await self._send_overloaded(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def _send_overloaded(self, send):
+        """返回503响应"""
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(_OVERLOADED_BODY)).encode()),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": _OVERLOADED_BODY})
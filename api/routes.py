@@ -1,18 +1,27 @@
 """
 FastAPI路由 - API接口定义
 """
+from datetime import datetime
 from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 from loguru import logger
-import json
+import orjson
 
-from models.base_model import Message
+from models.base_model import MessageListAdapter
+from core.orchestrator import MCPOrchestrator
+from database import DatabaseManager
 
 
 router = APIRouter(prefix="/api/v1", tags=["MCP Monitor"])
 
+# 固定内容的响应体，启动时预先序列化
+_HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "MCP Monitor"})
+_EXECUTION_RECORDED_BODY = orjson.dumps({"success": True, "message": "Execution result recorded"})
+_STREAM_START_EVENT = b"data: " + orjson.dumps({"type": "start", "message": "开始处理您的问题..."}) + b"\n\n"
+_STREAM_END_EVENT = b"data: " + orjson.dumps({"type": "end", "message": "处理完成"}) + b"\n\n"
+
 
 # ==================== 请求/响应模型 ====================
 
@@ -60,15 +69,19 @@ class ExecutionResultRequest(BaseModel):
 
 # ==================== 依赖注入 ====================
 
-def get_orchestrator():
-    """获取编排器实例（将在main.py中设置）"""
-    from main import orchestrator
-    return orchestrator
+def get_orchestrator(request: Request) -> MCPOrchestrator:
+    """获取编排器实例（由main.py的lifespan挂载到app.state）"""
+    return request.app.state.orchestrator
+
+
+def get_db(request: Request) -> DatabaseManager:
+    """获取数据库管理器实例（由main.py的lifespan挂载到app.state）"""
+    return request.app.state.db
 
 
 # ==================== API端点 ====================
 
-@router.post("/query", response_model=QueryResponse)
+@router.post("/query", response_model=None, responses={200: {"model": QueryResponse}})
 async def process_query(
     request: QueryRequest,
     orchestrator = Depends(get_orchestrator)
@@ -90,7 +103,7 @@ async def process_query(
         # 转换上下文
         context = None
         if request.context:
-            context = [Message(**msg) for msg in request.context]
+            context = MessageListAdapter.validate_python(request.context)
 
         # 处理查询
         result = await orchestrator.process_query(
@@ -99,7 +112,8 @@ async def process_query(
             conversation_context=context
         )
 
-        return QueryResponse(**result)
+        # 编排器结果结构已固定，直接序列化，跳过响应模型的逐字段校验
+        return ORJSONResponse(result)
 
     except Exception as e:
         logger.error(f"Error processing query: {e}")
@@ -131,10 +145,10 @@ async def process_query_stream(
             # 转换上下文
             context = None
             if request.context:
-                context = [Message(**msg) for msg in request.context]
+                context = MessageListAdapter.validate_python(request.context)
 
             # 开始流式处理
-            yield f"data: {json.dumps({'type': 'start', 'message': '开始处理您的问题...'})}\n\n"
+            yield _STREAM_START_EVENT
 
             # 流式处理查询
             async for chunk in orchestrator.process_query_stream(
@@ -142,10 +156,10 @@ async def process_query_stream(
                 user_question=request.question,
                 conversation_context=context
             ):
-                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                yield b"data: " + orjson.dumps(chunk) + b"\n\n"
 
             # 结束标记
-            yield f"data: {json.dumps({'type': 'end', 'message': '处理完成'})}\n\n"
+            yield _STREAM_END_EVENT
 
         except Exception as e:
             logger.error(f"Error in stream processing: {e}")
@@ -154,7 +168,7 @@ async def process_query_stream(
                 'error': str(e),
                 'message': '处理过程中出现错误'
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+            yield b"data: " + orjson.dumps(error_data) + b"\n\n"
 
     return StreamingResponse(
         generate_stream(),
@@ -217,7 +231,7 @@ async def record_execution(
             execution_result=request.execution_result
         )
 
-        return {"success": True, "message": "Execution result recorded"}
+        return Response(content=_EXECUTION_RECORDED_BODY, media_type="application/json")
 
     except Exception as e:
         logger.error(f"Error recording execution: {e}")
@@ -241,7 +255,7 @@ async def register_service(
         注册结果
     """
     try:
-        success = await orchestrator.service_manager.register_service(
+        success = await orchestrator.register_service(
             service_name=request.service_name,
             service_url=request.service_url,
             description=request.description,
@@ -277,7 +291,7 @@ async def list_services(
         服务列表
     """
     try:
-        services = await orchestrator.service_manager.list_services(
+        services = await orchestrator.list_services(
             layer=layer,
             active_only=active_only
         )
@@ -356,7 +370,10 @@ async def get_user_history(
     user_id: str,
     limit: int = 50,
     tool_name: Optional[str] = None,
-    orchestrator = Depends(get_orchestrator)
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    stream: bool = False,
+    db = Depends(get_db)
 ):
     """
     获取用户的工具调用历史
@@ -365,31 +382,43 @@ async def get_user_history(
         user_id: 用户ID
         limit: 返回记录数量
         tool_name: 筛选工具名称
+        before: 分页游标，传入上一页返回的 next_cursor.before
+        before_id: 分页游标，传入上一页返回的 next_cursor.before_id
+        stream: 是否以NDJSON（每行一条记录）流式返回
 
     Returns:
         历史记录列表
     """
+    if stream:
+        async def generate_rows():
+            async for row in db.stream_user_tool_history_rows(
+                user_id=user_id,
+                limit=limit,
+                tool_name=tool_name,
+                before=before,
+                before_id=before_id
+            ):
+                yield orjson.dumps(row) + b"\n"
+
+        return StreamingResponse(generate_rows(), media_type="application/x-ndjson")
+
     try:
-        histories = await orchestrator.db.get_user_tool_history(
+        # 行数据直接由ORJSONResponse序列化（含datetime）
+        histories = await db.get_user_tool_history_rows(
             user_id=user_id,
             limit=limit,
-            tool_name=tool_name
+            tool_name=tool_name,
+            before=before,
+            before_id=before_id
         )
 
         return {
             "total": len(histories),
-            "histories": [
-                {
-                    "request_id": h.request_id,
-                    "user_question": h.user_question,
-                    "tool_name": h.tool_name,
-                    "risk_score": h.risk_score,
-                    "user_confirmed": h.user_confirmed,
-                    "execution_success": h.execution_success,
-                    "created_at": h.created_at.isoformat()
-                }
-                for h in histories
-            ]
+            "histories": histories,
+            "next_cursor": (
+                {"before": histories[-1]["created_at"], "before_id": histories[-1]["id"]}
+                if len(histories) == limit else None
+            )
         }
 
     except Exception as e:
@@ -400,40 +429,38 @@ async def get_user_history(
 @router.get("/execution-result/{request_id}")
 async def get_execution_result(
     request_id: str,
-    orchestrator = Depends(get_orchestrator)
+    db = Depends(get_db)
 ):
     """
     获取特定请求的详细执行结果
 
+    传入请求ID时 tool_calls 包含该请求全部工具调用的记录，传入 record_id 时只包含该条；
+    顶层的工具调用字段取第一条记录（与单工具调用的响应保持一致）。
+
     Args:
-        request_id: 请求ID
+        request_id: 请求ID或工具调用的 record_id
 
     Returns:
         详细执行结果
     """
     try:
         # 从数据库获取详细记录
-        history = await orchestrator.db.get_tool_call_history(request_id)
+        histories = await db.get_tool_call_histories(request_id)
 
-        if not history:
+        if not histories:
             raise HTTPException(status_code=404, detail="Request not found")
 
+        tool_calls = [_execution_detail(history) for history in histories]
+        first = histories[0]
+
         return {
-            "request_id": history.request_id,
-            "user_id": history.user_id,
-            "user_question": history.user_question,
-            "tool_name": history.tool_name,
-            "tool_parameters": history.tool_parameters,
-            "risk_score": history.risk_score,
-            "user_confirmed": history.user_confirmed,
-            "user_feedback": history.user_feedback,
-            "execution_success": history.execution_success,
-            "execution_result": history.execution_result,
-            "confirmation_reason": history.confirmation_reason,
-            "conversation_context": history.conversation_context,
-            "created_at": history.created_at.isoformat(),
-            "confirmed_at": history.confirmed_at.isoformat() if history.confirmed_at else None,
-            "executed_at": history.executed_at.isoformat() if history.executed_at else None
+            **tool_calls[0],
+            "request_id": request_id,
+            "user_id": first.user_id,
+            "user_question": first.user_question,
+            "conversation_context": first.conversation_context,
+            "created_at": first.created_at.isoformat(),
+            "tool_calls": tool_calls
         }
 
     except HTTPException:
@@ -443,12 +470,31 @@ async def get_execution_result(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _execution_detail(history) -> Dict[str, Any]:
+    """单个工具调用记录的执行详情"""
+    return {
+        "record_id": history.request_id,
+        "tool_name": history.tool_name,
+        "tool_parameters": history.tool_parameters,
+        "risk_score": history.risk_score,
+        "user_confirmed": history.user_confirmed,
+        "user_feedback": history.user_feedback,
+        "execution_success": history.execution_success,
+        "execution_result": history.execution_result,
+        "confirmation_reason": history.confirmation_reason,
+        "confirmed_at": history.confirmed_at.isoformat() if history.confirmed_at else None,
+        "executed_at": history.executed_at.isoformat() if history.executed_at else None
+    }
+
+
 @router.get("/execution-results/{user_id}")
 async def get_user_execution_results(
     user_id: str,
     limit: int = 10,
     include_failed: bool = True,
-    orchestrator = Depends(get_orchestrator)
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    db = Depends(get_db)
 ):
     """
     获取用户的所有执行结果，包含详细信息
@@ -457,14 +503,18 @@ async def get_user_execution_results(
         user_id: 用户ID
         limit: 返回记录数量
         include_failed: 是否包含失败的执行
+        before: 分页游标，传入上一页返回的 next_cursor.before
+        before_id: 分页游标，传入上一页返回的 next_cursor.before_id
 
     Returns:
         执行结果列表
     """
     try:
-        histories = await orchestrator.db.get_user_tool_history(
+        histories = await db.get_user_tool_history(
             user_id=user_id,
-            limit=limit
+            limit=limit,
+            before=before,
+            before_id=before_id
         )
 
         results = []
@@ -487,7 +537,11 @@ async def get_user_execution_results(
         return {
             "user_id": user_id,
             "total": len(results),
-            "execution_results": results
+            "execution_results": results,
+            "next_cursor": (
+                {"before": histories[-1].created_at.isoformat(), "before_id": histories[-1].id}
+                if len(histories) == limit else None
+            )
         }
 
     except Exception as e:
@@ -495,12 +549,17 @@ async def get_user_execution_results(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ==================== 调试 ====================
+
+@router.get("/debug/cache")
+async def get_cache_stats(orchestrator = Depends(get_orchestrator)):
+    """获取缓存命中统计"""
+    return orchestrator.cache_stats()
+
+
 # ==================== 健康检查 ====================
 
 @router.get("/health")
 async def health_check():
     """健康检查端点"""
-    return {
-        "status": "healthy",
-        "service": "MCP Monitor"
-    }
+    return Response(content=_HEALTH_BODY, media_type="application/json")
@@ -1,12 +1,15 @@
 """
 核心模块初始化
 """
+from core.batcher import AdaptiveBatcher
 from core.rag_retriever import RAGRetriever
-from core.risk_assessor import RiskAssessor
+from core.risk_assessor import RiskAssessor, RiskResult
 from core.rule_engine import RuleEngine
 
 __all__ = [
+    "AdaptiveBatcher",
     "RAGRetriever",
     "RiskAssessor",
+    "RiskResult",
     "RuleEngine"
 ]
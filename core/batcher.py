@@ -0,0 +1,182 @@
+"""
+自适应微批处理器 - 将并发的单条请求合并为批量调用
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from loguru import logger
+
+
+class AdaptiveBatcher:
+    """
+    自适应批处理器
+
+    并发协程通过 submit() 提交单个条目，后台任务在 max_batch_size 条
+    或 max_wait_ms 毫秒内收集请求，调用一次批量处理函数，再把结果
+    按顺序分发回各个等待的协程。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "batcher"
+    ):
+        """
+        初始化批处理器
+
+        Args:
+            handler: 批量处理函数，输入条目列表，返回等长结果列表
+            max_batch_size: 单批最大条目数
+            max_wait_ms: 凑批最长等待时间（毫秒）
+            name: 批处理器名称（用于日志）
+        """
+        self.handler = handler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+
+    async def start(self):
+        """启动后台批处理任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Batcher '{self.name}' started: max_batch_size={self.max_batch_size}, "
+                f"max_wait_ms={self.max_wait * 1000:.1f}"
+            )
+
+    async def stop(self):
+        """停止后台任务，等待进行中的批次完成"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+        # 未被处理的请求直接失败，避免调用方永久挂起
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            self._queue.task_done()
+            if not future.done():
+                future.set_exception(RuntimeError(f"Batcher '{self.name}' stopped"))
+
+        logger.info(f"Batcher '{self.name}' stopped")
+
+    def submit_nowait(self, item: Any):
+        """
+        提交单个条目但不等待结果（写后即忘）
+
+        处理失败只记录日志，不会抛给调用方。
+
+        Args:
+            item: 待处理条目
+        """
+        if self._task is None:
+            task = asyncio.create_task(self.handler([item]))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            task.add_done_callback(self._log_detached_error)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._consume_result)
+        self._queue.put_nowait((item, future))
+
+    async def drain(self):
+        """等待已提交的条目全部处理完成"""
+        await self._queue.join()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def submit(self, item: Any) -> Any:
+        """
+        提交单个条目并等待其结果
+
+        Args:
+            item: 待处理条目
+
+        Returns:
+            该条目对应的处理结果
+        """
+        if self._task is None:
+            # 未启动时退化为单条调用
+            results = await self.handler([item])
+            return results[0]
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _run(self):
+        """后台收集并分发批次"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            try:
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # 停止时已取出的条目直接分发，避免丢失
+                task = asyncio.create_task(self._dispatch(batch))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+                raise
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]):
+        """执行一次批量调用并回填结果"""
+        items = [item for item, _ in batch]
+
+        try:
+            results = await self.handler(items)
+            if len(results) != len(items):
+                raise ValueError(
+                    f"Batch handler returned {len(results)} results for {len(items)} items"
+                )
+        except Exception as e:
+            logger.error(f"Batcher '{self.name}' failed on batch of {len(items)}: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+        logger.debug("Batcher '{}' processed batch of {}", self.name, len(items))
+
+    @staticmethod
+    def _consume_result(future: asyncio.Future):
+        """取走写后即忘条目的异常（批次失败已在 _dispatch 中记录）"""
+        if not future.cancelled():
+            future.exception()
+
+    def _log_detached_error(self, task: asyncio.Task):
+        """记录未启动时直接执行的写后即忘任务的异常"""
+        if not task.cancelled() and task.exception():
+            logger.error(f"Batcher '{self.name}' failed on item: {task.exception()}")
@@ -1,17 +1,32 @@
 """
 主流程编排器 - 整合所有组件处理用户请求
 """
+import asyncio
+import functools
+import hashlib
+import os
 import uuid
-from typing import Dict, Any, List, Optional, AsyncGenerator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, AsyncGenerator, Iterator, Tuple
 from datetime import datetime
 from loguru import logger
-import json
+import httpx
+import orjson
 
 from database import DatabaseManager
-from models.base_model import BaseModel, Message, ToolDefinition
-from core import RAGRetriever, RiskAssessor, RuleEngine
+from models.base_model import BaseModel, Message, MessageListAdapter, ToolDefinition
+from core import AdaptiveBatcher, RAGRetriever, RiskAssessor, RiskResult, RuleEngine
 from mcp_manager.service_manager import MCPServiceManager
 from mcp_manager.tool_router import ToolRouter
+from utils.cache import TTLCache
+from utils.metrics import (
+    DB_WRITE_SECONDS, MODEL_SECONDS, RAG_SECONDS, RISK_SECONDS, ROUTING_SECONDS,
+    RULES_SECONDS, observe_async
+)
+
+
+# 风险等级对应的提示图标
+_RISK_EMOJI = {"low": "🟢", "medium": "🟡", "high": "🔴"}
 
 
 class MCPOrchestrator:
@@ -35,25 +50,214 @@ class MCPOrchestrator:
         self.model = model
         self.config = config
 
+        # embedding微批处理器：合并并发请求的embedding调用
+        batching_config = config.get("batching", {})
+        self.embedding_batcher = AdaptiveBatcher(
+            model.get_embeddings,
+            max_batch_size=batching_config.get("max_batch_size", 32),
+            max_wait_ms=batching_config.get("max_wait_ms", 5.0),
+            name="embedding"
+        )
+
+        # 历史记录写后即忘队列：批量INSERT后批量写入问题embedding
+        self.history_writer = AdaptiveBatcher(
+            self._write_history_batch,
+            max_batch_size=batching_config.get("history_max_batch_size", 64),
+            max_wait_ms=batching_config.get("history_max_wait_ms", 20.0),
+            name="history_writer"
+        )
+
+        # 单个查询内工具调用的并发上限，避免耗尽数据库连接池
+        self._tool_semaphore = asyncio.Semaphore(batching_config.get("max_concurrent_tools", 8))
+
         # 初始化各组件
-        self.rag_retriever = RAGRetriever(db_manager, model, config)
+        self.rag_retriever = RAGRetriever(
+            db_manager, model, config,
+            embedding_batcher=self.embedding_batcher
+        )
         self.risk_assessor = RiskAssessor(config)
         self.rule_engine = RuleEngine(config)
-        self.service_manager = MCPServiceManager(db_manager, config)
+
+        # 规则检查和风险评估为微秒级同步计算，默认在事件循环内直接执行；
+        # 规则集很大、单次检查明显变慢时可配置放到线程池执行
+        rule_config = config.get("rule_engine", {})
+        self._checks_executor = None
+        if rule_config.get("run_in_executor", False):
+            self._checks_executor = ThreadPoolExecutor(
+                max_workers=rule_config.get("executor_workers", min(32, (os.cpu_count() or 1) * 2)),
+                thread_name_prefix="rule_checks"
+            )
+
+        # 共享HTTP客户端：所有下游MCP服务调用复用连接（HTTP/2 + keep-alive）
+        mcp_config = config.get("mcp_services", {})
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=mcp_config.get("timeout", 10),
+            limits=httpx.Limits(
+                max_connections=mcp_config.get("max_connections", 100),
+                max_keepalive_connections=mcp_config.get("max_keepalive_connections", 50)
+            )
+        )
+
+        self.service_manager = MCPServiceManager(db_manager, config, http_client=self.http_client)
         self.tool_router = ToolRouter(db_manager, config)
 
+        # 路由结果和服务列表的短期缓存（变化频率为分钟级）
+        cache_config = config.get("cache", {})
+        cache_size = cache_config.get("max_size", 1024)
+        cache_ttl = cache_config.get("ttl_seconds", 20)
+        self._routing_cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self._services_cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+
+        # ToolDefinition对象缓存 {(工具名称, 定义指纹): ToolDefinition}
+        # 与路由缓存同样按TTL过期，其他worker或直接改库变更的服务定义最多延迟一个TTL生效
+        self._tool_def_cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        # 工具定义列表缓存，按路由结果中的工具键序列复用整个列表
+        self._tool_defs_cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+
         logger.info("MCP orchestrator initialized")
 
     async def start(self):
         """启动编排器"""
+        await self.embedding_batcher.start()
+        await self.history_writer.start()
         await self.service_manager.start()
         logger.info("MCP orchestrator started")
 
     async def stop(self):
         """停止编排器"""
         await self.service_manager.stop()
+        await self.history_writer.drain()
+        await self.history_writer.stop()
+        await self.embedding_batcher.stop()
+        await self.http_client.aclose()
+        if self._checks_executor:
+            self._checks_executor.shutdown(wait=False)
         logger.info("MCP orchestrator stopped")
 
+    async def _write_history_batch(self, records: List[Dict[str, Any]]) -> List[Optional[int]]:
+        """批量写入工具调用历史及其问题embedding"""
+        with DB_WRITE_SECONDS.time():
+            history_ids = await self.db.create_tool_call_histories_bulk(records)
+
+        # 写入失败的记录（ID为None）不存embedding
+        stored = [(r["user_question"], i) for r, i in zip(records, history_ids) if i is not None]
+        if stored:
+            await self.rag_retriever.store_question_embeddings(
+                user_questions=[q for q, _ in stored],
+                database_ids=[i for _, i in stored]
+            )
+
+        return history_ids
+
+    async def _route_tools(self, user_id: str, user_question: str) -> Dict[str, Any]:
+        """工具路由（带缓存）"""
+        key = hashlib.blake2b(
+            f"{user_id}\x00{user_question}".encode(),
+            digest_size=16
+        ).digest()
+
+        routing_result = self._routing_cache.get(key)
+        if routing_result is None:
+            routing_result = await self.tool_router.route_tools(
+                user_question=user_question,
+                user_id=user_id
+            )
+            self._routing_cache.set(key, routing_result)
+
+        return routing_result
+
+    async def list_services(
+        self,
+        layer: Optional[str] = None,
+        active_only: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        列出MCP服务（带缓存）
+
+        Args:
+            layer: 筛选层级
+            active_only: 是否只返回活跃服务
+
+        Returns:
+            服务列表
+        """
+        key = (layer, active_only)
+        services = self._services_cache.get(key)
+        if services is None:
+            services = await self.service_manager.list_services(
+                layer=layer,
+                active_only=active_only
+            )
+            self._services_cache.set(key, services)
+
+        return services
+
+    async def register_service(self, **kwargs) -> bool:
+        """
+        注册MCP服务，并使路由和服务列表缓存失效
+
+        Args:
+            **kwargs: 透传给 MCPServiceManager.register_service 的参数
+
+        Returns:
+            是否注册成功
+        """
+        success = await self.service_manager.register_service(**kwargs)
+        if success:
+            self._routing_cache.clear()
+            self._services_cache.clear()
+            self._tool_def_cache.clear()
+            self._tool_defs_cache.clear()
+            self.tool_router.invalidate_core_cache()
+        return success
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """获取各级缓存的命中统计"""
+        return {
+            "routing": self._routing_cache.stats(),
+            "services": self._services_cache.stats(),
+            "tool_definitions": self._tool_defs_cache.stats(),
+            "mcp_services": self.db.service_cache_stats(),
+            **self.rag_retriever.cache_stats()
+        }
+
+    def _get_tool_defs(self, tools: List[Dict[str, Any]]) -> List[ToolDefinition]:
+        """获取路由结果对应的ToolDefinition列表，相同工具组合复用同一列表"""
+        functions = [tool.get("function") or tool for tool in tools]
+        keys = [self._tool_def_key(function) for function in functions]
+        signature = tuple(keys)
+
+        tool_defs = self._tool_defs_cache.get(signature)
+        if tool_defs is None:
+            tool_defs = [self._get_tool_def(function, key) for function, key in zip(functions, keys)]
+            self._tool_defs_cache.set(signature, tool_defs)
+
+        return tool_defs
+
+    @staticmethod
+    def _tool_def_key(function: Dict[str, Any]) -> Tuple[Optional[str], bytes]:
+        """
+        ToolDefinition缓存键：工具名称 + 定义内容指纹
+
+        路由结果中的工具不带所属服务，不同服务的同名工具按定义内容区分，
+        服务更新了工具定义时也会得到新的键。
+        """
+        digest = hashlib.blake2b(
+            orjson.dumps(function, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS),
+            digest_size=16
+        ).digest()
+        return function.get("name"), digest
+
+    def _get_tool_def(self, function: Dict[str, Any], key: Tuple[Optional[str], bytes]) -> ToolDefinition:
+        """获取工具对应的ToolDefinition，相同名称和定义复用已构建的对象"""
+        tool_def = self._tool_def_cache.get(key)
+        if tool_def is None:
+            tool_def = ToolDefinition(type="function", function=function)
+            self._tool_def_cache.set(key, tool_def)
+
+        return tool_def
+
     async def process_query(
         self,
         user_id: str,
@@ -81,40 +285,44 @@ class MCPOrchestrator:
             处理结果字典
         """
         request_id = str(uuid.uuid4())
-        logger.info(f"Processing query {request_id}: {user_question[:50]}...")
+        logger.info("Processing query {}: {:.50}...", request_id, user_question)
 
         try:
             # 1. 工具路由 - 选择相关工具
             logger.debug("Step 1: Tool routing")
-            routing_result = await self.tool_router.route_tools(
-                user_question=user_question,
-                user_id=user_id
-            )
+            with ROUTING_SECONDS.time():
+                routing_result = await self._route_tools(user_id, user_question)
 
             available_tools = routing_result["total_tools"]
-            logger.info(f"Routed {len(available_tools)} tools")
+            tool_count = len(available_tools)
+            logger.info("Routed {} tools", tool_count)
+
+            # 3. RAG检索只依赖用户问题：与模型生成并行执行，所有工具调用共享结果
+            logger.debug("Step 3: RAG retrieval")
+            rag_task = self._start_rag_retrieval(user_id, user_question)
 
             # 2. 模型生成 - 生成工具调用草案
             logger.debug("Step 2: Model generation")
-            messages = conversation_context or []
+            # 复制一份再追加，避免修改调用方传入的上下文列表
+            messages = list(conversation_context) if conversation_context else []
             messages.append(Message(role="user", content=user_question))
 
             # 转换工具格式
-            tool_definitions = [
-                ToolDefinition(
-                    type="function",
-                    function=tool.get("function") or tool
-                )
-                for tool in available_tools
-            ]
-
-            model_response = await self.model.generate(
-                messages=messages,
-                tools=tool_definitions if tool_definitions else None
-            )
+            tool_definitions = self._get_tool_defs(available_tools)
+
+            try:
+                with MODEL_SECONDS.time():
+                    model_response = await self.model.generate(
+                        messages=messages,
+                        tools=tool_definitions if tool_definitions else None
+                    )
+            except Exception:
+                rag_task.cancel()
+                raise
 
             # 检查是否有工具调用
             if not model_response.tool_calls:
+                rag_task.cancel()
                 logger.info("No tool calls in response")
                 return {
                     "request_id": request_id,
@@ -123,21 +331,29 @@ class MCPOrchestrator:
                     "tool_calls": None
                 }
 
-            # 处理每个工具调用
-            results = []
-            for tool_call in model_response.tool_calls:
-                result = await self._process_tool_call(
-                    request_id=request_id,
-                    user_id=user_id,
-                    user_question=user_question,
-                    tool_call=tool_call,
-                    conversation_context=conversation_context
-                )
-                results.append(result)
+            similar_cases = await rag_task
+            historical_analysis = self.rag_retriever.analyze_historical_feedback(similar_cases)
 
-            # 如果有任何一个需要确认，整体需要确认
-            requires_confirmation = any(r["requires_confirmation"] for r in results)
-            max_risk_score = max(r["risk_score"] for r in results)
+            # 并发处理每个工具调用
+            results = await self._process_tool_calls(
+                request_id=request_id,
+                user_id=user_id,
+                user_question=user_question,
+                tool_calls=model_response.tool_calls,
+                similar_cases=similar_cases,
+                historical_analysis=historical_analysis,
+                conversation_context=conversation_context
+            )
+
+            # 如果有任何一个需要确认，整体需要确认（单次遍历同时求最大风险分数）
+            requires_confirmation = False
+            max_risk_score = 0.0
+            for r in results:
+                if r["requires_confirmation"]:
+                    requires_confirmation = True
+                risk_score = r["risk_score"]
+                if risk_score > max_risk_score:
+                    max_risk_score = risk_score
 
             return {
                 "request_id": request_id,
@@ -148,7 +364,7 @@ class MCPOrchestrator:
                 "routing_info": {
                     "detected_intents": routing_result["detected_intents"],
                     "active_domains": routing_result["active_domains"],
-                    "tool_count": len(available_tools)
+                    "tool_count": tool_count
                 }
             }
 
@@ -156,53 +372,125 @@ class MCPOrchestrator:
             logger.error(f"Error processing query {request_id}: {e}")
             raise
 
+    async def _process_tool_calls(
+        self,
+        request_id: str,
+        user_id: str,
+        user_question: str,
+        tool_calls: List[Dict[str, Any]],
+        similar_cases: List[Dict[str, Any]],
+        historical_analysis: Dict[str, Any],
+        conversation_context: Optional[List[Message]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        并发处理全部工具调用（受 max_concurrent_tools 限制）
+
+        单个工具调用处理失败不会影响其他调用，失败的调用按最高风险返回并要求确认。
+
+        Args:
+            request_id: 请求ID
+            user_id: 用户ID
+            user_question: 用户问题
+            tool_calls: 工具调用列表
+            similar_cases: RAG检索到的相似案例（所有工具调用共享）
+            historical_analysis: 相似案例的历史反馈分析
+            conversation_context: 对话上下文
+
+        Returns:
+            与 tool_calls 顺序一致的处理结果列表
+        """
+        # 对话上下文在同一查询的所有工具调用间不变，只序列化一次
+        dumped_context = (
+            MessageListAdapter.dump_python(conversation_context, mode="json", exclude_none=True)
+            if conversation_context else None
+        )
+
+        async def bounded(index: int, tool_call: Dict[str, Any]) -> Dict[str, Any]:
+            async with self._tool_semaphore:
+                return await self._process_tool_call(
+                    request_id=request_id,
+                    record_id=self._tool_call_record_id(request_id, index),
+                    user_id=user_id,
+                    user_question=user_question,
+                    tool_call=tool_call,
+                    similar_cases=similar_cases,
+                    historical_analysis=historical_analysis,
+                    dumped_context=dumped_context
+                )
+
+        outcomes = await asyncio.gather(
+            *[bounded(i, tool_call) for i, tool_call in enumerate(tool_calls)],
+            return_exceptions=True
+        )
+
+        results = []
+        for i, (tool_call, outcome) in enumerate(zip(tool_calls, outcomes)):
+            # 取消（CancelledError）、KeyboardInterrupt 等不是处理失败，原样向上抛出
+            if isinstance(outcome, BaseException) and not isinstance(outcome, Exception):
+                raise outcome
+            if isinstance(outcome, Exception):
+                tool_name = tool_call["function"]["name"]
+                logger.error(f"Error processing tool call {tool_name} in {request_id}: {outcome}")
+                outcome = {
+                    "tool_call_id": tool_call["id"],
+                    "record_id": self._tool_call_record_id(request_id, i),
+                    "tool_name": tool_name,
+                    "requires_confirmation": True,
+                    "blocked": False,
+                    "risk_score": 1.0,
+                    "error": str(outcome)
+                }
+            results.append(outcome)
+
+        return results
+
     async def _process_tool_call(
         self,
         request_id: str,
         user_id: str,
         user_question: str,
         tool_call: Dict[str, Any],
-        conversation_context: Optional[List[Message]] = None
+        similar_cases: List[Dict[str, Any]],
+        historical_analysis: Dict[str, Any],
+        dumped_context: Optional[List[Dict[str, Any]]] = None,
+        record_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         处理单个工具调用
 
         Args:
             request_id: 请求ID
+            record_id: 该工具调用的历史记录ID（默认与请求ID相同）
             user_id: 用户ID
             user_question: 用户问题
             tool_call: 工具调用信息
-            conversation_context: 对话上下文
+            similar_cases: RAG检索到的相似案例
+            historical_analysis: 相似案例的历史反馈分析
+            dumped_context: 已序列化的对话上下文
 
         Returns:
             处理结果
         """
+        record_id = record_id or request_id
         tool_name = tool_call["function"]["name"]
-        tool_parameters = eval(tool_call["function"]["arguments"])  # 解析JSON
-
-        logger.debug(f"Processing tool call: {tool_name}")
-
-        # 3. RAG检索 - 检索历史反馈
-        logger.debug("Step 3: RAG retrieval")
-        similar_cases = await self.rag_retriever.retrieve_similar_cases(
-            user_question=user_question,
-            user_id=user_id
-        )
+        tool_parameters = self._parse_tool_arguments(tool_call["function"]["arguments"])
 
-        historical_analysis = self.rag_retriever.analyze_historical_feedback(similar_cases)
+        logger.debug("Processing tool call: {}", tool_name)
 
-        # 4. 规则检查 - 检查黑名单和规则
-        logger.debug("Step 4: Rule checking")
-        rule_result = self.rule_engine.check_tool_call(
+        # 4. 规则检查、5. 风险评估（同一次线程池调用内完成，被阻止时不做风险评估）
+        rule_result, risk_result = await self._run_check(
+            self._check_tool_call,
             tool_name=tool_name,
-            tool_parameters=tool_parameters
+            tool_parameters=tool_parameters,
+            historical_analysis=historical_analysis
         )
 
         # 如果被阻止，直接返回
-        if rule_result.get("blocked"):
+        if risk_result is None:
             logger.warning(f"Tool call blocked: {tool_name}")
             return {
                 "tool_call_id": tool_call["id"],
+                "record_id": record_id,
                 "tool_name": tool_name,
                 "tool_parameters": tool_parameters,
                 "requires_confirmation": False,
@@ -211,71 +499,153 @@ class MCPOrchestrator:
                 "messages": rule_result.get("messages", [])
             }
 
-        # 5. 风险评估 - 综合评估风险
-        logger.debug("Step 5: Risk assessment")
-        risk_result = self.risk_assessor.assess_tool_risk(
-            tool_name=tool_name,
-            tool_parameters=tool_parameters,
-            historical_analysis=historical_analysis,
-            rule_result=rule_result
-        )
-
         # 6. 决策 - 是否需要用户确认
         requires_confirmation = (
-            risk_result["requires_confirmation"] or
+            risk_result.requires_confirmation or
             rule_result.get("force_confirm", False)
         )
 
-        # 7. 生成确认消息（动态prompt注入）
-        confirmation_message = self._generate_confirmation_message(
-            tool_name=tool_name,
-            tool_parameters=tool_parameters,
-            risk_result=risk_result,
-            historical_analysis=historical_analysis,
-            rule_result=rule_result
-        )
+        # 7. 生成确认消息（动态prompt注入，仅在需要确认时生成）
+        confirmation_message = None
+        if requires_confirmation:
+            confirmation_message = self._generate_confirmation_message(
+                tool_name=tool_name,
+                tool_parameters=tool_parameters,
+                risk_result=risk_result,
+                historical_analysis=historical_analysis,
+                rule_result=rule_result
+            )
 
-        # 8. 存储到数据库
-        history = await self.db.create_tool_call_history(
-            request_id=request_id,
-            user_id=user_id,
-            user_question=user_question,
-            tool_name=tool_name,
-            tool_parameters=tool_parameters,
-            risk_score=risk_result["risk_score"],
-            requires_confirmation=requires_confirmation,
-            matched_rules=[r.get("rule_id") for r in rule_result.get("matched_rules", [])],
-            blacklist_hit=rule_result.get("blacklist_hit", False),
-            confirmation_reason=confirmation_message,
-            conversation_context=[m.model_dump() for m in conversation_context] if conversation_context else None,
-            similar_history_ids=[c["history"].id for c in similar_cases]
-        )
+        matched_rule_ids = [r.get("rule_id") for r in rule_result.get("matched_rules", [])]
 
-        # 9. 存储问题embedding
-        vector_id = await self.rag_retriever.store_question_embedding(
-            user_question=user_question,
-            database_id=history.id
-        )
+        # 8. 存储到数据库、9. 存储问题embedding（写后即忘，由后台批量写入）
+        self.history_writer.submit_nowait({
+            "request_id": record_id,
+            "user_id": user_id,
+            "user_question": user_question,
+            "tool_name": tool_name,
+            "tool_parameters": tool_parameters,
+            "risk_score": risk_result.risk_score,
+            "requires_confirmation": requires_confirmation,
+            "matched_rules": matched_rule_ids,
+            "blacklist_hit": rule_result.get("blacklist_hit", False),
+            "confirmation_reason": confirmation_message,
+            "conversation_context": dumped_context,
+            "similar_history_ids": [c["history"].id for c in similar_cases]
+        })
 
         return {
             "tool_call_id": tool_call["id"],
+            "record_id": record_id,
             "tool_name": tool_name,
             "tool_parameters": tool_parameters,
             "requires_confirmation": requires_confirmation,
             "blocked": False,
-            "risk_score": risk_result["risk_score"],
-            "risk_level": risk_result["risk_level"],
+            "risk_score": risk_result.risk_score,
+            "risk_level": risk_result.risk_level,
+            "matched_rules": matched_rule_ids,
             "confirmation_message": confirmation_message,
-            "risk_reasons": risk_result["reasons"],
+            "risk_reasons": risk_result.reasons,
             "historical_insights": historical_analysis.get("common_patterns", []),
             "similar_case_count": len(similar_cases)
         }
 
+    @staticmethod
+    def _tool_call_record_id(request_id: str, index: int) -> str:
+        """
+        工具调用历史记录ID（request_id列唯一）
+
+        第一个工具调用直接使用请求ID，其余追加序号，
+        按请求ID确认/记录结果时会同时作用于该请求的全部工具调用。
+        """
+        return request_id if index == 0 else f"{request_id}:{index}"
+
+    def _check_tool_call(
+        self,
+        tool_name: str,
+        tool_parameters: Dict[str, Any],
+        historical_analysis: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], Optional[RiskResult]]:
+        """
+        规则检查 + 风险评估（同步执行）
+
+        风险评估依赖规则检查结果，两者只能串行；合并为一个函数后
+        每个工具调用只需切换一次线程池。
+
+        Returns:
+            (规则检查结果, 风险评估结果)；被规则阻止时风险评估结果为None
+        """
+        logger.debug("Step 4: Rule checking")
+        with RULES_SECONDS.time():
+            rule_result = self.rule_engine.check_tool_call(
+                tool_name=tool_name,
+                tool_parameters=tool_parameters
+            )
+
+        if rule_result.get("blocked"):
+            return rule_result, None
+
+        logger.debug("Step 5: Risk assessment")
+        with RISK_SECONDS.time():
+            risk_result = self.risk_assessor.assess_tool_risk(
+                tool_name=tool_name,
+                tool_parameters=tool_parameters,
+                historical_analysis=historical_analysis,
+                rule_result=rule_result
+            )
+
+        return rule_result, risk_result
+
+    async def _run_check(self, func, **kwargs) -> Any:
+        """执行同步的规则检查/风险评估，配置了线程池时在线程池中执行"""
+        if self._checks_executor is None:
+            return func(**kwargs)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._checks_executor,
+            functools.partial(func, **kwargs)
+        )
+
+    def _start_rag_retrieval(self, user_id: str, user_question: str) -> asyncio.Task:
+        """在后台启动RAG检索（每个查询只执行一次）"""
+        return asyncio.create_task(observe_async(
+            RAG_SECONDS,
+            self.rag_retriever.retrieve_similar_cases(
+                user_question=user_question,
+                user_id=user_id
+            )
+        ))
+
+    @staticmethod
+    def _parse_tool_arguments(arguments: Any) -> Dict[str, Any]:
+        """
+        解析模型返回的工具参数（JSON字符串或已解析的字典）
+
+        Args:
+            arguments: 工具参数
+
+        Returns:
+            参数字典，无法解析或不是JSON对象时返回空字典
+        """
+        if isinstance(arguments, (str, bytes)):
+            try:
+                arguments = orjson.loads(arguments)
+            except orjson.JSONDecodeError:
+                logger.warning("Invalid tool arguments: {:.100}", arguments)
+                return {}
+
+        if not arguments:
+            return {}
+        if not isinstance(arguments, dict):
+            # 合法JSON但不是对象（如 [1]、5、"x"），后续规则检查和风险评估都按字典处理
+            logger.warning("Tool arguments are not a JSON object: {:.100}", repr(arguments))
+            return {}
+        return arguments
+
     def _generate_confirmation_message(
         self,
         tool_name: str,
         tool_parameters: Dict[str, Any],
-        risk_result: Dict[str, Any],
+        risk_result: RiskResult,
         historical_analysis: Dict[str, Any],
         rule_result: Dict[str, Any]
     ) -> str:
@@ -292,43 +662,36 @@ class MCPOrchestrator:
         Returns:
             确认消息
         """
-        message_parts = []
-
-        # 基础信息
-        message_parts.append(f"准备调用工具: {tool_name}")
-
-        # 参数信息
+        risk_level = risk_result.risk_level
         param_str = ", ".join(f"{k}={v}" for k, v in tool_parameters.items())
-        message_parts.append(f"参数: {param_str}")
 
-        # 风险等级
-        risk_level = risk_result["risk_level"]
-        risk_emoji = {"low": "🟢", "medium": "🟡", "high": "🔴"}.get(risk_level, "⚪")
-        message_parts.append(f"风险等级: {risk_emoji} {risk_level.upper()}")
+        # 基础信息、参数信息、风险等级
+        message_parts = [
+            f"准备调用工具: {tool_name}",
+            f"参数: {param_str}",
+            f"风险等级: {_RISK_EMOJI.get(risk_level, '⚪')} {risk_level.upper()}"
+        ]
 
         # 风险原因
-        if risk_result.get("reasons"):
+        reasons = risk_result.reasons
+        if reasons:
             message_parts.append("风险分析:")
-            for reason in risk_result["reasons"]:
-                message_parts.append(f"  - {reason}")
+            message_parts.extend(f"  - {reason}" for reason in reasons)
 
         # 历史反馈（动态prompt注入）
         if historical_analysis.get("has_history"):
-            message_parts.append(f"\n根据您过去的使用记录:")
-
-            if historical_analysis.get("common_patterns"):
-                for pattern in historical_analysis["common_patterns"]:
-                    message_parts.append(f"  - {pattern}")
-
-            if historical_analysis.get("user_preferences"):
-                for pref in historical_analysis["user_preferences"]:
-                    message_parts.append(f"  - {pref}")
+            message_parts.append("\n根据您过去的使用记录:")
+            message_parts.extend(
+                f"  - {item}"
+                for key in ("common_patterns", "user_preferences")
+                for item in historical_analysis.get(key) or ()
+            )
 
         # 规则提示
-        if rule_result.get("matched_rules"):
+        matched_rules = rule_result.get("matched_rules")
+        if matched_rules:
             message_parts.append("\n触发的安全规则:")
-            for rule in rule_result["matched_rules"][:2]:
-                message_parts.append(f"  - {rule.get('name', 'Unknown')}")
+            message_parts.extend(f"  - {rule.get('name', 'Unknown')}" for rule in matched_rules[:2])
 
         message_parts.append("\n是否确认执行此操作？")
 
@@ -353,7 +716,7 @@ class MCPOrchestrator:
         Returns:
             确认结果
         """
-        logger.info(f"Tool call {request_id} confirmed: {confirmed}")
+        logger.info("Tool call {} confirmed: {}", request_id, confirmed)
 
         # 更新数据库
         success = await self.db.update_tool_call_confirmation(
@@ -362,6 +725,15 @@ class MCPOrchestrator:
             user_feedback=feedback
         )
 
+        if not success:
+            # 记录可能仍在写后即忘队列中，等待写入后重试
+            await self.history_writer.drain()
+            success = await self.db.update_tool_call_confirmation(
+                request_id=request_id,
+                user_confirmed=confirmed,
+                user_feedback=feedback
+            )
+
         if not success:
             logger.error(f"Failed to update confirmation for {request_id}")
             return {"success": False, "message": "Request not found"}
@@ -393,13 +765,22 @@ class MCPOrchestrator:
             execution_success: 执行是否成功
             execution_result: 执行结果
         """
-        await self.db.update_tool_call_execution(
+        success = await self.db.update_tool_call_execution(
             request_id=request_id,
             execution_success=execution_success,
             execution_result=execution_result
         )
 
-        logger.info(f"Recorded execution result for {request_id}: {execution_success}")
+        if not success:
+            # 记录可能仍在写后即忘队列中，等待写入后重试
+            await self.history_writer.drain()
+            await self.db.update_tool_call_execution(
+                request_id=request_id,
+                execution_success=execution_success,
+                execution_result=execution_result
+            )
+
+        logger.info("Recorded execution result for {}: {}", request_id, execution_success)
 
     async def process_query_stream(
         self,
@@ -419,8 +800,9 @@ class MCPOrchestrator:
             Dict[str, Any]: 流式响应数据
         """
         request_id = str(uuid.uuid4())
-        logger.info(f"Processing stream query {request_id}: {user_question[:50]}...")
+        logger.info("Processing stream query {}: {:.50}...", request_id, user_question)
 
+        rag_task = None
         try:
             # 步骤1: 工具路由
             yield {
@@ -430,12 +812,13 @@ class MCPOrchestrator:
                 'request_id': request_id
             }
 
-            routing_result = await self.tool_router.route_tools(
-                user_question=user_question,
-                user_id=user_id
-            )
+            routing_result = await self._route_tools(user_id, user_question)
 
             available_tools = routing_result["total_tools"]
+
+            # RAG检索与模型生成并行执行，所有工具调用共享结果
+            rag_task = self._start_rag_retrieval(user_id, user_question)
+
             yield {
                 'type': 'routing_complete',
                 'message': f'✅ 发现 {len(available_tools)} 个相关工具',
@@ -451,57 +834,39 @@ class MCPOrchestrator:
                 'message': '🤖 AI正在分析并生成回复...'
             }
 
-            messages = conversation_context or []
+            # 复制一份再追加，避免修改调用方传入的上下文列表
+            messages = list(conversation_context) if conversation_context else []
             messages.append(Message(role="user", content=user_question))
 
             # 转换工具格式
-            tool_definitions = [
-                ToolDefinition(
-                    type="function",
-                    function=tool.get("function") or tool
-                )
-                for tool in available_tools
-            ]
-
-            # 检查是否支持流式生成
-            if hasattr(self.model, 'generate_stream'):
-                # 流式模型生成
-                content_buffer = ""
-                async for chunk in self.model.generate_stream(
-                    messages=messages,
-                    tools=tool_definitions if tool_definitions else None
-                ):
+            tool_definitions = self._get_tool_defs(available_tools)
+
+            # 流式模型生成：文本片段实时推送，工具调用由流内分片拼装，无需再调用一次generate
+            content_buffer = ""
+            model_response = None
+            async for event in self.model.generate_stream_events(
+                messages=messages,
+                tools=tool_definitions if tool_definitions else None
+            ):
+                if event["type"] == "content_delta":
+                    chunk = event["content"]
                     content_buffer += chunk
                     yield {
                         'type': 'model_stream',
                         'chunk': chunk,
                         'content': content_buffer
                     }
+                elif event["type"] == "done":
+                    model_response = event["response"]
 
-                # 使用缓冲的内容来模拟完整响应
-                # 注意：这里需要解析工具调用，实际实现可能需要更复杂的逻辑
-                model_response = await self.model.generate(
-                    messages=messages,
-                    tools=tool_definitions if tool_definitions else None
-                )
+            if model_response is None:
+                raise RuntimeError("Model stream ended without a final response")
 
-                yield {
-                    'type': 'model_complete',
-                    'content': model_response.content,
-                    'has_tool_calls': model_response.tool_calls is not None
-                }
-            else:
-                # 非流式模型生成
-                model_response = await self.model.generate(
-                    messages=messages,
-                    tools=tool_definitions if tool_definitions else None
-                )
-
-                yield {
-                    'type': 'model_complete',
-                    'content': model_response.content,
-                    'has_tool_calls': model_response.tool_calls is not None
-                }
+            yield {
+                'type': 'model_complete',
+                'content': model_response.content,
+                'has_tool_calls': model_response.tool_calls is not None
+            }
 
             # 检查是否有工具调用
             if not model_response.tool_calls:
@@ -521,40 +886,42 @@ class MCPOrchestrator:
                 'message': f'🔧 正在处理 {len(model_response.tool_calls)} 个工具调用...'
             }
 
-            results = []
-            for i, tool_call in enumerate(model_response.tool_calls):
+            similar_cases = await rag_task
+            historical_analysis = self.rag_retriever.analyze_historical_feedback(similar_cases)
+
+            # 并发完成全部工具调用的处理（含历史记录写入），再按顺序推送各步骤事件
+            results = await self._process_tool_calls(
+                request_id=request_id,
+                user_id=user_id,
+                user_question=user_question,
+                tool_calls=model_response.tool_calls,
+                similar_cases=similar_cases,
+                historical_analysis=historical_analysis,
+                conversation_context=conversation_context
+            )
+
+            total_tools = len(results)
+            for i, result in enumerate(results):
                 yield {
                     'type': 'tool_analysis',
                     'tool_index': i + 1,
-                    'total_tools': len(model_response.tool_calls),
-                    'tool_name': tool_call["function"]["name"],
-                    'message': f'🛠️ 分析工具调用 {i + 1}/{len(model_response.tool_calls)}: {tool_call["function"]["name"]}'
+                    'total_tools': total_tools,
+                    'tool_name': result["tool_name"],
+                    'message': f'🛠️ 分析工具调用 {i + 1}/{total_tools}: {result["tool_name"]}'
                 }
 
-                # 流式处理单个工具调用
-                async for chunk in self._process_tool_call_stream(
-                    request_id=request_id,
-                    user_id=user_id,
-                    user_question=user_question,
-                    tool_call=tool_call,
-                    conversation_context=conversation_context,
-                    tool_index=i + 1
-                ):
-                    yield chunk
+                for event in self._tool_call_events(result, i + 1, historical_analysis):
+                    yield event
 
-                # 获取处理结果
-                result = await self._process_tool_call(
-                    request_id=request_id,
-                    user_id=user_id,
-                    user_question=user_question,
-                    tool_call=tool_call,
-                    conversation_context=conversation_context
-                )
-                results.append(result)
-
-            # 最终结果
-            requires_confirmation = any(r["requires_confirmation"] for r in results)
-            max_risk_score = max(r["risk_score"] for r in results)
+            # 最终结果（单次遍历同时求是否需要确认和最大风险分数）
+            requires_confirmation = False
+            max_risk_score = 0.0
+            for r in results:
+                if r["requires_confirmation"]:
+                    requires_confirmation = True
+                risk_score = r["risk_score"]
+                if risk_score > max_risk_score:
+                    max_risk_score = risk_score
 
             yield {
                 'type': 'complete',
@@ -580,34 +947,39 @@ class MCPOrchestrator:
                 'message': f'❌ 处理过程中出现错误: {str(e)}'
             }
 
-    async def _process_tool_call_stream(
-        self,
-        request_id: str,
-        user_id: str,
-        user_question: str,
-        tool_call: Dict[str, Any],
-        conversation_context: Optional[List[Message]] = None,
-        tool_index: int = 1
-    ) -> AsyncGenerator[Dict[str, Any], None]:
+        finally:
+            # 无工具调用、出错或客户端断开（GeneratorExit/CancelledError）时都不再需要检索结果
+            if rag_task is not None and not rag_task.done():
+                rag_task.cancel()
+
+    @staticmethod
+    def _tool_call_events(
+        result: Dict[str, Any],
+        tool_index: int,
+        historical_analysis: Dict[str, Any]
+    ) -> Iterator[Dict[str, Any]]:
         """
-        流式处理单个工具调用
+        由单个工具调用的处理结果生成流式步骤事件（不重复执行检索、规则和风险评估）
 
         Args:
-            request_id: 请求ID
-            user_id: 用户ID
-            user_question: 用户问题
-            tool_call: 工具调用信息
-            conversation_context: 对话上下文
+            result: _process_tool_call 的处理结果
             tool_index: 工具索引
+            historical_analysis: 相似案例的历史反馈分析
 
         Yields:
             Dict[str, Any]: 流式处理数据
         """
-        tool_name = tool_call["function"]["name"]
-        try:
-            tool_parameters = eval(tool_call["function"]["arguments"])  # 解析JSON
-        except:
-            tool_parameters = {}
+        tool_name = result["tool_name"]
+
+        if "error" in result:
+            yield {
+                'type': 'tool_error',
+                'tool_index': tool_index,
+                'tool_name': tool_name,
+                'error': result["error"],
+                'message': '❌ 工具调用处理失败，需要用户确认'
+            }
+            return
 
         # RAG检索
         yield {
@@ -617,19 +989,13 @@ class MCPOrchestrator:
             'message': '📚 检索相似历史案例...'
         }
 
-        similar_cases = await self.rag_retriever.retrieve_similar_cases(
-            user_question=user_question,
-            user_id=user_id
-        )
-
-        historical_analysis = self.rag_retriever.analyze_historical_feedback(similar_cases)
-
+        similar_case_count = result.get("similar_case_count", 0)
         yield {
             'type': 'rag_complete',
             'tool_index': tool_index,
-            'similar_cases_count': len(similar_cases),
+            'similar_cases_count': similar_case_count,
             'has_history': historical_analysis.get("has_history", False),
-            'message': f'✅ 找到 {len(similar_cases)} 个相似案例'
+            'message': f'✅ 找到 {similar_case_count} 个相似案例'
         }
 
         # 规则检查
@@ -640,17 +1006,12 @@ class MCPOrchestrator:
             'message': '🛡️ 检查安全规则...'
         }
 
-        rule_result = self.rule_engine.check_tool_call(
-            tool_name=tool_name,
-            tool_parameters=tool_parameters
-        )
-
-        if rule_result.get("blocked"):
+        if result["blocked"]:
             yield {
                 'type': 'rule_blocked',
                 'tool_index': tool_index,
                 'tool_name': tool_name,
-                'messages': rule_result.get("messages", []),
+                'messages': result.get("messages", []),
                 'message': '❌ 操作被安全规则阻止'
             }
             return
@@ -658,7 +1019,7 @@ class MCPOrchestrator:
         yield {
             'type': 'rule_complete',
             'tool_index': tool_index,
-            'matched_rules': len(rule_result.get("matched_rules", [])),
+            'matched_rules': len(result.get("matched_rules", [])),
             'message': '✅ 安全规则检查通过'
         }
 
@@ -670,47 +1031,27 @@ class MCPOrchestrator:
             'message': '⚖️ 评估操作风险...'
         }
 
-        risk_result = self.risk_assessor.assess_tool_risk(
-            tool_name=tool_name,
-            tool_parameters=tool_parameters,
-            historical_analysis=historical_analysis,
-            rule_result=rule_result
-        )
-
-        requires_confirmation = (
-            risk_result["requires_confirmation"] or
-            rule_result.get("force_confirm", False)
-        )
-
-        risk_level = risk_result["risk_level"]
-        risk_emoji = {"low": "🟢", "medium": "🟡", "high": "🔴"}.get(risk_level, "⚪")
+        risk_level = result["risk_level"]
+        risk_score = result["risk_score"]
+        risk_emoji = _RISK_EMOJI.get(risk_level, "⚪")
 
         yield {
             'type': 'risk_complete',
             'tool_index': tool_index,
             'tool_name': tool_name,
-            'tool_parameters': tool_parameters,
-            'risk_score': risk_result["risk_score"],
+            'tool_parameters': result["tool_parameters"],
+            'risk_score': risk_score,
             'risk_level': risk_level,
-            'requires_confirmation': requires_confirmation,
-            'risk_reasons': risk_result["reasons"],
-            'message': f'{risk_emoji} 风险评估完成: {risk_level.upper()} ({risk_result["risk_score"]:.2f})'
+            'requires_confirmation': result["requires_confirmation"],
+            'risk_reasons': result["risk_reasons"],
+            'message': f'{risk_emoji} 风险评估完成: {risk_level.upper()} ({risk_score:.2f})'
         }
 
-        if requires_confirmation:
-            # 生成确认消息
-            confirmation_message = self._generate_confirmation_message(
-                tool_name=tool_name,
-                tool_parameters=tool_parameters,
-                risk_result=risk_result,
-                historical_analysis=historical_analysis,
-                rule_result=rule_result
-            )
-
+        if result["requires_confirmation"]:
             yield {
                 'type': 'confirmation_required',
                 'tool_index': tool_index,
                 'tool_name': tool_name,
-                'confirmation_message': confirmation_message,
+                'confirmation_message': result["confirmation_message"],
                 'message': '⚠️ 需要用户确认'
             }
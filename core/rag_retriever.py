@@ -1,11 +1,18 @@
 """
 RAG检索引擎 - 基于历史数据检索相似案例
 """
+import asyncio
+import hashlib
+import heapq
+import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
 from loguru import logger
 
 from database import DatabaseManager
 from models.base_model import BaseModel
+from core.batcher import AdaptiveBatcher
+from utils.cache import TTLCache
+from utils.semantic_cache import SemanticCache
 
 
 class RAGRetriever:
@@ -15,7 +22,8 @@ class RAGRetriever:
         self,
         db_manager: DatabaseManager,
         model: BaseModel,
-        config: Dict[str, Any]
+        config: Dict[str, Any],
+        embedding_batcher: Optional[AdaptiveBatcher] = None
     ):
         """
         初始化RAG检索器
@@ -24,14 +32,48 @@ class RAGRetriever:
             db_manager: 数据库管理器
             model: 模型实例（用于生成embedding）
             config: RAG配置
+            embedding_batcher: embedding批处理器（可选，合并并发的embedding请求）
         """
         self.db = db_manager
         self.model = model
+        self.embedding_batcher = embedding_batcher
         self.config = config.get("rag", {})
 
         self.top_k = self.config.get("top_k", 5)
         self.similarity_threshold = self.config.get("similarity_threshold", 0.75)
 
+        # 相似度阈值换算为L2距离上限（similarity = 1 / (1 + distance)），在Faiss结果上直接过滤
+        self.max_distance = (
+            1.0 / self.similarity_threshold - 1.0 if self.similarity_threshold > 0 else None
+        )
+
+        # 问题embedding缓存（按问题内容哈希，同一文本的embedding不变，无需过期）
+        # 以float32数组存储，单条内存约为Python浮点列表的1/8
+        self._emb_cache = TTLCache(
+            max_size=self.config.get("embedding_cache_size", 10000),
+            ttl=None
+        )
+        # 正在计算中的embedding，同一问题的并发请求共享一次模型调用
+        self._emb_inflight: Dict[bytes, asyncio.Future] = {}
+
+        # 检索结果缓存（按用户+归一化问题），新的embedding入库后整体失效
+        self._result_cache = TTLCache(
+            max_size=self.config.get("result_cache_size", 2048),
+            ttl=self.config.get("result_cache_ttl", 60)
+        )
+
+        # 语义缓存：措辞不同但embedding相近的问题复用检索结果
+        semantic_config = self.config.get("semantic_cache", {})
+        self._semantic_cache = None
+        if semantic_config.get("enabled", True):
+            self._semantic_cache = SemanticCache(
+                max_size=semantic_config.get("max_size", 2048),
+                num_tables=semantic_config.get("num_tables", 4),
+                num_bits=semantic_config.get("num_bits", 12),
+                threshold=semantic_config.get("threshold", 0.95),
+                ttl=self.config.get("result_cache_ttl", 60)
+            )
+
         logger.info(f"RAG retriever initialized: top_k={self.top_k}, threshold={self.similarity_threshold}")
 
     async def retrieve_similar_cases(
@@ -49,63 +91,163 @@ class RAGRetriever:
         Returns:
             相似案例列表，每个案例包含历史记录和相似度分数
         """
+        cache_key = self._result_key(user_question, user_id)
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             # 1. 生成问题的embedding
-            logger.debug(f"Generating embedding for question: {user_question[:50]}...")
-            embedding = await self.model.get_embedding(user_question)
+            logger.debug("Generating embedding for question: {:.50}...", user_question)
+            embedding = await self._get_embedding(user_question)
+
+            if self._semantic_cache is not None:
+                cached = self._semantic_cache.get(embedding, scope=user_id)
+                if cached is not None:
+                    self._result_cache.set(cache_key, cached)
+                    return cached
 
             # 2. 在Faiss中搜索相似向量
-            logger.debug(f"Searching similar vectors in Faiss...")
-            similar_vectors = self.db.faiss.search(embedding, self.top_k * 2)  # 多检索一些，后续过滤
+            logger.debug("Searching similar vectors in Faiss...")
+            similar_vectors = self.db.faiss.search(
+                embedding,
+                self.top_k * 2,  # 多检索一些，后续按用户过滤
+                max_distance=self.max_distance
+            )
 
             if not similar_vectors:
                 logger.info("No similar cases found in Faiss")
+                self._result_cache.set(cache_key, [])
                 return []
 
-            # 3. 从PostgreSQL获取完整记录
+            # 3. 从PostgreSQL获取完整记录（用户过滤在数据库中完成）
             database_ids = [db_id for db_id, _ in similar_vectors]
-            logger.debug(f"Fetching {len(database_ids)} records from PostgreSQL...")
-            histories = await self.db.get_history_by_ids(database_ids)
+            logger.debug("Fetching {} records from PostgreSQL...", len(database_ids))
+            histories = await self.db.get_history_by_ids(database_ids, user_id=user_id)
 
-            # 4. 构建结果，计算相似度并过滤
+            # 4. 构建结果，计算相似度（阈值已在Faiss结果上过滤）
+            dist_by_id = dict(similar_vectors)
             results = []
             for history in histories:
                 # 找到对应的距离（L2距离）
-                distance = next(
-                    (dist for db_id, dist in similar_vectors if db_id == history.id),
-                    float('inf')
-                )
+                distance = dist_by_id.get(history.id, float('inf'))
 
                 # 将L2距离转换为相似度分数 (0-1，越高越相似)
                 # 使用公式: similarity = 1 / (1 + distance)
                 similarity_score = 1.0 / (1.0 + distance)
 
-                # 应用相似度阈值
-                if similarity_score < self.similarity_threshold:
-                    continue
-
-                # 可选：只返回该用户的历史
-                if user_id and history.user_id != user_id:
-                    continue
-
                 results.append({
                     "history": history,
                     "similarity_score": similarity_score,
                     "distance": distance
                 })
 
-            # 5. 按相似度排序并限制数量
-            results.sort(key=lambda x: x["similarity_score"], reverse=True)
-            results = results[:self.top_k]
+            # 5. 按相似度取前top_k个
+            results = heapq.nlargest(self.top_k, results, key=lambda x: x["similarity_score"])
 
-            logger.info(f"Retrieved {len(results)} similar cases (threshold={self.similarity_threshold})")
+            logger.info("Retrieved {} similar cases (threshold={})", len(results), self.similarity_threshold)
 
+            self._result_cache.set(cache_key, results)
+            if self._semantic_cache is not None:
+                self._semantic_cache.set(embedding, results, scope=user_id)
             return results
 
         except Exception as e:
             logger.error(f"Error retrieving similar cases: {e}")
             return []
 
+    @staticmethod
+    def _result_key(user_question: str, user_id: Optional[str]) -> bytes:
+        """检索结果缓存键"""
+        normalized = f"{user_id or ''}\x1f{user_question.strip().lower()}"
+        return hashlib.blake2b(normalized.encode(), digest_size=16).digest()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """获取检索相关缓存的统计信息"""
+        return {
+            "embedding": self._emb_cache.stats(),
+            "result": self._result_cache.stats(),
+            "semantic": self._semantic_cache.stats() if self._semantic_cache is not None else None
+        }
+
+    def _invalidate_results(self):
+        """新的embedding入库后，使检索结果缓存失效"""
+        self._result_cache.clear()
+        if self._semantic_cache is not None:
+            self._semantic_cache.clear()
+
+    @staticmethod
+    def _embedding_key(text: str) -> bytes:
+        """embedding缓存键"""
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    async def _get_embedding(self, text: str) -> np.ndarray:
+        """生成文本embedding（float32数组），优先读缓存，配置了批处理器时走批量通道"""
+        key = self._embedding_key(text)
+        embedding = self._emb_cache.get(key)
+        if embedding is not None:
+            return embedding
+
+        inflight = self._emb_inflight.get(key)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # 发起方被取消时自行计算；自身被取消则继续向上抛出
+                if not inflight.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._emb_inflight[key] = future
+        try:
+            if self.embedding_batcher:
+                embedding = await self.embedding_batcher.submit(text)
+            else:
+                embedding = await self.model.get_embedding(text)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时取走异常，避免"exception was never retrieved"警告
+            future.exception()
+            raise
+        finally:
+            if self._emb_inflight.get(key) is future:
+                del self._emb_inflight[key]
+
+        embedding = np.asarray(embedding, dtype=np.float32)
+        self._emb_cache.set(key, embedding)
+        future.set_result(embedding)
+        return embedding
+
+    async def _get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """批量生成文本embedding，仅对未命中缓存的文本调用模型"""
+        keys = [self._embedding_key(text) for text in texts]
+        embeddings = [self._emb_cache.get(key) for key in keys]
+
+        # 正在由检索路径计算的embedding直接等待其结果
+        for i, embedding in enumerate(embeddings):
+            inflight = self._emb_inflight.get(keys[i]) if embedding is None else None
+            if inflight is None:
+                continue
+            try:
+                embeddings[i] = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+            except Exception:
+                pass
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = await self.model.get_embeddings([texts[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = np.asarray(embedding, dtype=np.float32)
+                self._emb_cache.set(keys[i], embeddings[i])
+
+        return embeddings
+
     async def store_question_embedding(
         self,
         user_question: str,
@@ -123,12 +265,13 @@ class RAGRetriever:
         """
         try:
             # 生成embedding
-            embedding = await self.model.get_embedding(user_question)
+            embedding = await self._get_embedding(user_question)
 
             # 存入Faiss
             vector_id = self.db.faiss.add_vector(embedding, database_id)
+            self._invalidate_results()
 
-            logger.debug(f"Stored embedding: vector_id={vector_id}, db_id={database_id}")
+            logger.debug("Stored embedding: vector_id={}, db_id={}", vector_id, database_id)
 
             return vector_id
 
@@ -136,6 +279,35 @@ class RAGRetriever:
             logger.error(f"Error storing embedding: {e}")
             return -1
 
+    async def store_question_embeddings(
+        self,
+        user_questions: List[str],
+        database_ids: List[int]
+    ) -> List[int]:
+        """
+        批量存储问题的embedding到Faiss（单次批量embedding调用）
+
+        Args:
+            user_questions: 用户问题列表
+            database_ids: 对应的数据库记录ID列表
+
+        Returns:
+            与输入顺序一致的Faiss向量ID列表，失败的条目为-1
+        """
+        try:
+            embeddings = await self._get_embeddings(user_questions)
+
+            vector_ids = self.db.faiss.add_vectors(embeddings, database_ids)
+            self._invalidate_results()
+
+            logger.debug("Stored {} embeddings", len(vector_ids))
+
+            return vector_ids
+
+        except Exception as e:
+            logger.error(f"Error storing embeddings: {e}")
+            return [-1] * len(database_ids)
+
     def analyze_historical_feedback(
         self,
         similar_cases: List[Dict[str, Any]]
@@ -165,29 +337,21 @@ class RAGRetriever:
             "user_preferences": []
         }
 
-        # 统计高风险案例
-        high_risk_count = 0
-        confirmed_count = 0
-        rejected_count = 0
-        failed_count = 0
-
-        for case in similar_cases:
-            history = case["history"]
-
-            # 风险统计
-            if history.risk_score and history.risk_score > 0.7:
-                high_risk_count += 1
-
-            # 用户反馈统计
-            if history.user_confirmed is not None:
-                if history.user_confirmed:
-                    confirmed_count += 1
-                else:
-                    rejected_count += 1
+        # 按列提取后向量化统计：风险分数、用户反馈（1确认/-1拒绝/0未反馈）、执行失败
+        histories = [case["history"] for case in similar_cases]
+        count = len(histories)
+        risk = np.fromiter((h.risk_score or 0.0 for h in histories), dtype=np.float32, count=count)
+        confirmed = np.fromiter(
+            (0 if h.user_confirmed is None else (1 if h.user_confirmed else -1) for h in histories),
+            dtype=np.int8,
+            count=count
+        )
+        failed = np.fromiter((h.execution_success is False for h in histories), dtype=bool, count=count)
 
-            # 执行结果统计
-            if history.execution_success is False:
-                failed_count += 1
+        high_risk_count = int((risk > 0.7).sum())
+        confirmed_count = int((confirmed == 1).sum())
+        rejected_count = int((confirmed == -1).sum())
+        failed_count = int(failed.sum())
 
         # 判断风险指示
         if high_risk_count > len(similar_cases) / 2:
@@ -220,8 +384,8 @@ class RAGRetriever:
             analysis["user_preferences"].append("用户通常会拒绝此类操作")
 
         logger.info(
-            f"Historical analysis: risk={analysis['risk_indication']}, "
-            f"patterns={len(analysis['common_patterns'])}"
+            "Historical analysis: risk={}, patterns={}",
+            analysis["risk_indication"], len(analysis["common_patterns"])
         )
 
         return analysis
@@ -1,10 +1,44 @@
 """
 风险评估引擎 - 综合评估工具调用的风险
 """
-from typing import Dict, Any, List, Optional
+import functools
+import re
+from typing import Dict, Any, List, NamedTuple, Optional
 from loguru import logger
 
 
+# 各项风险分数的权重（基础、参数、历史、规则）
+_BASE_WEIGHT = 0.3
+_PARAM_WEIGHT = 0.2
+_HISTORY_WEIGHT = 0.3
+_RULE_WEIGHT = 0.2
+
+# 敏感参数模式（参数名或参数值包含其一即计为一个风险指标）
+_SENSITIVE_PATTERNS = (
+    "password", "secret", "token", "key", "credential",
+    "root", "admin", "system", "sudo",
+    "*", "all", "recursive", "force"
+)
+_SENSITIVE_RE = re.compile("|".join(map(re.escape, _SENSITIVE_PATTERNS)), re.IGNORECASE)
+
+
+class RiskBreakdown(NamedTuple):
+    """各项风险分数"""
+    base_risk: float
+    parameter_risk: float
+    historical_risk: float
+    rule_risk: float
+
+
+class RiskResult(NamedTuple):
+    """风险评估结果"""
+    risk_score: float
+    risk_level: str
+    requires_confirmation: bool
+    breakdown: RiskBreakdown
+    reasons: List[str]
+
+
 class RiskAssessor:
     """风险评估器"""
 
@@ -50,6 +84,13 @@ class RiskAssessor:
             "query": 0.2,
         }
 
+        # 关键词一次性编译为单个正则：前瞻匹配可在一次扫描中找出所有（含重叠）命中，
+        # 同一位置按风险从高到低尝试，保证取到该位置的最高风险关键词
+        self._keyword_re = self._compile_keyword_pattern(self.tool_risk_levels)
+
+        # 基础风险只取决于工具名称，按工具名称缓存（绑定到实例，随配置重建）
+        self._base_risk_cached = functools.lru_cache(maxsize=4096)(self._base_risk_impl)
+
         logger.info(
             f"Risk assessor initialized: confirmation_threshold={self.confirmation_threshold}"
         )
@@ -60,7 +101,7 @@ class RiskAssessor:
         tool_parameters: Dict[str, Any],
         historical_analysis: Optional[Dict[str, Any]] = None,
         rule_result: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, Any]:
+    ) -> RiskResult:
         """
         综合评估工具调用风险
 
@@ -71,9 +112,19 @@ class RiskAssessor:
             rule_result: 规则引擎检查结果
 
         Returns:
-            风险评估结果字典
+            风险评估结果
         """
-        logger.debug(f"Assessing risk for tool: {tool_name}")
+        logger.debug("Assessing risk for tool: {}", tool_name)
+
+        # 命中黑名单直接判为最高风险，无需计算其余分数
+        if rule_result and rule_result.get("blacklist_hit"):
+            return RiskResult(
+                risk_score=1.0,
+                risk_level="high",
+                requires_confirmation=True,
+                breakdown=RiskBreakdown(0.0, 0.0, 0.0, 1.0),
+                reasons=["该操作命中黑名单规则，禁止执行"]
+            )
 
         # 1. 基础风险分数（基于工具名称）
         base_score = self._calculate_base_risk(tool_name)
@@ -88,18 +139,11 @@ class RiskAssessor:
         rule_score = self._calculate_rule_risk(rule_result)
 
         # 5. 综合计算（加权平均）
-        weights = {
-            "base": 0.3,
-            "param": 0.2,
-            "history": 0.3,
-            "rule": 0.2
-        }
-
         final_score = (
-            base_score * weights["base"] +
-            param_score * weights["param"] +
-            history_score * weights["history"] +
-            rule_score * weights["rule"]
+            base_score * _BASE_WEIGHT +
+            param_score * _PARAM_WEIGHT +
+            history_score * _HISTORY_WEIGHT +
+            rule_score * _RULE_WEIGHT
         )
 
         # 确保分数在0-1之间
@@ -122,69 +166,56 @@ class RiskAssessor:
             historical_analysis, rule_result
         )
 
-        result = {
-            "risk_score": final_score,
-            "risk_level": risk_level,
-            "requires_confirmation": requires_confirmation,
-            "breakdown": {
-                "base_risk": base_score,
-                "parameter_risk": param_score,
-                "historical_risk": history_score,
-                "rule_risk": rule_score
-            },
-            "reasons": reasons
-        }
+        result = RiskResult(
+            risk_score=final_score,
+            risk_level=risk_level,
+            requires_confirmation=requires_confirmation,
+            breakdown=RiskBreakdown(base_score, param_score, history_score, rule_score),
+            reasons=reasons
+        )
 
         logger.info(
-            f"Risk assessment: score={final_score:.2f}, level={risk_level}, "
-            f"confirmation={requires_confirmation}"
+            "Risk assessment: score={:.2f}, level={}, confirmation={}",
+            final_score, risk_level, requires_confirmation
         )
 
         return result
 
     def _calculate_base_risk(self, tool_name: str) -> float:
-        """计算基础风险分数（基于工具名称）"""
-        tool_name_lower = tool_name.lower()
+        """计算基础风险分数（基于工具名称，结果按工具名称缓存）"""
+        return self._base_risk_cached(tool_name)
 
-        # 检查是否包含高风险关键词
-        for keyword, risk in self.tool_risk_levels.items():
-            if keyword in tool_name_lower:
-                return risk
+    def _base_risk_impl(self, tool_name: str) -> float:
+        """计算基础风险分数（未缓存）"""
+        # 单次扫描工具名，取命中关键词中的最高风险
+        hits = self._keyword_re.findall(tool_name.lower())
+        if hits:
+            return max(self.tool_risk_levels[keyword] for keyword in hits)
 
         # 默认中等风险
         return 0.3
 
+    @staticmethod
+    def _compile_keyword_pattern(risk_levels: Dict[str, float]) -> "re.Pattern":
+        """将风险关键词编译为支持重叠匹配的单个正则"""
+        keywords = sorted(risk_levels, key=lambda k: (-risk_levels[k], -len(k)))
+        alternation = "|".join(re.escape(k) for k in keywords)
+        return re.compile(f"(?=({alternation}))")
+
     def _calculate_parameter_risk(self, parameters: Dict[str, Any]) -> float:
         """计算参数风险分数"""
         if not parameters:
             return 0.0
 
-        risk_score = 0.0
-        risk_indicators = 0
-
-        # 检查敏感参数
-        sensitive_patterns = [
-            "password", "secret", "token", "key", "credential",
-            "root", "admin", "system", "sudo",
-            "*", "all", "recursive", "force"
-        ]
-
-        for key, value in parameters.items():
-            key_lower = str(key).lower()
-            value_str = str(value).lower() if value is not None else ""
-
-            # 检查参数名和值
-            for pattern in sensitive_patterns:
-                if pattern in key_lower or pattern in value_str:
-                    risk_indicators += 1
-                    risk_score += 0.3
-                    break
+        # 检查参数名和值：每个参数一次正则扫描（模式中不含"="，不会跨越名值边界误匹配）
+        search = _SENSITIVE_RE.search
+        risk_indicators = sum(
+            1 for key, value in parameters.items()
+            if search(f"{key}={value if value is not None else ''}")
+        )
 
         # 归一化
-        if risk_indicators > 0:
-            risk_score = min(risk_score, 1.0)
-
-        return risk_score
+        return min(0.3 * risk_indicators, 1.0)
 
     def _calculate_historical_risk(
         self,
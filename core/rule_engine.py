@@ -1,11 +1,20 @@
 """
 规则引擎 - 基于规则检查工具调用
 """
-import json
 import re
-from typing import Dict, Any, List, Optional
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import orjson
 from loguru import logger
 
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# 不含行内标志的模式解析后的标志位（用于识别 (?i) 等全局行内标志）
+_DEFAULT_PARSE_FLAGS = sre_parse.parse("").state.flags
+
 
 class RuleEngine:
     """规则引擎"""
@@ -25,6 +34,11 @@ class RuleEngine:
         # 加载规则
         self.blacklist = self._load_blacklist()
         self.rules = self._load_rules()
+        self._compile_blacklist()
+        self._compile_rules()
+
+        # 按工具名称特化的规则匹配函数 {tool_name: matcher}，规则变更时清空
+        self._compiled_rules: Dict[str, Callable[[Dict[str, Any]], List[Dict[str, Any]]]] = {}
 
         logger.info(
             f"Rule engine initialized: {len(self.blacklist.get('blocked_tools', []))} blacklist items, "
@@ -34,19 +48,237 @@ class RuleEngine:
     def _load_blacklist(self) -> Dict[str, Any]:
         """加载黑名单配置"""
         try:
-            with open(self.blacklist_file, 'r', encoding='utf-8') as f:
-                blacklist = json.load(f)
+            blacklist = orjson.loads(Path(self.blacklist_file).read_bytes())
             logger.info(f"Loaded blacklist from {self.blacklist_file}")
             return blacklist
         except Exception as e:
             logger.error(f"Failed to load blacklist: {e}")
             return {"blocked_tools": [], "blocked_parameters": []}
 
+    def _compile_blacklist(self):
+        """
+        将黑名单模式预编译为单个正则（各模式作为命名分支）
+
+        未命中时只需一次扫描即可放行；命中时再按原顺序逐条确认拦截原因。
+        含捕获组、反向引用或行内标志的模式不参与合并（拼接后分组编号偏移，
+        反向引用会静默指向别的分组导致漏拦截），预过滤时逐条匹配。
+        """
+        blocked_tools = self.blacklist.get("blocked_tools", [])
+        blocked_params = self.blacklist.get("blocked_parameters", [])
+
+        # 逐条预编译，供命中后确认拦截原因时复用
+        self._blocked_tool_patterns = []
+        for item in blocked_tools:
+            try:
+                self._blocked_tool_patterns.append((item, re.compile(item.get("tool_name", ""))))
+            except re.error as e:
+                logger.error(f"Invalid blacklist tool pattern {item.get('tool_name')!r}: {e}")
+
+        self._blocked_param_patterns = []
+        for item in blocked_params:
+            flags = 0 if item.get("case_sensitive", False) else re.IGNORECASE
+            try:
+                self._blocked_param_patterns.append((item, re.compile(item.get("pattern", ""), flags)))
+            except re.error as e:
+                logger.error(f"Invalid blacklist parameter pattern {item.get('pattern')!r}: {e}")
+
+        self._blocked_tool_names = {item.get("tool_name", "") for item in blocked_tools}
+        self._blocked_tool_re = None
+        self._blocked_param_re = None
+        self._blacklist_prefilter = True
+
+        # 不能安全合并的模式，预过滤时单独匹配
+        combined_tools = [
+            item for item, _ in self._blocked_tool_patterns if self._is_combinable(item.get("tool_name", ""))
+        ]
+        self._blocked_tool_separate = [
+            tool_re for item, tool_re in self._blocked_tool_patterns
+            if not self._is_combinable(item.get("tool_name", ""))
+        ]
+        combined_params = [
+            item for item, _ in self._blocked_param_patterns if self._is_combinable(item.get("pattern", ""))
+        ]
+        self._blocked_param_separate = [
+            param_re for item, param_re in self._blocked_param_patterns
+            if not self._is_combinable(item.get("pattern", ""))
+        ]
+
+        try:
+            if combined_tools:
+                self._blocked_tool_re = re.compile("|".join(
+                    f"(?:{item.get('tool_name', '')})" for item in combined_tools
+                ))
+            if combined_params:
+                self._blocked_param_re = re.compile("|".join(
+                    f"(?{'' if item.get('case_sensitive', False) else 'i'}:{item.get('pattern', '')})"
+                    for item in combined_params
+                ))
+        except re.error as e:
+            # 合并失败时退回逐条匹配
+            logger.warning(f"Failed to combine blacklist patterns, prefilter disabled: {e}")
+            self._blacklist_prefilter = False
+
+    def _compile_rules(self):
+        """
+        预编译所有规则的正则条件
+
+        编译结果单独保存（不写回规则字典），规则本身会原样返回给调用方并被序列化。
+        """
+        self._rule_patterns = {}
+        for rule in self.rules:
+            try:
+                self._rule_patterns[id(rule)] = self._compile_rule(rule)
+            except re.error as e:
+                logger.error(f"Invalid pattern in rule {rule.get('rule_id')}: {e}")
+
+        self._compile_rule_literals()
+        self._compile_rule_name_scanner()
+
+    def _compile_rule_literals(self):
+        """
+        提取每条规则工具名称模式中的必需字面量
+
+        工具名称中一个都不包含时，该规则的正则不可能命中，可跳过正则匹配。
+        无法提取字面量的规则（如纯通配）不参与预过滤，始终交给正则判断。
+        """
+        self._rule_literals = {}
+        for rule in self.rules:
+            compiled = self._rule_patterns.get(id(rule))
+            if compiled is None or compiled[0] is None:
+                continue
+            try:
+                literals = self._required_literals(list(sre_parse.parse(compiled[0].pattern)))
+            except Exception:
+                literals = None
+            if literals:
+                self._rule_literals[id(rule)] = tuple(literals)
+
+    @classmethod
+    def _required_literals(cls, items: list) -> Optional[set]:
+        """
+        求解析后的正则序列中"至少出现其一"的小写字面量集合
+
+        Args:
+            items: sre_parse 解析出的 (op, av) 序列
+
+        Returns:
+            字面量集合；无法确定时返回None
+        """
+        candidates = []
+        run = []
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run.append(chr(av))
+                continue
+
+            if run:
+                candidates.append({"".join(run).lower()})
+                run = []
+
+            if op is sre_parse.SUBPATTERN:
+                sub = cls._required_literals(list(av[-1]))
+                if sub:
+                    candidates.append(sub)
+            elif op is sre_parse.BRANCH:
+                alternatives = set()
+                for branch in av[1]:
+                    sub = cls._required_literals(list(branch))
+                    if not sub:
+                        alternatives = None
+                        break
+                    alternatives |= sub
+                if alternatives:
+                    candidates.append(alternatives)
+        if run:
+            candidates.append({"".join(run).lower()})
+
+        if not candidates:
+            return None
+        # 最短字面量越长，过滤越有效
+        return max(candidates, key=lambda literals: min(map(len, literals)))
+
+    def _compile_rule_name_scanner(self):
+        """
+        把所有规则的工具名称模式合并为一个正则，一次匹配求出全部命中的规则
+
+        每条规则对应一个可选的前瞻分支 (?:(?=[\\s\\S]*?(?P<_rN>模式))|)，
+        跳过前缀用 [\\s\\S] 而不是全局 (?s)，以免规则模式中的 "." 也被改为匹配换行；
+        匹配后命名分组非None即表示该规则的工具名称条件成立。
+        含捕获组、反向引用或行内标志的模式不参与合并：拼接后分组编号整体偏移，
+        \\1 之类的反向引用仍能编译却指向别的分组，会静默地匹配错误；这类规则逐条匹配。
+        """
+        self._rule_name_scanner = None
+        self._rule_name_groups = []
+
+        branches = []
+        for rule in self.rules:
+            compiled = self._rule_patterns.get(id(rule))
+            if compiled is None or compiled[0] is None:
+                continue
+            if not self._is_combinable(compiled[0].pattern):
+                continue
+            group = f"_r{len(branches)}"
+            branches.append(f"(?:(?=[\\s\\S]*?(?P<{group}>{compiled[0].pattern}))|)")
+            self._rule_name_groups.append((id(rule), group))
+
+        if not branches:
+            return
+
+        try:
+            self._rule_name_scanner = re.compile("".join(branches), re.IGNORECASE)
+        except re.error as e:
+            logger.warning(f"Failed to combine rule name patterns, falling back to per-rule matching: {e}")
+            self._rule_name_groups = []
+
+    @classmethod
+    def _is_combinable(cls, pattern: str) -> bool:
+        """模式能否安全地拼入合并正则（不含捕获组、反向引用和行内标志）"""
+        try:
+            parsed = sre_parse.parse(pattern)
+        except Exception:
+            return False
+        # state.groups 从1开始计数；flags 与空模式不同说明含全局行内标志如 (?i)
+        if parsed.state.groups > 1 or parsed.state.flags != _DEFAULT_PARSE_FLAGS:
+            return False
+        return not cls._has_scoped_flags(parsed)
+
+    @classmethod
+    def _has_scoped_flags(cls, items) -> bool:
+        """递归检查解析结果中是否有局部行内标志 (?i:...)"""
+        for item in items:
+            if isinstance(item, (sre_parse.SubPattern, list, tuple)):
+                if cls._has_scoped_flags(item):
+                    return True
+            if (
+                isinstance(item, tuple) and len(item) == 2 and item[0] is sre_parse.SUBPATTERN
+                and (item[1][1] or item[1][2])
+            ):
+                return True
+        return False
+
+    @staticmethod
+    def _compile_rule(rule: Dict[str, Any]) -> Tuple[Optional["re.Pattern"], Tuple[Tuple[str, "re.Pattern"], ...]]:
+        """
+        编译单条规则的工具名称模式和参数条件
+
+        Returns:
+            (工具名称正则或None, ((参数名, 参数正则), ...))
+        """
+        condition = rule.get("condition", {})
+
+        tool_name_pattern = condition.get("tool_name_pattern")
+        name_re = re.compile(tool_name_pattern, re.IGNORECASE) if tool_name_pattern else None
+
+        param_checks = tuple(
+            (param_name, re.compile(param_pattern, re.IGNORECASE))
+            for param_name, param_pattern in (condition.get("parameter_check") or {}).items()
+        )
+        return name_re, param_checks
+
     def _load_rules(self) -> List[Dict[str, Any]]:
         """加载规则配置"""
         try:
-            with open(self.rules_file, 'r', encoding='utf-8') as f:
-                rules_data = json.load(f)
+            rules_data = orjson.loads(Path(self.rules_file).read_bytes())
             rules = rules_data.get("rules", [])
             logger.info(f"Loaded {len(rules)} rules from {self.rules_file}")
             return rules
@@ -69,7 +301,7 @@ class RuleEngine:
         Returns:
             检查结果字典
         """
-        logger.debug(f"Checking rules for tool: {tool_name}")
+        logger.debug("Checking rules for tool: {}", tool_name)
 
         result = {
             "blacklist_hit": False,
@@ -88,25 +320,24 @@ class RuleEngine:
             logger.warning(f"Tool {tool_name} hit blacklist")
             return result
 
-        # 2. 检查规则
-        for rule in self.rules:
-            if self._match_rule(rule, tool_name, tool_parameters):
-                result["matched_rules"].append(rule)
-
-                # 处理规则动作
-                action = rule.get("action", "log")
-                if action == "force_confirm":
-                    result["force_confirm"] = True
-                elif action == "block":
-                    result["blocked"] = True
+        # 2. 检查规则（工具名称条件已在特化时求值，这里只检查参数条件）
+        for rule in self._get_rule_matcher(tool_name)(tool_parameters):
+            result["matched_rules"].append(rule)
 
-                message = f"匹配规则: {rule.get('name', rule.get('rule_id'))}"
-                result["messages"].append(message)
+            # 处理规则动作
+            action = rule.get("action", "log")
+            if action == "force_confirm":
+                result["force_confirm"] = True
+            elif action == "block":
+                result["blocked"] = True
 
-                logger.info(f"Matched rule {rule.get('rule_id')}: {rule.get('name')}")
+            message = f"匹配规则: {rule.get('name', rule.get('rule_id'))}"
+            result["messages"].append(message)
+
+            logger.info("Matched rule {}: {}", rule.get("rule_id"), rule.get("name"))
 
         if result["matched_rules"]:
-            logger.info(f"Tool {tool_name} matched {len(result['matched_rules'])} rules")
+            logger.info("Tool {} matched {} rules", tool_name, len(result["matched_rules"]))
 
         return result
 
@@ -121,27 +352,40 @@ class RuleEngine:
             "messages": []
         }
 
+        # 快速路径：合并后的正则和单独匹配的模式均未命中时直接放行
+        if self._blacklist_prefilter:
+            tool_hit = (
+                tool_name in self._blocked_tool_names
+                or (self._blocked_tool_re is not None and self._blocked_tool_re.search(tool_name) is not None)
+                or any(tool_re.search(tool_name) for tool_re in self._blocked_tool_separate)
+            )
+            param_hit = False
+            if tool_parameters and (self._blocked_param_re is not None or self._blocked_param_separate):
+                param_texts = [f"{k}={v}" for k, v in tool_parameters.items()]
+                param_hit = (
+                    self._blocked_param_re is not None
+                    and any(self._blocked_param_re.search(text) for text in param_texts)
+                ) or any(
+                    param_re.search(text)
+                    for param_re in self._blocked_param_separate
+                    for text in param_texts
+                )
+            if not tool_hit and not param_hit:
+                return result
+
         # 检查工具黑名单
-        for blocked_tool in self.blacklist.get("blocked_tools", []):
-            tool_name_pattern = blocked_tool.get("tool_name", "")
-            if tool_name == tool_name_pattern or re.search(tool_name_pattern, tool_name):
+        for blocked_tool, tool_re in self._blocked_tool_patterns:
+            if tool_name == blocked_tool.get("tool_name", "") or tool_re.search(tool_name):
                 result["blocked"] = True
                 reason = blocked_tool.get("reason", "此工具已被禁用")
                 result["messages"].append(f"黑名单拦截: {reason}")
                 break
 
         # 检查参数黑名单
-        for blocked_param in self.blacklist.get("blocked_parameters", []):
-            pattern = blocked_param.get("pattern", "")
-            case_sensitive = blocked_param.get("case_sensitive", False)
-
+        for blocked_param, param_re in self._blocked_param_patterns:
             # 检查所有参数
             for param_name, param_value in tool_parameters.items():
-                param_str = f"{param_name}={param_value}"
-
-                # 编译正则表达式
-                flags = 0 if case_sensitive else re.IGNORECASE
-                if re.search(pattern, param_str, flags):
+                if param_re.search(f"{param_name}={param_value}"):
                     result["blocked"] = True
                     reason = blocked_param.get("reason", "参数包含敏感信息")
                     result["messages"].append(f"参数拦截: {reason}")
@@ -152,6 +396,79 @@ class RuleEngine:
 
         return result
 
+    def _get_rule_matcher(self, tool_name: str) -> Callable[[Dict[str, Any]], List[Dict[str, Any]]]:
+        """获取工具对应的规则匹配函数，首次调用时特化"""
+        matcher = self._compiled_rules.get(tool_name)
+        if matcher is None:
+            if len(self._compiled_rules) >= 4096:
+                self._compiled_rules.clear()
+            matcher = self._compile_rule_matcher(tool_name)
+            self._compiled_rules[tool_name] = matcher
+        return matcher
+
+    def _compile_rule_matcher(self, tool_name: str) -> Callable[[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        针对单个工具名称特化规则：预先筛掉工具名称不匹配的规则，
+        返回只需检查参数条件（已预编译）的闭包
+
+        Args:
+            tool_name: 工具名称
+
+        Returns:
+            输入工具参数、返回匹配规则列表（保持规则原顺序）的函数
+        """
+        # 字面量预过滤：必需字面量均未出现的规则直接排除
+        tool_name_lower = tool_name.lower()
+        excluded = {
+            rule_key for rule_key, literals in self._rule_literals.items()
+            if not any(literal in tool_name_lower for literal in literals)
+        }
+
+        # 一次扫描求出合并正则中工具名称条件成立的规则（全部被预过滤排除时跳过）
+        name_hits = None
+        scanned = set()
+        if self._rule_name_scanner is not None and len(excluded) < len(self._rule_name_groups):
+            groups = self._rule_name_scanner.match(tool_name).groupdict()
+            name_hits = {rule_key for rule_key, group in self._rule_name_groups if groups[group] is not None}
+            scanned = {rule_key for rule_key, _ in self._rule_name_groups}
+
+        applicable = []
+        for rule in self.rules:
+            compiled = self._rule_patterns.get(id(rule))
+            if compiled is None:
+                continue
+
+            name_re, param_checks = compiled
+            if name_re is not None:
+                if id(rule) in excluded:
+                    continue
+                if id(rule) in scanned:
+                    if id(rule) not in name_hits:
+                        continue
+                elif not name_re.search(tool_name):
+                    continue
+
+            applicable.append((rule, param_checks))
+
+        # 无参数条件的规则对该工具恒成立
+        if all(not checks for _, checks in applicable):
+            always = [rule for rule, _ in applicable]
+            return lambda tool_parameters: always
+
+        def match(tool_parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+            matched = []
+            for rule, param_checks in applicable:
+                for param_name, param_re in param_checks:
+                    if param_name not in tool_parameters:
+                        break
+                    if not param_re.search(str(tool_parameters[param_name])):
+                        break
+                else:
+                    matched.append(rule)
+            return matched
+
+        return match
+
     def _match_rule(
         self,
         rule: Dict[str, Any],
@@ -169,24 +486,22 @@ class RuleEngine:
         Returns:
             是否匹配
         """
-        condition = rule.get("condition", {})
+        compiled = self._rule_patterns.get(id(rule))
+        if compiled is None:
+            compiled = self._compile_rule(rule)
+        name_re, param_checks = compiled
 
         # 1. 检查工具名称模式
-        tool_name_pattern = condition.get("tool_name_pattern")
-        if tool_name_pattern:
-            if not re.search(tool_name_pattern, tool_name, re.IGNORECASE):
-                return False
+        if name_re is not None and not name_re.search(tool_name):
+            return False
 
         # 2. 检查参数条件
-        parameter_check = condition.get("parameter_check", {})
-        if parameter_check:
-            for param_name, param_pattern in parameter_check.items():
-                if param_name not in tool_parameters:
-                    return False
+        for param_name, param_re in param_checks:
+            if param_name not in tool_parameters:
+                return False
 
-                param_value = str(tool_parameters[param_name])
-                if not re.search(param_pattern, param_value, re.IGNORECASE):
-                    return False
+            if not param_re.search(str(tool_parameters[param_name])):
+                return False
 
         return True
 
@@ -195,6 +510,9 @@ class RuleEngine:
         logger.info("Reloading rules...")
         self.blacklist = self._load_blacklist()
         self.rules = self._load_rules()
+        self._compile_blacklist()
+        self._compile_rules()
+        self._compiled_rules.clear()
         logger.info("Rules reloaded successfully")
 
     def add_custom_rule(self, rule: Dict[str, Any]) -> bool:
@@ -219,8 +537,13 @@ class RuleEngine:
                 logger.warning(f"Rule {rule['rule_id']} already exists")
                 return False
 
+            # 预编译失败（正则非法）时拒绝添加
+            self._compile_rule(rule)
+
             # 添加规则
             self.rules.append(rule)
+            self._compile_rules()
+            self._compiled_rules.clear()
             logger.info(f"Added custom rule: {rule['rule_id']}")
             return True
 
@@ -242,6 +565,8 @@ class RuleEngine:
         self.rules = [r for r in self.rules if r.get("rule_id") != rule_id]
 
         if len(self.rules) < initial_count:
+            self._compile_rules()
+            self._compiled_rules.clear()
             logger.info(f"Removed rule: {rule_id}")
             return True
         else:
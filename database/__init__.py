@@ -30,11 +30,15 @@ class DatabaseManager:
     async def init(self):
         """初始化数据库"""
         await self.pg.init_database()
+        self.pg.start_partition_maintenance()
+        self.pg.start_metrics_flusher()
+        self.faiss.start_autosave()
 
     async def close(self):
         """关闭所有数据库连接"""
         await self.pg.close()
-        self.faiss.save()
+        await self.faiss.stop_autosave()
+        await self.faiss.save_async()
         logger.info("All database connections closed")
 
     def __getattr__(self, name):
@@ -1,6 +1,7 @@
 """
 Faiss向量数据库管理
 """
+import asyncio
 import os
 import pickle
 from typing import List, Tuple, Optional
@@ -26,55 +27,131 @@ class FaissManager:
         self.dimension = faiss_config.get("dimension", 1536)
         self.index_type = faiss_config.get("index_type", "IVFFlat")
         self.nlist = faiss_config.get("nlist", 100)
+        # IVFPQ参数：子空间数（需整除维度）与每个子空间的编码位数
+        self.pq_m = faiss_config.get("pq_m", 64)
+        self.pq_nbits = faiss_config.get("pq_nbits", 8)
+        # 相似度度量：cosine（向量归一化后用内积）或 l2
+        self.metric = str(faiss_config.get("metric", "cosine")).lower()
+        self._faiss_metric = faiss.METRIC_L2 if self.metric == "l2" else faiss.METRIC_INNER_PRODUCT
+        # 需要训练的索引（IVF、SQ8）在收集到 train_size 条向量后统一训练并写入
+        self.train_size = faiss_config.get("train_size") or self._default_train_size()
+        # 新增向量先写入预分配缓冲区，攒满 flush_size 条或检索前一次性写入索引
+        self.flush_size = max(1, faiss_config.get("flush_size", 256))
+
+        # Faiss内部OpenMP线程数（不配置则使用Faiss默认值）
+        omp_threads = faiss_config.get("omp_threads")
+        if omp_threads:
+            faiss.omp_set_num_threads(int(omp_threads))
+
+        # 后台自动保存间隔（秒），0表示只在关闭时保存
+        self.autosave_interval = faiss_config.get("autosave_interval", 30)
+        # 只读副本：以mmap方式只读加载索引（多进程共享页缓存），不写入，
+        # 并按 autosave_interval 检查写入进程保存的新索引文件后重新加载
+        self.read_only = faiss_config.get("read_only", False)
+        self._index_mtime: Optional[float] = None
 
         # 确保存储目录存在
         os.makedirs(self.index_path, exist_ok=True)
 
         # 索引文件路径
         self.index_file = os.path.join(self.index_path, "index.faiss")
-        self.id_map_file = os.path.join(self.index_path, "id_map.pkl")
-
-        # 初始化索引
+        self.train_buf_file = os.path.join(self.index_path, "train_buf.npy")
+        self.train_ids_file = os.path.join(self.index_path, "train_ids.npy")
+        # 旧版本由Python维护 vector_id -> database_id 映射，加载时迁移
+        self.legacy_id_map_files = (
+            os.path.join(self.index_path, "id_map.npy"),
+            os.path.join(self.index_path, "id_map.pkl"),
+        )
+
+        # 初始化索引（IndexIDMap2包装，Faiss内部的ID即数据库记录ID）
         self.index = None
-        self.id_map = {}  # vector_id -> database_id 映射
-        self.next_vector_id = 0
+        # 索引训练前尚未写入索引的向量及其数据库ID（首次使用时按 train_size 预分配）
+        self._train_buf: Optional[np.ndarray] = None
+        self._train_ids: Optional[np.ndarray] = None
+        self._train_n = 0
+        # 等待批量写入的向量（连续float32矩阵）及其数据库ID
+        self._pending_vecs = np.empty((self.flush_size, self.dimension), dtype=np.float32)
+        self._pending_ids = np.empty(self.flush_size, dtype=np.int64)
+        self._pending_n = 0
+        # 自上次保存后索引是否有变更
+        self._dirty = False
+        self._save_lock = asyncio.Lock()
+        self._autosave_task: Optional[asyncio.Task] = None
 
         self._load_or_create_index()
 
         logger.info(f"Faiss manager initialized: {self.index_path}, dimension={self.dimension}")
 
+    def _default_train_size(self) -> int:
+        """默认训练样本数：IVF每个聚类中心约39个样本，PQ码本另需足够样本，SQ8只需估计各维度取值范围"""
+        if self.index_type == "IVFPQ":
+            return max(39 * self.nlist, 16384)
+        if self.index_type.startswith("IVF"):
+            return 39 * self.nlist
+        return 1000
+
     def _create_index(self) -> faiss.Index:
         """创建Faiss索引"""
+        metric = self._faiss_metric
+
         if self.index_type == "Flat":
             # 暴力搜索，精确但慢
-            index = faiss.IndexFlatL2(self.dimension)
+            index = faiss.IndexFlat(self.dimension, metric)
         elif self.index_type == "IVFFlat":
             # 倒排文件索引，平衡精度和速度
-            quantizer = faiss.IndexFlatL2(self.dimension)
-            index = faiss.IndexIVFFlat(quantizer, self.dimension, self.nlist)
+            quantizer = faiss.IndexFlat(self.dimension, metric)
+            index = faiss.IndexIVFFlat(quantizer, self.dimension, self.nlist, metric)
             # 需要训练
             index.is_trained = False
+        elif self.index_type == "IVFPQ":
+            # 倒排+乘积量化，每个向量仅占 pq_m 字节（nbits=8时），内存/带宽降低数十倍（需要训练）
+            quantizer = faiss.IndexFlat(self.dimension, metric)
+            index = faiss.IndexIVFPQ(
+                quantizer, self.dimension, self.nlist, self._pq_subquantizers(), self.pq_nbits, metric
+            )
+        elif self.index_type == "IVFSQ8":
+            # 倒排+8位标量量化，内存为IVFFlat的1/4（需要训练）
+            quantizer = faiss.IndexFlat(self.dimension, metric)
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, self.dimension, self.nlist, faiss.ScalarQuantizer.QT_8bit, metric
+            )
         elif self.index_type == "HNSW":
             # HNSW图索引，快速但占用内存
-            index = faiss.IndexHNSWFlat(self.dimension, 32)
+            index = faiss.IndexHNSWFlat(self.dimension, 32, metric)
+        elif self.index_type == "SQ8":
+            # 8位标量量化，内存为Flat的1/4，召回损失很小（需要训练）
+            index = faiss.IndexScalarQuantizer(
+                self.dimension, faiss.ScalarQuantizer.QT_8bit, metric
+            )
         else:
             logger.warning(f"Unknown index type {self.index_type}, using Flat")
-            index = faiss.IndexFlatL2(self.dimension)
+            index = faiss.IndexFlat(self.dimension, metric)
+
+        logger.info(f"Created new Faiss index: {self.index_type} ({self.metric})")
+        # 由Faiss维护ID映射，检索直接返回数据库ID，并支持remove_ids
+        return faiss.IndexIDMap2(index)
 
-        logger.info(f"Created new Faiss index: {self.index_type}")
-        return index
+    def _pq_subquantizers(self) -> int:
+        """PQ子空间数必须整除维度，配置值不满足时取不超过它的最大约数"""
+        m = max(1, min(self.pq_m, self.dimension))
+        while self.dimension % m:
+            m -= 1
+        if m != self.pq_m:
+            logger.warning(f"pq_m={self.pq_m} does not divide dimension {self.dimension}, using {m}")
+        return m
 
     def _load_or_create_index(self):
         """加载或创建索引"""
-        if os.path.exists(self.index_file) and os.path.exists(self.id_map_file):
+        if os.path.exists(self.index_file):
             # 加载现有索引
             try:
-                self.index = faiss.read_index(self.index_file)
-                with open(self.id_map_file, 'rb') as f:
-                    data = pickle.load(f)
-                    self.id_map = data['id_map']
-                    self.next_vector_id = data['next_vector_id']
-                logger.info(f"Loaded existing Faiss index with {self.index.ntotal} vectors")
+                self.index = self._read_index_file()
+                if self.read_only:
+                    logger.info(f"Loaded Faiss index read-only (mmap) with {self.index.ntotal} vectors")
+                else:
+                    if os.path.exists(self.train_buf_file) and os.path.exists(self.train_ids_file):
+                        self._load_train_buffer(np.load(self.train_buf_file), np.load(self.train_ids_file))
+                    logger.info(f"Loaded existing Faiss index with {self.index.ntotal} vectors")
             except Exception as e:
                 logger.error(f"Failed to load index: {e}, creating new one")
                 self.index = self._create_index()
@@ -82,19 +159,224 @@ class FaissManager:
             # 创建新索引
             self.index = self._create_index()
 
+        # 以索引实际的度量为准（兼容此前创建的L2索引）
+        self._inner_product = self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+        if not isinstance(self.index, faiss.IndexIDMap2):
+            if self.read_only:
+                logger.warning("Legacy Faiss index found in read-only mode, migration left to the writer")
+            else:
+                self._migrate_legacy_index()
+
+    def _read_index_file(self) -> faiss.Index:
+        """读取索引文件；只读模式下使用mmap，索引数据不复制进进程内存"""
+        self._index_mtime = os.path.getmtime(self.index_file)
+        if self.read_only:
+            # 写入进程以"写临时文件+原子替换"保存，已映射的旧文件不会被截断
+            return faiss.read_index(self.index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        return faiss.read_index(self.index_file)
+
+    async def _reload_if_changed(self):
+        """只读模式：索引文件被写入进程更新后重新加载"""
+        try:
+            mtime = os.path.getmtime(self.index_file)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+
+        try:
+            index = await asyncio.to_thread(self._read_index_file)
+        except Exception as e:
+            logger.error(f"Failed to reload index: {e}")
+            return
+        self.index = index
+        self._inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+        logger.info(f"Reloaded Faiss index with {index.ntotal} vectors")
+
+    def _migrate_legacy_index(self):
+        """
+        迁移旧版索引：旧版索引内是连续的 vector_id，映射单独保存在 id_map 文件中。
+        取出全部向量后按数据库ID重建为 IndexIDMap2 索引（仅执行一次）。
+        """
+        legacy_npy, legacy_pkl = self.legacy_id_map_files
+        try:
+            if os.path.exists(legacy_npy):
+                db_ids = np.load(legacy_npy)
+            elif os.path.exists(legacy_pkl):
+                with open(legacy_pkl, 'rb') as f:
+                    data = pickle.load(f)
+                db_ids = np.full(data['next_vector_id'], -1, dtype=np.int64)
+                for vector_id, database_id in data['id_map'].items():
+                    db_ids[vector_id] = database_id
+            else:
+                raise FileNotFoundError("id map not found")
+
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if ivf is not None:
+                ivf.make_direct_map()
+            vectors = [self.index.reconstruct_n(0, self.index.ntotal)]
+            if os.path.exists(self.train_buf_file):
+                vectors.append(np.load(self.train_buf_file))
+            vectors = np.concatenate(vectors)[:len(db_ids)]
+
+            keep = db_ids[:len(vectors)] != -1
+            logger.info(f"Migrating legacy Faiss index with {int(keep.sum())} vectors...")
+            self.rebuild_index(list(zip(vectors[keep], db_ids[:len(vectors)][keep].tolist())))
+        except Exception as e:
+            logger.error(f"Failed to migrate legacy index: {e}, creating new one")
+            self.index = self._create_index()
+            self._inner_product = self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+            self._reset_train_buffer()
+            self._save_index()
+
+        for legacy_file in self.legacy_id_map_files:
+            if os.path.exists(legacy_file):
+                os.remove(legacy_file)
+
+    def _prepare_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """内积索引下将向量原地归一化为单位长度，使内积等于余弦相似度"""
+        if self._inner_product:
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def _snapshot(self) -> dict:
+        """在当前线程生成索引和映射的内存快照（后续写盘不再访问可变状态）"""
+        return {
+            "index": faiss.serialize_index(self.index),
+            "ntotal": self.index.ntotal,
+            "train_buf": self._train_buf[:self._train_n].copy() if self._train_n else None,
+            "train_ids": self._train_ids[:self._train_n].copy() if self._train_n else None,
+        }
+
+    def _write_snapshot(self, snapshot: dict):
+        """将快照写入磁盘（先写临时文件再原子替换，可在线程池中执行）"""
+        tmp_index_file = self.index_file + ".tmp"
+        snapshot["index"].tofile(tmp_index_file)
+        os.replace(tmp_index_file, self.index_file)
+
+        if snapshot["train_buf"] is not None:
+            np.save(self.train_buf_file, snapshot["train_buf"])
+            np.save(self.train_ids_file, snapshot["train_ids"])
+        else:
+            for train_file in (self.train_buf_file, self.train_ids_file):
+                if os.path.exists(train_file):
+                    os.remove(train_file)
+        logger.debug("Saved Faiss index with {} vectors", snapshot["ntotal"])
+
     def _save_index(self):
-        """保存索引到磁盘"""
+        """同步保存索引到磁盘"""
+        if self.read_only:
+            return
         try:
-            faiss.write_index(self.index, self.index_file)
-            with open(self.id_map_file, 'wb') as f:
-                pickle.dump({
-                    'id_map': self.id_map,
-                    'next_vector_id': self.next_vector_id
-                }, f)
-            logger.debug(f"Saved Faiss index with {self.index.ntotal} vectors")
+            self._write_snapshot(self._snapshot())
+            self._dirty = False
         except Exception as e:
             logger.error(f"Failed to save index: {e}")
 
+    async def save_async(self):
+        """
+        异步保存索引：在事件循环内生成快照，写盘放到线程池，不阻塞请求处理
+        """
+        self._flush_pending()
+        if not self._dirty:
+            return
+
+        async with self._save_lock:
+            snapshot = self._snapshot()
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._write_snapshot, snapshot)
+            except Exception as e:
+                self._dirty = True
+                logger.error(f"Failed to save index: {e}")
+
+    def start_autosave(self):
+        """启动后台自动保存任务（有变更时按 autosave_interval 合并保存；只读模式下改为检查并重新加载）"""
+        if self._autosave_task is None and self.autosave_interval:
+            self._autosave_task = asyncio.create_task(self._autosave_loop())
+
+    async def stop_autosave(self):
+        """停止后台自动保存任务"""
+        if self._autosave_task:
+            self._autosave_task.cancel()
+            try:
+                await self._autosave_task
+            except asyncio.CancelledError:
+                pass
+            self._autosave_task = None
+
+    async def _autosave_loop(self):
+        """定期保存有变更的索引"""
+        while True:
+            await asyncio.sleep(self.autosave_interval)
+            if self.read_only:
+                await self._reload_if_changed()
+            else:
+                await self.save_async()
+
+    def _reset_train_buffer(self):
+        """清空训练缓冲区"""
+        self._train_buf = None
+        self._train_ids = None
+        self._train_n = 0
+
+    def _load_train_buffer(self, vectors: np.ndarray, ids: np.ndarray):
+        """载入已保存的训练缓冲区（容量不小于 train_size）"""
+        capacity = max(self.train_size, len(vectors))
+        self._train_buf = np.empty((capacity, self.dimension), dtype=np.float32)
+        self._train_ids = np.empty(capacity, dtype=np.int64)
+        self._train_n = len(vectors)
+        self._train_buf[:self._train_n] = vectors
+        self._train_ids[:self._train_n] = ids
+
+    def _add_to_index(self, vectors: np.ndarray, ids: np.ndarray):
+        """写入索引；索引未训练时先写入训练缓冲区，攒满 train_size 条后训练并一次性写入"""
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+            return
+
+        if self._train_buf is None:
+            self._train_buf = np.empty((self.train_size, self.dimension), dtype=np.float32)
+            self._train_ids = np.empty(self.train_size, dtype=np.int64)
+
+        n = min(len(vectors), len(self._train_buf) - self._train_n)
+        self._train_buf[self._train_n:self._train_n + n] = vectors[:n]
+        self._train_ids[self._train_n:self._train_n + n] = ids[:n]
+        self._train_n += n
+        if self._train_n < len(self._train_buf):
+            logger.debug("Buffered {}/{} vectors for index training", self._train_n, self.train_size)
+            return
+
+        self._train_buffered()
+        if n < len(vectors):
+            self.index.add_with_ids(vectors[n:], ids[n:])
+
+    def _train_buffered(self):
+        """用缓冲的向量训练索引，并按原顺序写入"""
+        train_vectors = self._train_buf[:self._train_n]
+        logger.info(f"Training {self.index_type} index on {len(train_vectors)} vectors...")
+        self.index.train(train_vectors)
+        self.index.add_with_ids(train_vectors, self._train_ids[:self._train_n])
+        self._reset_train_buffer()
+        self._dirty = True
+
+    def _min_train_size(self) -> int:
+        """训练所需的最少样本数（IVF每个聚类中心至少一个样本，PQ每个码字至少一个样本）"""
+        if self.index_type == "IVFPQ":
+            return max(self.nlist, 2 ** self.pq_nbits)
+        if self.index_type.startswith("IVF"):
+            return self.nlist
+        return 1
+
+    def _flush_pending(self):
+        """将缓冲区中的向量一次性写入索引"""
+        if self._pending_n == 0:
+            return
+        n = self._pending_n
+        self._add_to_index(self._pending_vecs[:n], self._pending_ids[:n])
+        self._pending_n = 0
+
     def add_vector(self, embedding: List[float], database_id: int) -> int:
         """
         添加向量到索引
@@ -104,44 +386,57 @@ class FaissManager:
             database_id: 对应的数据库记录ID
 
         Returns:
-            vector_id: Faiss中的向量ID
+            vector_id: Faiss中的向量ID（即数据库记录ID）
         """
-        # 转换为numpy数组
-        vector = np.array([embedding], dtype=np.float32)
-
-        # 如果是IVFFlat且未训练，需要先训练
-        if isinstance(self.index, faiss.IndexIVFFlat) and not self.index.is_trained:
-            if self.index.ntotal >= self.nlist:
-                # 有足够的数据进行训练
-                logger.info("Training IVFFlat index...")
-                self.index.train(vector)
-            else:
-                # 数据不够，暂时不训练，等数据足够再说
-                pass
+        return self.add_vectors([embedding], [database_id])[0]
+
+    def add_vectors(self, embeddings: List[List[float]], database_ids: List[int]) -> List[int]:
+        """
+        批量添加向量到索引
 
-        # 添加向量
-        if self.index.is_trained or not isinstance(self.index, faiss.IndexIVFFlat):
-            self.index.add(vector)
+        数据库记录ID直接作为Faiss内的向量ID。向量先复制进预分配的缓冲区，
+        攒满 flush_size 条（或下次检索、保存前）再以单次 add_with_ids 写入；
+        索引训练前的向量先缓冲，训练完成后按原顺序写入。
 
-            # 记录映射
-            vector_id = self.next_vector_id
-            self.id_map[vector_id] = database_id
-            self.next_vector_id += 1
+        Args:
+            embeddings: 向量嵌入列表
+            database_ids: 对应的数据库记录ID列表
 
-            # 定期保存（每10个向量保存一次）
-            if self.next_vector_id % 10 == 0:
-                self._save_index()
+        Returns:
+            与输入顺序一致的向量ID列表
+        """
+        if len(embeddings) == 0:
+            return []
 
-            logger.debug(f"Added vector {vector_id} -> database_id {database_id}")
-            return vector_id
-        else:
-            logger.warning("Index not trained yet, skipping add")
-            return -1
+        if self.read_only:
+            logger.warning("Faiss index is read-only, skipped adding {} vectors", len(embeddings))
+            return [-1] * len(embeddings)
+
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        ids = np.asarray(database_ids, dtype=np.int64)
+
+        # 分段复制进缓冲区，缓冲区满时写入索引
+        offset = 0
+        while offset < len(vectors):
+            n = min(self.flush_size - self._pending_n, len(vectors) - offset)
+            self._pending_vecs[self._pending_n:self._pending_n + n] = vectors[offset:offset + n]
+            self._pending_ids[self._pending_n:self._pending_n + n] = ids[offset:offset + n]
+            self._prepare_vectors(self._pending_vecs[self._pending_n:self._pending_n + n])
+            self._pending_n += n
+            offset += n
+            if self._pending_n == self.flush_size:
+                self._flush_pending()
+
+        self._dirty = True
+
+        logger.debug("Added {} vectors", len(ids))
+        return ids.tolist()
 
     def search(
         self,
         query_embedding: List[float],
-        top_k: int = 5
+        top_k: int = 5,
+        max_distance: Optional[float] = None
     ) -> List[Tuple[int, float]]:
         """
         搜索最相似的向量
@@ -149,53 +444,99 @@ class FaissManager:
         Args:
             query_embedding: 查询向量
             top_k: 返回top k结果
+            max_distance: 最大距离（可选），超出的结果直接丢弃
 
         Returns:
-            [(database_id, distance), ...] 列表
+            [(database_id, distance), ...] 列表；余弦度量下 distance 为单位向量间的
+            平方L2距离（2 - 2·cos），与L2索引的距离含义一致
         """
-        if self.index.ntotal == 0:
+        self._flush_pending()
+        if self.index.ntotal == 0 and self._train_n == 0:
             logger.warning("Index is empty")
             return []
 
         # 转换为numpy数组
-        query_vector = np.array([query_embedding], dtype=np.float32)
+        query_vector = self._prepare_vectors(np.array([query_embedding], dtype=np.float32))
 
         # 搜索
         try:
-            distances, indices = self.index.search(query_vector, top_k)
+            if self.index.is_trained:
+                distances, indices = self.index.search(query_vector, top_k)
+                if self._inner_product:
+                    distances = np.maximum(2.0 - 2.0 * distances, 0.0)
+            else:
+                # 训练前向量都在缓冲区中，直接暴力检索
+                distances, indices = self._search_train_buffer(query_vector[0], top_k)
 
-            # 转换为数据库ID
-            results = []
-            for idx, dist in zip(indices[0], distances[0]):
-                if idx != -1 and idx in self.id_map:
-                    database_id = self.id_map[idx]
-                    results.append((database_id, float(dist)))
+            # 返回的ID即数据库ID，过滤无效结果（-1）后一次性转换为Python类型
+            valid = indices[0] != -1
+            if max_distance is not None:
+                valid &= distances[0] <= max_distance
+            results = list(zip(indices[0][valid].tolist(), distances[0][valid].tolist()))
 
-            logger.debug(f"Found {len(results)} similar vectors")
+            logger.debug("Found {} similar vectors", len(results))
             return results
         except Exception as e:
             logger.error(f"Search failed: {e}")
             return []
 
+    def _search_train_buffer(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """在训练缓冲区中暴力检索，返回与 index.search 相同形状的 (distances, ids)"""
+        vectors = self._train_buf[:self._train_n]
+        if self._inner_product:
+            distances = np.maximum(2.0 - 2.0 * (vectors @ query), 0.0)
+        else:
+            distances = ((vectors - query) ** 2).sum(axis=1)
+
+        k = min(top_k, self._train_n)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return distances[top][None], self._train_ids[top][None]
+
     def delete_vector(self, vector_id: int):
         """
-        删除向量（注意：Faiss不直接支持删除，这里只从映射中移除）
+        删除向量
 
         Args:
-            vector_id: 向量ID
+            vector_id: 向量ID（即数据库记录ID）
         """
-        if vector_id in self.id_map:
-            del self.id_map[vector_id]
-            self._save_index()
-            logger.debug(f"Removed vector {vector_id} from mapping")
+        if self.read_only:
+            logger.warning(f"Faiss index is read-only, cannot remove vector {vector_id}")
+            return
+
+        self._flush_pending()
+
+        # 仍在训练缓冲区中的向量直接从缓冲区移除
+        if self._train_n:
+            keep = self._train_ids[:self._train_n] != vector_id
+            removed = int((~keep).sum())
+            if removed:
+                remaining = self._train_n - removed
+                self._train_buf[:remaining] = self._train_buf[:self._train_n][keep]
+                self._train_ids[:remaining] = self._train_ids[:self._train_n][keep]
+                self._train_n = remaining
+        else:
+            try:
+                removed = self.index.remove_ids(np.array([vector_id], dtype=np.int64))
+            except RuntimeError as e:
+                # 部分索引类型（如HNSW）不支持删除
+                logger.warning(f"Index {self.index_type} does not support removal: {e}")
+                return
+
+        if removed:
+            self._dirty = True
+            logger.debug(f"Removed vector {vector_id} from index")
 
     def get_total_vectors(self) -> int:
         """获取索引中的向量总数"""
+        self._flush_pending()
         return self.index.ntotal
 
     def save(self):
-        """手动保存索引"""
-        self._save_index()
+        """保存索引（先写入缓冲区中的向量；无变更时跳过）"""
+        self._flush_pending()
+        if self._dirty:
+            self._save_index()
 
     def rebuild_index(self, embeddings: List[Tuple[List[float], int]]):
         """
@@ -204,31 +545,29 @@ class FaissManager:
         Args:
             embeddings: [(embedding, database_id), ...] 列表
         """
+        if self.read_only:
+            logger.error("Faiss index is read-only, rebuild must run on the writer")
+            return
+
         logger.info("Rebuilding Faiss index...")
 
         # 创建新索引
         self.index = self._create_index()
-        self.id_map = {}
-        self.next_vector_id = 0
+        self._inner_product = self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        self._reset_train_buffer()
+        self._pending_n = 0
 
-        # 批量添加
+        # 批量添加（需要训练的索引在样本足够时自动训练）
         if embeddings:
-            vectors = np.array([emb for emb, _ in embeddings], dtype=np.float32)
-
-            # 训练（如果需要）
-            if isinstance(self.index, faiss.IndexIVFFlat) and not self.index.is_trained:
-                if len(vectors) >= self.nlist:
-                    logger.info("Training index...")
-                    self.index.train(vectors)
-
-            # 添加向量
-            if self.index.is_trained or not isinstance(self.index, faiss.IndexIVFFlat):
-                self.index.add(vectors)
-
-                # 重建映射
-                for i, (_, db_id) in enumerate(embeddings):
-                    self.id_map[i] = db_id
-                self.next_vector_id = len(embeddings)
+            self.add_vectors(
+                [emb for emb, _ in embeddings],
+                [db_id for _, db_id in embeddings]
+            )
+            self._flush_pending()
+
+            # 重建时数据已全部给出，不足 train_size 也直接训练
+            if self._train_n and self._train_n >= self._min_train_size():
+                self._train_buffered()
 
         # 保存
         self._save_index()
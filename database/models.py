@@ -2,51 +2,66 @@
 数据库模型定义
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, Text, Boolean
-from sqlalchemy.ext.declarative import declarative_base
+from typing import Any, Optional
+from sqlalchemy import Integer, String, Float, DateTime, JSON, Text, Boolean, Index, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    """声明式基类（SQLAlchemy 2.0 类型化映射）"""
 
 
 class ToolCallHistory(Base):
-    """工具调用历史记录"""
+    """
+    工具调用历史记录
+
+    大体积的JSON/文本列归入延迟加载组 "payload"，RAG等只需摘要字段的查询不读取它们，
+    需要完整记录的查询使用 undefer_group("payload")。
+    """
     __tablename__ = "tool_call_history"
+    __table_args__ = (
+        # 用户历史查询：WHERE user_id=? [AND tool_name=?] ORDER BY created_at DESC, id DESC
+        Index("ix_history_user_time", "user_id", "created_at", "id"),
+        Index("ix_history_user_tool_time", "user_id", "tool_name", "created_at", "id"),
+    )
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    request_id = Column(String(64), unique=True, index=True, nullable=False)
-    user_id = Column(String(128), index=True, nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    request_id: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    user_id: Mapped[str] = mapped_column(String(128))  # 由上面的复合索引覆盖
 
     # 用户问题
-    user_question = Column(Text, nullable=False)
-    user_question_embedding_id = Column(Integer, index=True)  # 对应Faiss向量ID
+    user_question: Mapped[str] = mapped_column(Text)
+    user_question_embedding_id: Mapped[Optional[int]] = mapped_column(Integer, index=True)  # 对应Faiss向量ID
 
     # 工具调用信息
-    tool_name = Column(String(256), index=True, nullable=False)
-    tool_parameters = Column(JSON)
+    tool_name: Mapped[str] = mapped_column(String(256), index=True)
+    tool_parameters: Mapped[Optional[Any]] = mapped_column(JSON)
 
     # 风险评估
-    risk_score = Column(Float, default=0.0)
-    requires_confirmation = Column(Boolean, default=False)
-    confirmation_reason = Column(Text)
+    risk_score: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    requires_confirmation: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
+    confirmation_reason: Mapped[Optional[str]] = mapped_column(Text, deferred=True, deferred_group="payload")
 
     # 规则引擎结果
-    matched_rules = Column(JSON)  # 匹配到的规则列表
-    blacklist_hit = Column(Boolean, default=False)
+    matched_rules: Mapped[Optional[Any]] = mapped_column(JSON, deferred=True, deferred_group="payload")  # 匹配到的规则列表
+    blacklist_hit: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
 
     # 用户反馈
-    user_confirmed = Column(Boolean, nullable=True)
-    user_feedback = Column(Text)
-    execution_success = Column(Boolean, nullable=True)
-    execution_result = Column(JSON)
+    user_confirmed: Mapped[Optional[bool]] = mapped_column(Boolean)
+    user_feedback: Mapped[Optional[str]] = mapped_column(Text)
+    execution_success: Mapped[Optional[bool]] = mapped_column(Boolean)
+    execution_result: Mapped[Optional[Any]] = mapped_column(JSON, deferred=True, deferred_group="payload")
 
     # 上下文信息
-    conversation_context = Column(JSON)
-    similar_history_ids = Column(JSON)  # 检索到的相似历史记录ID列表
+    conversation_context: Mapped[Optional[Any]] = mapped_column(JSON, deferred=True, deferred_group="payload")
+    similar_history_ids: Mapped[Optional[Any]] = mapped_column(
+        JSON, deferred=True, deferred_group="payload"
+    )  # 检索到的相似历史记录ID列表
 
     # 时间戳
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
-    confirmed_at = Column(DateTime)
-    executed_at = Column(DateTime)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    confirmed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    executed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
 
     def __repr__(self):
         return f"<ToolCallHistory(id={self.id}, tool={self.tool_name}, user={self.user_id})>"
@@ -55,61 +70,66 @@ class ToolCallHistory(Base):
 class MCPService(Base):
     """MCP服务注册表"""
     __tablename__ = "mcp_services"
+    __table_args__ = (
+        # 活跃服务查询：WHERE is_active [AND layer=?]
+        Index("ix_mcp_services_active_layer", "layer", postgresql_where=text("is_active")),
+    )
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    service_name = Column(String(256), unique=True, index=True, nullable=False)
-    service_url = Column(String(512))
-    description = Column(Text)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    service_name: Mapped[str] = mapped_column(String(256), unique=True, index=True)
+    service_url: Mapped[Optional[str]] = mapped_column(String(512))
+    description: Mapped[Optional[str]] = mapped_column(Text)
 
     # 工具信息
-    tools = Column(JSON)  # 该服务提供的所有工具列表
+    tools: Mapped[Optional[Any]] = mapped_column(JSON)  # 该服务提供的所有工具列表
 
     # 分层信息
-    layer = Column(String(16), index=True)  # L1, L2, L3
-    domain = Column(String(64), index=True)  # weather, email, etc.
+    layer: Mapped[Optional[str]] = mapped_column(String(16), index=True)  # L1, L2, L3
+    domain: Mapped[Optional[str]] = mapped_column(String(64), index=True)  # weather, email, etc.
 
     # 状态信息
-    is_active = Column(Boolean, default=True, index=True)
-    health_status = Column(String(32), default="healthy")  # healthy, degraded, down
+    is_active: Mapped[Optional[bool]] = mapped_column(Boolean, default=True, index=True)
+    health_status: Mapped[Optional[str]] = mapped_column(String(32), default="healthy")  # healthy, degraded, down
 
     # 监控指标
-    total_calls = Column(Integer, default=0)
-    success_calls = Column(Integer, default=0)
-    failed_calls = Column(Integer, default=0)
-    avg_latency_ms = Column(Float, default=0.0)
+    total_calls: Mapped[Optional[int]] = mapped_column(Integer, default=0)
+    success_calls: Mapped[Optional[int]] = mapped_column(Integer, default=0)
+    failed_calls: Mapped[Optional[int]] = mapped_column(Integer, default=0)
+    avg_latency_ms: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
 
     # 熔断状态
-    circuit_breaker_state = Column(String(16), default="closed")  # closed, open, half_open
-    circuit_breaker_opened_at = Column(DateTime)
+    circuit_breaker_state: Mapped[Optional[str]] = mapped_column(String(16), default="closed")  # closed, open, half_open
+    circuit_breaker_opened_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
 
     # 时间戳
-    registered_at = Column(DateTime, default=datetime.utcnow)
-    last_health_check = Column(DateTime)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    registered_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    last_health_check: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f"<MCPService(id={self.id}, name={self.service_name}, status={self.health_status})>"
 
 
 class ToolCallMetrics(Base):
-    """工具调用指标"""
+    """工具调用指标（按 timestamp 按月范围分区，分区由 PostgreSQLManager 维护）"""
     __tablename__ = "tool_call_metrics"
+    __table_args__ = {"postgresql_partition_by": 'RANGE ("timestamp")'}
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    tool_name = Column(String(256), index=True, nullable=False)
-    service_id = Column(Integer, index=True)  # 关联的MCP服务ID
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    tool_name: Mapped[str] = mapped_column(String(256), index=True)
+    service_id: Mapped[Optional[int]] = mapped_column(Integer, index=True)  # 关联的MCP服务ID
 
     # 调用信息
-    request_id = Column(String(64), index=True)
-    user_id = Column(String(128), index=True)
+    request_id: Mapped[Optional[str]] = mapped_column(String(64), index=True)
+    user_id: Mapped[Optional[str]] = mapped_column(String(128), index=True)
 
     # 性能指标
-    latency_ms = Column(Float)
-    success = Column(Boolean)
-    error_message = Column(Text)
+    latency_ms: Mapped[Optional[float]] = mapped_column(Float)
+    success: Mapped[Optional[bool]] = mapped_column(Boolean)
+    error_message: Mapped[Optional[str]] = mapped_column(Text)
 
-    # 时间戳
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    # 时间戳（分区键，分区表的主键必须包含分区键）
+    timestamp: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=datetime.utcnow, index=True)
 
     def __repr__(self):
         return f"<ToolCallMetrics(tool={self.tool_name}, success={self.success})>"
@@ -119,23 +139,23 @@ class UserPreference(Base):
     """用户偏好设置"""
     __tablename__ = "user_preferences"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(String(128), unique=True, index=True, nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[str] = mapped_column(String(128), unique=True, index=True)
 
     # 风险偏好
-    risk_threshold = Column(Float, default=0.6)  # 个性化的风险阈值
-    auto_confirm_tools = Column(JSON)  # 用户信任的工具列表，无需确认
+    risk_threshold: Mapped[Optional[float]] = mapped_column(Float, default=0.6)  # 个性化的风险阈值
+    auto_confirm_tools: Mapped[Optional[Any]] = mapped_column(JSON)  # 用户信任的工具列表，无需确认
 
     # 工具偏好
-    preferred_tools = Column(JSON)  # 用户偏好的工具
-    blocked_tools = Column(JSON)  # 用户屏蔽的工具
+    preferred_tools: Mapped[Optional[Any]] = mapped_column(JSON)  # 用户偏好的工具
+    blocked_tools: Mapped[Optional[Any]] = mapped_column(JSON)  # 用户屏蔽的工具
 
     # 设置
-    settings = Column(JSON)
+    settings: Mapped[Optional[Any]] = mapped_column(JSON)
 
     # 时间戳
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f"<UserPreference(user_id={self.user_id})>"
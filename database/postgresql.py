@@ -2,18 +2,62 @@
 PostgreSQL数据库连接和操作
 """
 import asyncio
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import AsyncGenerator, List, Optional, Dict, Any, Tuple
+from datetime import date, datetime
 from contextlib import asynccontextmanager
 
-from sqlalchemy import create_engine, select, update, delete
+from sqlalchemy import Integer, String, any_, bindparam, case, column, create_engine, func, select, insert, update, delete, text, tuple_, values, or_
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, undefer_group
+import orjson
 from loguru import logger
 
 from database.models import Base, ToolCallHistory, MCPService, ToolCallMetrics, UserPreference
+from utils.cache import TTLCache
 
 
+# 指标写入队列中记录的列顺序（与COPY的列一一对应）
+_METRIC_COLUMNS = (
+    "tool_name", "service_id", "request_id", "user_id",
+    "latency_ms", "success", "error_message", "timestamp"
+)
+
+# 服务缓存中表示"服务不存在"的占位值（与未命中区分）
+_MISSING_SERVICE = object()
+
+# 固定形状的高频单行查询，模块加载时构建一次，执行时只传参数
+_GET_MCP_SERVICE = select(MCPService).where(MCPService.service_name == bindparam("service_name"))
+_GET_CIRCUIT_BREAKER = select(
+    MCPService.circuit_breaker_state,
+    MCPService.circuit_breaker_opened_at
+).where(MCPService.service_name == bindparam("service_name"))
+_GET_USER_PREFERENCE = select(UserPreference).where(UserPreference.user_id == bindparam("user_id"))
+
+
+def _json_serializer(value: Any) -> str:
+    """JSON列的序列化（orjson，兼容标准库对非字符串键的处理）"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _request_records(request_id: str):
+    """
+    匹配一次请求的全部工具调用记录
+
+    同一请求的第一个工具调用记录使用请求ID本身，其余为 "<请求ID>:<序号>"；
+    传入带序号的记录ID时只匹配该条记录。
+    """
+    return or_(
+        ToolCallHistory.request_id == request_id,
+        ToolCallHistory.request_id.startswith(f"{request_id}:", autoescape=True)
+    )
+
+
+def _db_utcnow():
+    """由数据库生成的当前UTC时间（与模型中 datetime.utcnow 默认值同为不带时区的UTC时间）"""
+    return func.timezone("UTC", func.now())
+
 class PostgreSQLManager:
     """PostgreSQL数据库管理器"""
 
@@ -33,11 +77,56 @@ class PostgreSQLManager:
             f"@{pg_config['host']}:{pg_config['port']}/{pg_config['database']}"
         )
 
+        # 指标表分区：提前创建的月分区数量
+        self.partition_months_ahead = pg_config.get("partition_months_ahead", 2)
+        self._partition_task: Optional[asyncio.Task] = None
+
+        # 指标写入队列：后台任务攒批后写入，单批达到 metrics_copy_threshold 条时改用COPY
+        self.metrics_batch_size = pg_config.get("metrics_batch_size", 500)
+        self.metrics_flush_interval = pg_config.get("metrics_flush_ms", 100) / 1000.0
+        self.metrics_copy_threshold = pg_config.get("metrics_copy_threshold", 100)
+        self._metrics_queue: asyncio.Queue = asyncio.Queue()
+        self._metrics_task: Optional[asyncio.Task] = None
+
+        # MCP服务元数据缓存（按服务名，含不存在服务的负缓存），服务变更时失效
+        self.service_cache_negative_ttl = pg_config.get("service_cache_negative_ttl", 10)
+        self._service_cache = TTLCache(
+            max_size=pg_config.get("service_cache_size", 2048),
+            ttl=pg_config.get("service_cache_ttl", 60)
+        )
+        self._active_services_cache = TTLCache(max_size=16, ttl=pg_config.get("service_cache_ttl", 60))
+
+        # 连接池配置
+        self.pool_size = pg_config.get("pool_size", 10)
+        self.max_overflow = pg_config.get("max_overflow", 20)
+        # 启动时预先建立的连接数，避免首批请求承担建连开销
+        self.warmup_connections = min(pg_config.get("warmup_connections", self.pool_size), self.pool_size)
+
+        # 预处理语句缓存（asyncpg连接级 + SQLAlchemy方言级），同一SQL模板只解析一次；
+        # 经PgBouncer事务池连接时，连接可能在事务间被切换，需禁用
+        statement_cache_size = pg_config.get("statement_cache_size", 1024)
+        if pg_config.get("pgbouncer", False):
+            statement_cache_size = 0
+        connect_args = {
+            "statement_cache_size": statement_cache_size,
+            "prepared_statement_cache_size": statement_cache_size
+        }
+        # 本服务的查询都很短，关闭JIT避免规划阶段的编译开销
+        if not pg_config.get("jit", False):
+            connect_args["server_settings"] = {"jit": "off"}
+
         # 创建异步引擎
         self.engine = create_async_engine(
             self.db_url,
-            pool_size=pg_config.get("pool_size", 10),
-            max_overflow=pg_config.get("max_overflow", 20),
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=pg_config.get("pool_timeout", 30),
+            pool_recycle=pg_config.get("pool_recycle", 3600),
+            pool_pre_ping=pg_config.get("pool_pre_ping", True),
+            connect_args=connect_args,
+            # JSON列（tool_parameters、execution_result、tools等）使用orjson编解码
+            json_serializer=_json_serializer,
+            json_deserializer=orjson.loads,
             echo=False
         )
 
@@ -47,6 +136,13 @@ class PostgreSQLManager:
             class_=AsyncSession,
             expire_on_commit=False
         )
+        # 只读会话：连接处于自动提交模式，查询不发送BEGIN/COMMIT
+        self.read_session_maker = async_sessionmaker(
+            self.engine.execution_options(isolation_level="AUTOCOMMIT"),
+            class_=AsyncSession,
+            expire_on_commit=False,
+            autoflush=False
+        )
 
         logger.info(f"PostgreSQL manager initialized: {pg_config['host']}:{pg_config['port']}/{pg_config['database']}")
 
@@ -55,6 +151,128 @@ class PostgreSQLManager:
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
         logger.info("Database tables created successfully")
+        await self.ensure_metrics_partitions()
+        await self.warm_up_pool()
+
+    async def warm_up_pool(self):
+        """并发建立 warmup_connections 个连接并放回连接池"""
+        if self.warmup_connections <= 0:
+            return
+
+        # 先同时持有全部连接再归还，确保建立的是不同的连接
+        results = await asyncio.gather(
+            *(self.engine.connect() for _ in range(self.warmup_connections)),
+            return_exceptions=True
+        )
+        conns = [c for c in results if not isinstance(c, BaseException)]
+        try:
+            await asyncio.gather(*(c.execute(text("SELECT 1")) for c in conns))
+        finally:
+            await asyncio.gather(*(c.close() for c in conns), return_exceptions=True)
+
+        failed = len(results) - len(conns)
+        if failed:
+            logger.warning(f"Pool warm-up: {failed}/{len(results)} connections failed")
+        logger.info(f"Warmed up {len(conns)} database connections")
+
+    async def ensure_metrics_partitions(self, today: Optional[date] = None):
+        """
+        为按月分区的 tool_call_metrics 创建默认分区以及当月起若干个月的月分区（幂等）
+
+        Args:
+            today: 计算月份的基准日期，默认当天
+        """
+        table = ToolCallMetrics.__tablename__
+        today = today or datetime.utcnow().date()
+
+        async with self.engine.begin() as conn:
+            relkind = await conn.scalar(
+                text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+                {"name": table}
+            )
+            if relkind != "p":
+                # 旧版本创建的非分区表不会被 create_all 修改，需要手动迁移
+                logger.warning(f"Table {table} is not partitioned, skipping partition maintenance")
+                return
+
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"
+            ))
+
+        year, month = today.year, today.month
+        for _ in range(self.partition_months_ahead + 1):
+            next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            partition = f"{table}_{year}_{month:02d}"
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{year}-{month:02d}-01') TO ('{next_year}-{next_month:02d}-01')"
+                    ))
+            except Exception as e:
+                # 默认分区中已有该月数据时无法再拆出月分区
+                logger.warning(f"Failed to create partition {partition}: {e}")
+            year, month = next_year, next_month
+
+        logger.debug("Ensured partitions for {}", table)
+
+    def start_partition_maintenance(self, interval: float = 86400):
+        """启动后台任务，每天检查并提前创建后续月份的分区"""
+        if self._partition_task is None:
+            self._partition_task = asyncio.create_task(self._partition_maintenance_loop(interval))
+
+    async def _partition_maintenance_loop(self, interval: float):
+        """定期维护指标表分区"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.ensure_metrics_partitions()
+            except Exception as e:
+                logger.error(f"Partition maintenance failed: {e}")
+
+    def start_metrics_flusher(self):
+        """启动后台指标写入任务"""
+        if self._metrics_task is None:
+            self._metrics_task = asyncio.create_task(self._flush_metrics_loop())
+
+    async def _flush_metrics_loop(self):
+        """从队列中攒批（最多 metrics_batch_size 条或等待 metrics_flush_ms）后写入"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._metrics_queue.get()]
+            deadline = loop.time() + self.metrics_flush_interval
+            while len(batch) < self.metrics_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._metrics_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write_metrics(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} tool call metrics: {e}")
+            finally:
+                for _ in batch:
+                    self._metrics_queue.task_done()
+
+    async def _write_metrics(self, records: List[tuple]):
+        """写入一批指标记录：数量较少时用INSERT executemany，否则用COPY"""
+        if len(records) < self.metrics_copy_threshold:
+            await self.record_tool_call_metrics_bulk([dict(zip(_METRIC_COLUMNS, r)) for r in records])
+            return
+
+        async with self.engine.begin() as conn:
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                ToolCallMetrics.__tablename__,
+                records=records,
+                columns=_METRIC_COLUMNS
+            )
+        logger.debug("Copied {} tool call metrics", len(records))
 
     @asynccontextmanager
     async def get_session(self):
@@ -68,6 +286,16 @@ class PostgreSQLManager:
                 logger.error(f"Database session error: {e}")
                 raise
 
+    @asynccontextmanager
+    async def get_read_session(self):
+        """获取只读会话的上下文管理器（纯查询使用，不提交）"""
+        async with self.read_session_maker() as session:
+            try:
+                yield session
+            except Exception as e:
+                logger.error(f"Database session error: {e}")
+                raise
+
     # ==================== ToolCallHistory操作 ====================
 
     async def create_tool_call_history(
@@ -81,9 +309,9 @@ class PostgreSQLManager:
         requires_confirmation: bool,
         **kwargs
     ) -> ToolCallHistory:
-        """创建工具调用历史记录"""
+        """创建工具调用历史记录（INSERT ... RETURNING，插入后无需再查询）"""
         async with self.get_session() as session:
-            history = ToolCallHistory(
+            stmt = insert(ToolCallHistory).values(
                 request_id=request_id,
                 user_id=user_id,
                 user_question=user_question,
@@ -92,32 +320,73 @@ class PostgreSQLManager:
                 risk_score=risk_score,
                 requires_confirmation=requires_confirmation,
                 **kwargs
-            )
-            session.add(history)
-            await session.flush()
-            await session.refresh(history)
-            logger.info(f"Created tool call history: {request_id}")
+            ).returning(ToolCallHistory)
+            result = await session.execute(stmt)
+            history = result.scalar_one()
+            logger.debug("Created tool call history: {}", request_id)
             return history
 
+    async def create_tool_call_histories_bulk(self, rows: List[Dict[str, Any]]) -> List[Optional[int]]:
+        """
+        批量创建工具调用历史记录（单条多行INSERT）
+
+        批次中任一行违反约束（如重复的request_id）时整条INSERT回滚，
+        此时改为逐行插入，只有出错的行被丢弃，不影响同批其他请求的记录。
+
+        Args:
+            rows: 记录字典列表，各字典的键需一致
+
+        Returns:
+            与输入顺序一致的记录ID列表，插入失败的行为None
+        """
+        if not rows:
+            return []
+
+        try:
+            async with self.get_session() as session:
+                stmt = insert(ToolCallHistory).returning(
+                    ToolCallHistory.id,
+                    sort_by_parameter_order=True
+                )
+                result = await session.execute(stmt, rows)
+                ids = list(result.scalars().all())
+                logger.debug("Created {} tool call histories", len(ids))
+                return ids
+        except IntegrityError as e:
+            logger.warning(f"Bulk insert of {len(rows)} tool call histories failed, retrying row by row: {e}")
+
+        ids = []
+        for row in rows:
+            try:
+                async with self.get_session() as session:
+                    result = await session.execute(
+                        insert(ToolCallHistory).values(**row).returning(ToolCallHistory.id)
+                    )
+                    ids.append(result.scalar_one())
+            except IntegrityError as e:
+                logger.error(f"Failed to create tool call history {row.get('request_id')}: {e}")
+                ids.append(None)
+        return ids
+
     async def update_tool_call_confirmation(
         self,
         request_id: str,
         user_confirmed: bool,
         user_feedback: Optional[str] = None
     ) -> bool:
-        """更新工具调用确认状态"""
+        """更新工具调用确认状态（请求ID对应该请求的全部工具调用记录）"""
         async with self.get_session() as session:
             stmt = (
                 update(ToolCallHistory)
-                .where(ToolCallHistory.request_id == request_id)
+                .where(_request_records(request_id))
                 .values(
                     user_confirmed=user_confirmed,
                     user_feedback=user_feedback,
-                    confirmed_at=datetime.utcnow()
+                    confirmed_at=_db_utcnow()
                 )
             )
             result = await session.execute(stmt)
-            logger.info(f"Updated confirmation for {request_id}: {user_confirmed}")
+            logger.debug("Updated confirmation for {}: {}", request_id, user_confirmed)
             return result.rowcount > 0
 
     async def update_tool_call_execution(
@@ -126,47 +395,144 @@ class PostgreSQLManager:
         execution_success: bool,
         execution_result: Optional[Dict] = None
     ) -> bool:
-        """更新工具调用执行结果"""
+        """更新工具调用执行结果（请求ID对应该请求的全部工具调用记录）"""
         async with self.get_session() as session:
             stmt = (
                 update(ToolCallHistory)
-                .where(ToolCallHistory.request_id == request_id)
+                .where(_request_records(request_id))
                 .values(
                     execution_success=execution_success,
                     execution_result=execution_result,
-                    executed_at=datetime.utcnow()
+                    executed_at=_db_utcnow()
                 )
             )
             result = await session.execute(stmt)
-            logger.info(f"Updated execution for {request_id}: {execution_success}")
+            logger.debug("Updated execution for {}: {}", request_id, execution_success)
             return result.rowcount > 0
 
-    async def get_tool_call_history(self, request_id: str) -> Optional[ToolCallHistory]:
-        """根据request_id获取工具调用历史"""
-        async with self.get_session() as session:
-            stmt = select(ToolCallHistory).where(ToolCallHistory.request_id == request_id)
+    async def get_tool_call_histories(self, request_id: str) -> List[ToolCallHistory]:
+        """
+        根据request_id获取工具调用历史（按写入顺序）
+
+        传入请求ID时返回该请求全部工具调用的记录，传入带序号的记录ID时只返回该条记录。
+        """
+        async with self.get_read_session() as session:
+            stmt = (
+                select(ToolCallHistory)
+                .where(_request_records(request_id))
+                .options(undefer_group("payload"))
+                .order_by(ToolCallHistory.id)
+            )
             result = await session.execute(stmt)
-            return result.scalar_one_or_none()
+            return list(result.scalars().all())
 
     async def get_user_tool_history(
         self,
         user_id: str,
         limit: int = 100,
-        tool_name: Optional[str] = None
+        tool_name: Optional[str] = None,
+        before: Optional[datetime] = None,
+        before_id: Optional[int] = None
     ) -> List[ToolCallHistory]:
-        """获取用户的工具调用历史"""
-        async with self.get_session() as session:
-            stmt = select(ToolCallHistory).where(ToolCallHistory.user_id == user_id)
+        """
+        获取用户的工具调用历史（按创建时间、ID倒序）
+
+        before/before_id 为上一页最后一条的 created_at 和 id（键集分页），
+        走 (user_id, [tool_name,] created_at, id) 索引，翻页深度不影响查询代价；
+        同一事务批量写入的记录 created_at 相同，需要 id 区分，不会在翻页边界漏掉。
+        """
+        async with self.get_read_session() as session:
+            stmt = (
+                select(ToolCallHistory)
+                .where(ToolCallHistory.user_id == user_id)
+                .options(undefer_group("payload"))
+            )
             if tool_name:
                 stmt = stmt.where(ToolCallHistory.tool_name == tool_name)
-            stmt = stmt.order_by(ToolCallHistory.created_at.desc()).limit(limit)
+            stmt = self._history_page(stmt, limit, before, before_id)
             result = await session.execute(stmt)
             return list(result.scalars().all())
 
-    async def get_history_by_ids(self, history_ids: List[int]) -> List[ToolCallHistory]:
-        """根据ID列表批量获取历史记录"""
+    async def get_user_tool_history_rows(
+        self,
+        user_id: str,
+        limit: int = 100,
+        tool_name: Optional[str] = None,
+        before: Optional[datetime] = None,
+        before_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """获取用户的工具调用历史摘要（仅查询列表所需字段，不构建ORM对象；before/before_id 同 get_user_tool_history）"""
+        async with self.get_read_session() as session:
+            stmt = self._user_history_rows_stmt(user_id, limit, tool_name, before, before_id)
+            result = await session.execute(stmt)
+            return [dict(row) for row in result.mappings()]
+
+    async def stream_user_tool_history_rows(
+        self,
+        user_id: str,
+        limit: int = 100,
+        tool_name: Optional[str] = None,
+        before: Optional[datetime] = None,
+        before_id: Optional[int] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        逐行返回用户的工具调用历史摘要（服务端游标分批读取，不在内存中构建完整列表）
+
+        服务端游标需要在事务内使用，因此使用普通会话而非只读会话。
+        """
         async with self.get_session() as session:
-            stmt = select(ToolCallHistory).where(ToolCallHistory.id.in_(history_ids))
+            stmt = self._user_history_rows_stmt(user_id, limit, tool_name, before, before_id)
+            result = await session.stream(stmt.execution_options(yield_per=100))
+            async for row in result.mappings():
+                yield dict(row)
+
+    @staticmethod
+    def _user_history_rows_stmt(
+        user_id: str,
+        limit: int,
+        tool_name: Optional[str],
+        before: Optional[datetime],
+        before_id: Optional[int]
+    ):
+        """构建历史摘要查询"""
+        stmt = select(
+            ToolCallHistory.id,
+            ToolCallHistory.request_id,
+            ToolCallHistory.user_question,
+            ToolCallHistory.tool_name,
+            ToolCallHistory.risk_score,
+            ToolCallHistory.user_confirmed,
+            ToolCallHistory.execution_success,
+            ToolCallHistory.created_at
+        ).where(ToolCallHistory.user_id == user_id)
+        if tool_name:
+            stmt = stmt.where(ToolCallHistory.tool_name == tool_name)
+        return PostgreSQLManager._history_page(stmt, limit, before, before_id)
+
+    @staticmethod
+    def _history_page(stmt, limit: int, before: Optional[datetime], before_id: Optional[int]):
+        """为历史查询加上键集分页条件和 (created_at, id) 倒序排序"""
+        if before and before_id is not None:
+            stmt = stmt.where(
+                tuple_(ToolCallHistory.created_at, ToolCallHistory.id) < tuple_(before, before_id)
+            )
+        elif before:
+            stmt = stmt.where(ToolCallHistory.created_at < before)
+        return stmt.order_by(ToolCallHistory.created_at.desc(), ToolCallHistory.id.desc()).limit(limit)
+
+    async def get_history_by_ids(
+        self,
+        history_ids: List[int],
+        user_id: Optional[str] = None
+    ) -> List[ToolCallHistory]:
+        """根据ID列表批量获取历史记录（可按用户过滤）"""
+        async with self.get_read_session() as session:
+            # 单个数组参数：不同长度的ID列表共用同一条预处理语句
+            stmt = select(ToolCallHistory).where(
+                ToolCallHistory.id == any_(bindparam("ids", list(history_ids), type_=ARRAY(Integer)))
+            )
+            if user_id:
+                stmt = stmt.where(ToolCallHistory.user_id == user_id)
             result = await session.execute(stmt)
             return list(result.scalars().all())
 
@@ -181,37 +547,91 @@ class PostgreSQLManager:
         layer: str,
         domain: Optional[str] = None
     ) -> MCPService:
-        """注册MCP服务"""
+        """注册MCP服务（INSERT ... RETURNING，插入后无需再查询）"""
         async with self.get_session() as session:
-            service = MCPService(
+            stmt = insert(MCPService).values(
                 service_name=service_name,
                 service_url=service_url,
                 description=description,
                 tools=tools,
                 layer=layer,
                 domain=domain
-            )
-            session.add(service)
-            await session.flush()
-            await session.refresh(service)
-            logger.info(f"Registered MCP service: {service_name}")
-            return service
+            ).returning(MCPService)
+            result = await session.execute(stmt)
+            service = result.scalar_one()
+        self._invalidate_service(service_name)
+        logger.info(f"Registered MCP service: {service_name}")
+        return service
+
+    def _invalidate_service(self, service_name: str):
+        """服务信息变更后清除相关缓存"""
+        self._service_cache.invalidate(service_name)
+        self._active_services_cache.clear()
+
+    def service_cache_stats(self) -> Dict[str, Any]:
+        """获取服务缓存统计信息"""
+        return self._service_cache.stats()
 
     async def get_mcp_service(self, service_name: str) -> Optional[MCPService]:
-        """获取MCP服务"""
-        async with self.get_session() as session:
-            stmt = select(MCPService).where(MCPService.service_name == service_name)
-            result = await session.execute(stmt)
-            return result.scalar_one_or_none()
+        """获取MCP服务（优先读取缓存，返回的对象为只读快照）"""
+        cached = self._service_cache.get(service_name, _MISSING_SERVICE)
+        if cached is not _MISSING_SERVICE:
+            return cached
+
+        async with self.get_read_session() as session:
+            result = await session.execute(_GET_MCP_SERVICE, {"service_name": service_name})
+            service = result.scalar_one_or_none()
+
+        if service is None:
+            self._service_cache.set(service_name, None, ttl=self.service_cache_negative_ttl)
+        else:
+            self._service_cache.set(service_name, service)
+        return service
 
     async def get_active_services(self, layer: Optional[str] = None) -> List[MCPService]:
-        """获取活跃的MCP服务"""
-        async with self.get_session() as session:
+        """获取活跃的MCP服务（优先读取缓存）"""
+        services = self._active_services_cache.get(layer)
+        if services is not None:
+            return list(services)
+
+        async with self.get_read_session() as session:
             stmt = select(MCPService).where(MCPService.is_active == True)
             if layer:
                 stmt = stmt.where(MCPService.layer == layer)
             result = await session.execute(stmt)
-            return list(result.scalars().all())
+            services = list(result.scalars().all())
+
+        self._active_services_cache.set(layer, services)
+        return list(services)
+
+    async def get_service_rows(
+        self,
+        layer: Optional[str] = None,
+        active_only: bool = True
+    ) -> List[Dict[str, Any]]:
+        """获取服务列表摘要（单次查询，工具数量由数据库计算，不构建ORM对象）"""
+        tool_count = case(
+            (func.json_typeof(MCPService.tools) == "array", func.json_array_length(MCPService.tools)),
+            else_=0
+        )
+        async with self.get_read_session() as session:
+            stmt = select(
+                MCPService.service_name,
+                MCPService.description,
+                MCPService.layer,
+                MCPService.domain,
+                MCPService.is_active,
+                MCPService.health_status,
+                MCPService.circuit_breaker_state,
+                tool_count.label("tool_count"),
+                MCPService.tools
+            )
+            if active_only:
+                stmt = stmt.where(MCPService.is_active == True)
+            if layer:
+                stmt = stmt.where(MCPService.layer == layer)
+            result = await session.execute(stmt)
+            return [dict(row) for row in result.mappings()]
 
     async def update_service_health(
         self,
@@ -223,12 +643,12 @@ class PostgreSQLManager:
         async with self.get_session() as session:
             values = {
                 "health_status": health_status,
-                "last_health_check": datetime.utcnow()
+                "last_health_check": _db_utcnow()
             }
             if circuit_breaker_state:
                 values["circuit_breaker_state"] = circuit_breaker_state
                 if circuit_breaker_state == "open":
-                    values["circuit_breaker_opened_at"] = datetime.utcnow()
+                    values["circuit_breaker_opened_at"] = _db_utcnow()
 
             stmt = (
                 update(MCPService)
@@ -236,49 +656,128 @@ class PostgreSQLManager:
                 .values(**values)
             )
             result = await session.execute(stmt)
-            return result.rowcount > 0
+        self._invalidate_service(service_name)
+        return result.rowcount > 0
 
-    async def update_service_metrics(
+    async def get_circuit_breaker_state(self, service_name: str) -> Optional[Tuple[str, Optional[datetime]]]:
+        """
+        直接从数据库读取熔断器状态（不经过服务缓存，用于与其他worker同步）
+
+        Returns:
+            (熔断器状态, 打开时间)，服务不存在时返回None
+        """
+        async with self.get_read_session() as session:
+            result = await session.execute(_GET_CIRCUIT_BREAKER, {"service_name": service_name})
+            row = result.one_or_none()
+        if row is None:
+            return None
+        return row.circuit_breaker_state or "closed", row.circuit_breaker_opened_at
+
+    async def transition_circuit_breaker(
         self,
         service_name: str,
-        success: bool,
-        latency_ms: float
+        from_state: str,
+        to_state: str,
+        health_status: Optional[str] = None
     ) -> bool:
-        """更新服务调用指标"""
+        """
+        条件切换熔断器状态（单条UPDATE，仅当当前状态为 from_state 时生效，并发调用只有一个成功）
+
+        Args:
+            service_name: 服务名称
+            from_state: 期望的当前状态
+            to_state: 目标状态
+            health_status: 同时更新的健康状态（None表示不变）
+
+        Returns:
+            是否完成了切换
+        """
+        values: Dict[str, Any] = {"circuit_breaker_state": to_state}
+        if to_state == "open":
+            values["circuit_breaker_opened_at"] = _db_utcnow()
+        if health_status:
+            values["health_status"] = health_status
+
         async with self.get_session() as session:
-            # 先获取当前服务
-            service = await self.get_mcp_service(service_name)
-            if not service:
-                return False
+            stmt = (
+                update(MCPService)
+                .where(
+                    MCPService.service_name == service_name,
+                    func.coalesce(MCPService.circuit_breaker_state, "closed") == from_state
+                )
+                .values(**values)
+            )
+            result = await session.execute(stmt)
+
+        self._invalidate_service(service_name)
+        return result.rowcount > 0
 
-            # 更新统计
-            total_calls = service.total_calls + 1
-            success_calls = service.success_calls + (1 if success else 0)
-            failed_calls = service.failed_calls + (0 if success else 1)
+    async def update_services_health_bulk(self, statuses: Dict[str, str]) -> int:
+        """
+        批量更新服务健康状态（单条 UPDATE ... FROM (VALUES ...)）
+
+        Args:
+            statuses: {service_name: health_status}
 
-            # 计算平均延迟
-            avg_latency = (service.avg_latency_ms * service.total_calls + latency_ms) / total_calls
+        Returns:
+            更新的行数
+        """
+        if not statuses:
+            return 0
+
+        rows = values(
+            column("service_name", String),
+            column("health_status", String),
+            name="v"
+        ).data(list(statuses.items()))
 
+        async with self.get_session() as session:
+            stmt = (
+                update(MCPService)
+                .where(MCPService.service_name == rows.c.service_name)
+                .values(
+                    health_status=rows.c.health_status,
+                    last_health_check=_db_utcnow()
+                )
+            )
+            result = await session.execute(stmt)
+
+        for service_name in statuses:
+            self._service_cache.invalidate(service_name)
+        self._active_services_cache.clear()
+        return result.rowcount
+
+    async def update_service_metrics(
+        self,
+        service_name: str,
+        success: bool,
+        latency_ms: float
+    ) -> bool:
+        """更新服务调用指标（单条UPDATE在数据库端累加，无需先查询，并发更新也不会丢失）"""
+        async with self.get_session() as session:
             stmt = (
                 update(MCPService)
                 .where(MCPService.service_name == service_name)
                 .values(
-                    total_calls=total_calls,
-                    success_calls=success_calls,
-                    failed_calls=failed_calls,
-                    avg_latency_ms=avg_latency
+                    total_calls=MCPService.total_calls + 1,
+                    success_calls=MCPService.success_calls + (1 if success else 0),
+                    failed_calls=MCPService.failed_calls + (0 if success else 1),
+                    avg_latency_ms=(
+                        (MCPService.avg_latency_ms * MCPService.total_calls + latency_ms)
+                        / (MCPService.total_calls + 1)
+                    )
                 )
             )
             result = await session.execute(stmt)
-            return result.rowcount > 0
+        self._invalidate_service(service_name)
+        return result.rowcount > 0
 
     # ==================== UserPreference操作 ====================
 
     async def get_user_preference(self, user_id: str) -> Optional[UserPreference]:
         """获取用户偏好"""
-        async with self.get_session() as session:
-            stmt = select(UserPreference).where(UserPreference.user_id == user_id)
-            result = await session.execute(stmt)
+        async with self.get_read_session() as session:
+            result = await session.execute(_GET_USER_PREFERENCE, {"user_id": user_id})
             return result.scalar_one_or_none()
 
     async def create_or_update_user_preference(
@@ -286,22 +785,25 @@ class PostgreSQLManager:
         user_id: str,
         **kwargs
     ) -> UserPreference:
-        """创建或更新用户偏好"""
+        """创建或更新用户偏好（单条 INSERT ... ON CONFLICT DO UPDATE，并发调用不会重复插入）"""
+        columns = UserPreference.__table__.c
+        values = {
+            key: value for key, value in kwargs.items()
+            if key in columns and key not in ("id", "user_id")
+        }
+
         async with self.get_session() as session:
-            pref = await self.get_user_preference(user_id)
-            if pref:
-                # 更新
-                for key, value in kwargs.items():
-                    if hasattr(pref, key):
-                        setattr(pref, key, value)
-                pref.updated_at = datetime.utcnow()
-            else:
-                # 创建
-                pref = UserPreference(user_id=user_id, **kwargs)
-                session.add(pref)
-
-            await session.flush()
-            await session.refresh(pref)
+            stmt = (
+                pg_insert(UserPreference)
+                .values(user_id=user_id, **values)
+                .on_conflict_do_update(
+                    index_elements=[UserPreference.user_id],
+                    set_={**values, "updated_at": _db_utcnow()}
+                )
+                .returning(UserPreference)
+            )
+            result = await session.execute(stmt)
+            pref = result.scalar_one()
             logger.info(f"Updated user preference: {user_id}")
             return pref
 
@@ -317,21 +819,46 @@ class PostgreSQLManager:
         error_message: Optional[str] = None,
         service_id: Optional[int] = None
     ):
-        """记录工具调用指标"""
+        """记录工具调用指标（后台任务已启动时只入队，由其批量写入）"""
+        record = (
+            tool_name, service_id, request_id, user_id,
+            latency_ms, success, error_message, datetime.utcnow()
+        )
+        if self._metrics_task is None:
+            await self._write_metrics([record])
+        else:
+            self._metrics_queue.put_nowait(record)
+
+    async def record_tool_call_metrics_bulk(self, rows: List[Dict[str, Any]]):
+        """
+        批量记录工具调用指标（Core INSERT executemany，不实例化ORM对象）
+
+        Args:
+            rows: 指标字典列表，各字典的键需一致
+        """
+        if not rows:
+            return
+
         async with self.get_session() as session:
-            metric = ToolCallMetrics(
-                tool_name=tool_name,
-                service_id=service_id,
-                request_id=request_id,
-                user_id=user_id,
-                latency_ms=latency_ms,
-                success=success,
-                error_message=error_message
-            )
-            session.add(metric)
-            logger.debug(f"Recorded metric for {tool_name}: {latency_ms}ms, success={success}")
+            await session.execute(insert(ToolCallMetrics), rows)
 
     async def close(self):
         """关闭数据库连接"""
+        if self._metrics_task:
+            # 先写完队列中剩余的指标
+            await self._metrics_queue.join()
+            self._metrics_task.cancel()
+            try:
+                await self._metrics_task
+            except asyncio.CancelledError:
+                pass
+            self._metrics_task = None
+        if self._partition_task:
+            self._partition_task.cancel()
+            try:
+                await self._partition_task
+            except asyncio.CancelledError:
+                pass
+            self._partition_task = None
         await self.engine.dispose()
         logger.info("PostgreSQL connection closed")
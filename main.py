@@ -2,40 +2,41 @@
 MCP Monitor - 主入口文件
 """
 import asyncio
-import yaml
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from loguru import logger
+from prometheus_client import make_asgi_app
 
 from database import DatabaseManager
 from models import OpenAIAdapter
 from core.orchestrator import MCPOrchestrator
 from api.routes import router
-
-
-# 全局变量
-db_manager = None
-orchestrator = None
+from api.middleware import ConcurrencyLimitMiddleware
+from utils.config_loader import load_config
+from utils.metrics import MetricsMiddleware
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """应用生命周期管理"""
-    global db_manager, orchestrator
+    """应用生命周期管理（各组件挂载到 app.state，不使用模块级全局变量）"""
+    db_manager = None
+    orchestrator = None
 
     logger.info("Starting MCP Monitor...")
 
     try:
-        # 1. 加载配置
-        with open("config/config.yaml", "r", encoding="utf-8") as f:
-            config = yaml.safe_load(f)
+        # 1. 加载配置（读文件和解析放到线程池，不阻塞事件循环）
+        config = await asyncio.to_thread(load_config)
 
         # 2. 初始化数据库
         logger.info("Initializing database...")
         db_manager = DatabaseManager(config)
         await db_manager.init()
+        app.state.db = db_manager
 
         # 3. 初始化模型
         logger.info("Initializing model...")
@@ -49,6 +50,13 @@ async def lifespan(app: FastAPI):
         logger.info("Initializing orchestrator...")
         orchestrator = MCPOrchestrator(db_manager, model, config)
         await orchestrator.start()
+        app.state.orchestrator = orchestrator
+
+        # 5. 并发上限（默认取连接池大小的80%，避免连接池耗尽）
+        pool_size = config.get("database", {}).get("postgresql", {}).get("pool_size", 10)
+        max_concurrency = config.get("server", {}).get("max_concurrency") or max(1, int(pool_size * 0.8))
+        app.state.concurrency_limiter = asyncio.Semaphore(max_concurrency)
+        logger.info(f"Concurrency limit for query endpoints: {max_concurrency}")
 
         logger.info("MCP Monitor started successfully!")
 
@@ -75,7 +83,8 @@ app = FastAPI(
     title="MCP Monitor",
     description="智能MCP工具调用监控和管理系统",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS中间件
@@ -87,9 +96,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩中间件（小于1KB的响应不压缩，压缩级别1以降低CPU开销）
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
+
+# 并发上限中间件（仅限制 /query 与 /confirm）
+app.add_middleware(ConcurrencyLimitMiddleware, queue_timeout=1.0)
+
+# 请求耗时指标中间件（最外层，包含排队与压缩耗时）
+app.add_middleware(MetricsMiddleware)
+
 # 注册路由
 app.include_router(router)
 
+# Prometheus指标端点
+app.mount("/metrics", make_asgi_app())
+
 
 @app.get("/")
 async def root():
@@ -103,6 +124,7 @@ async def root():
 
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
 
     # 配置日志
@@ -113,11 +135,23 @@ if __name__ == "__main__":
         level="INFO"
     )
 
+    server_config = load_config().get("server", {})
+
+    # uvloop不支持Windows，缺失时退回标准asyncio事件循环
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+
     # 启动服务
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=server_config.get("host", "0.0.0.0"),
+        port=server_config.get("port", 8000),
+        # 默认单进程：Faiss索引文件只允许一个写入者，多个worker会互相覆盖自动保存的索引，
+        # 且各进程的检索数据、缓存和熔断状态互不相同
+        workers=server_config.get("workers", 1),
+        loop=loop,
+        http=http,
+        limit_concurrency=server_config.get("limit_concurrency"),
         reload=False,
         log_level="info"
     )
@@ -2,39 +2,63 @@
 MCP服务管理器 - 管理多个MCP服务的生命周期
 """
 import asyncio
-from typing import Dict, Any, List, Optional
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Any, List, Optional
 from datetime import datetime, timedelta
 from loguru import logger
+import httpx
 
 from database import DatabaseManager
+from utils.cache import TTLCache
 
 
 class MCPServiceManager:
     """MCP服务管理器"""
 
-    def __init__(self, db_manager: DatabaseManager, config: Dict[str, Any]):
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        config: Dict[str, Any],
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
         """
         初始化MCP服务管理器
 
         Args:
             db_manager: 数据库管理器
             config: MCP服务配置
+            http_client: 共享HTTP客户端（用于调用MCP服务，未提供时跳过实际探测）
         """
         self.db = db_manager
+        self.http_client = http_client
         self.config = config.get("mcp_services", {})
 
         self.max_services = self.config.get("max_services", 50)
         self.health_check_interval = self.config.get("health_check_interval", 30)
+        # 一轮健康检查中同时探测的服务数上限
+        self.health_check_concurrency = max(1, self.config.get("health_check_concurrency", 8))
         self.timeout = self.config.get("timeout", 10)
 
         # 熔断配置
         circuit_config = self.config.get("circuit_breaker", {})
         self.failure_threshold = circuit_config.get("failure_threshold", 5)
         self.timeout_duration = circuit_config.get("timeout_duration", 60)
+        self.state_sync_interval = circuit_config.get("state_sync_interval", 10)
+
+        # 熔断器状态在进程内维护，只在状态切换时写库，并定期从数据库重新加载
+        # {service_name: 最近 failure_threshold 次失败的时间戳（monotonic）}
+        self._failures: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.failure_threshold))
+        self._breaker_states: Dict[str, str] = {}
+        self._breaker_opened_at: Dict[str, float] = {}
+        self._breaker_synced_at: Dict[str, float] = {}
 
         # 服务实例缓存 {service_name: service_instance}
         self.service_instances = {}
 
+        # 服务工具列表缓存 {service_name: tools}
+        self._tools_cache = TTLCache(max_size=self.max_services * 2, ttl=60)
+
         # 后台任务
         self.health_check_task = None
 
@@ -100,6 +124,7 @@ class MCPServiceManager:
                 layer=layer,
                 domain=domain
             )
+            self._tools_cache.invalidate(service_name)
 
             logger.info(f"Registered MCP service: {service_name}")
             return True
@@ -158,27 +183,7 @@ class MCPServiceManager:
         Returns:
             服务列表
         """
-        if active_only:
-            services = await self.db.get_active_services(layer=layer)
-        else:
-            # 这里需要数据库添加方法获取所有服务
-            services = await self.db.get_active_services(layer=layer)
-
-        result = []
-        for service in services:
-            result.append({
-                "service_name": service.service_name,
-                "description": service.description,
-                "layer": service.layer,
-                "domain": service.domain,
-                "is_active": service.is_active,
-                "health_status": service.health_status,
-                "circuit_breaker_state": service.circuit_breaker_state,
-                "tool_count": len(service.tools) if service.tools else 0,
-                "tools": service.tools
-            })
-
-        return result
+        return await self.db.get_service_rows(layer=layer, active_only=active_only)
 
     async def get_tools_by_service(self, service_name: str) -> List[Dict[str, Any]]:
         """
@@ -190,11 +195,17 @@ class MCPServiceManager:
         Returns:
             工具列表
         """
+        tools = self._tools_cache.get(service_name)
+        if tools is not None:
+            return tools
+
         service = await self.db.get_mcp_service(service_name)
         if not service:
             return []
 
-        return service.tools or []
+        tools = service.tools or []
+        self._tools_cache.set(service_name, tools)
+        return tools
 
     async def check_service_health(self, service_name: str) -> bool:
         """
@@ -206,26 +217,35 @@ class MCPServiceManager:
         Returns:
             是否健康
         """
-        try:
-            # 这里应该实际调用MCP服务的健康检查接口
-            # 简化实现，实际项目中需要HTTP请求
-            service = await self.db.get_mcp_service(service_name)
-            if not service:
-                return False
+        service = await self.db.get_mcp_service(service_name)
+        if not service:
+            return False
 
-            # 模拟健康检查
-            # 实际实现: response = await http_client.get(f"{service.service_url}/health")
-            is_healthy = True
+        is_healthy = await self._probe_service(service)
+        await self.db.update_service_health(service_name, "healthy" if is_healthy else "down")
+        return is_healthy
 
-            # 更新健康状态
-            health_status = "healthy" if is_healthy else "down"
-            await self.db.update_service_health(service_name, health_status)
+    async def _probe_service(self, service: Any) -> bool:
+        """
+        调用MCP服务的健康检查接口（复用共享连接，不写数据库）
 
-            return is_healthy
+        Args:
+            service: 已加载的服务对象
 
+        Returns:
+            是否健康
+        """
+        if not (self.http_client and service.service_url):
+            return True
+
+        try:
+            response = await self.http_client.get(
+                f"{service.service_url.rstrip('/')}/health",
+                timeout=self.timeout
+            )
+            return response.status_code < 500
         except Exception as e:
-            logger.error(f"Health check failed for {service_name}: {e}")
-            await self.db.update_service_health(service_name, "down")
+            logger.error(f"Health check failed for {service.service_name}: {e}")
             return False
 
     async def update_circuit_breaker(
@@ -240,54 +260,94 @@ class MCPServiceManager:
             service_name: 服务名称
             success: 调用是否成功
         """
-        service = await self.db.get_mcp_service(service_name)
-        if not service:
-            return
-
-        current_state = service.circuit_breaker_state
-
-        if current_state == "closed":
-            if not success:
-                # 检查失败次数
-                recent_failures = service.failed_calls
-                if recent_failures >= self.failure_threshold:
-                    # 打开熔断器
-                    await self.db.update_service_health(
-                        service_name,
-                        service.health_status,
-                        circuit_breaker_state="open"
-                    )
+        now = time.monotonic()
+        state = self._breaker_states.get(service_name)
+        if state is None or now - self._breaker_synced_at.get(service_name, 0.0) >= self.state_sync_interval:
+            # 首次使用或距上次同步超过间隔时，以数据库中持久化的状态为准
+            state = await self._load_breaker_state(service_name)
+            if state is None:
+                return
+
+        if state == "closed":
+            if success:
+                return
+            # 时间窗口内失败次数达到阈值时打开熔断器
+            failures = self._failures[service_name]
+            failures.append(now)
+            if len(failures) >= self.failure_threshold and now - failures[0] <= self.timeout_duration:
+                if await self._set_breaker_state(service_name, "closed", "open"):
                     logger.warning(f"Circuit breaker opened for {service_name}")
 
-        elif current_state == "open":
+        elif state == "open":
             # 检查是否可以进入半开状态
-            if service.circuit_breaker_opened_at:
-                elapsed = (datetime.utcnow() - service.circuit_breaker_opened_at).total_seconds()
-                if elapsed >= self.timeout_duration:
-                    await self.db.update_service_health(
-                        service_name,
-                        service.health_status,
-                        circuit_breaker_state="half_open"
-                    )
+            if now - self._breaker_opened_at.get(service_name, now) >= self.timeout_duration:
+                if await self._set_breaker_state(service_name, "open", "half_open"):
                     logger.info(f"Circuit breaker half-opened for {service_name}")
 
-        elif current_state == "half_open":
+        elif state == "half_open":
             if success:
                 # 恢复
-                await self.db.update_service_health(
-                    service_name,
-                    "healthy",
-                    circuit_breaker_state="closed"
-                )
-                logger.info(f"Circuit breaker closed for {service_name}")
+                if await self._set_breaker_state(service_name, "half_open", "closed", "healthy"):
+                    logger.info(f"Circuit breaker closed for {service_name}")
             else:
                 # 重新打开
-                await self.db.update_service_health(
-                    service_name,
-                    "degraded",
-                    circuit_breaker_state="open"
-                )
-                logger.warning(f"Circuit breaker re-opened for {service_name}")
+                if await self._set_breaker_state(service_name, "half_open", "open", "degraded"):
+                    logger.warning(f"Circuit breaker re-opened for {service_name}")
+
+    async def _set_breaker_state(
+        self,
+        service_name: str,
+        from_state: str,
+        to_state: str,
+        health_status: Optional[str] = None
+    ) -> bool:
+        """
+        切换熔断器状态并持久化（只在状态变化时写库）
+
+        数据库切换成功后才更新进程内状态；其他worker已先行切换时，
+        重新加载数据库中的状态，避免进程内状态与数据库长期不一致。
+
+        Returns:
+            是否由本次调用完成切换（其他worker已切换时返回False）
+        """
+        switched = await self.db.transition_circuit_breaker(
+            service_name, from_state, to_state, health_status=health_status
+        )
+        if not switched:
+            await self._load_breaker_state(service_name)
+            return False
+
+        now = time.monotonic()
+        self._breaker_states[service_name] = to_state
+        self._breaker_synced_at[service_name] = now
+        if to_state == "open":
+            self._breaker_opened_at[service_name] = now
+        elif to_state == "closed":
+            self._failures.pop(service_name, None)
+        return True
+
+    async def _load_breaker_state(self, service_name: str) -> Optional[str]:
+        """
+        从数据库加载服务的熔断器状态到进程内（直接查库，不读服务缓存）
+
+        Returns:
+            熔断器状态，服务不存在时返回None
+        """
+        persisted = await self.db.get_circuit_breaker_state(service_name)
+        now = time.monotonic()
+        if persisted is None:
+            self._breaker_states.pop(service_name, None)
+            self._breaker_synced_at.pop(service_name, None)
+            return None
+
+        state, opened_at = persisted
+        self._breaker_states[service_name] = state
+        self._breaker_synced_at[service_name] = now
+        if state == "open":
+            # 按数据库中的打开时间换算为monotonic时间，缺失时从现在开始计时
+            elapsed = (datetime.utcnow() - opened_at).total_seconds() if opened_at else 0.0
+            self._breaker_opened_at[service_name] = now - max(0.0, elapsed)
+        return state
 
     async def _health_check_loop(self):
         """后台健康检查循环"""
@@ -299,19 +359,25 @@ class MCPServiceManager:
 
                 # 获取所有活跃服务
                 services = await self.db.get_active_services()
+                if not services:
+                    continue
+
+                # 限制并发探测所有服务，结果汇总后一次性写库
+                semaphore = asyncio.Semaphore(self.health_check_concurrency)
+
+                async def probe(service):
+                    async with semaphore:
+                        return await self._probe_service(service)
 
-                # 并发检查所有服务
-                tasks = [
-                    self.check_service_health(service.service_name)
-                    for service in services
-                ]
-
-                if tasks:
-                    results = await asyncio.gather(*tasks, return_exceptions=True)
-                    healthy_count = sum(1 for r in results if r is True)
-                    logger.debug(
-                        f"Health check completed: {healthy_count}/{len(services)} services healthy"
-                    )
+                results = await asyncio.gather(*(probe(service) for service in services))
+                await self.db.update_services_health_bulk({
+                    service.service_name: "healthy" if is_healthy else "down"
+                    for service, is_healthy in zip(services, results)
+                })
+
+                logger.debug(
+                    "Health check completed: {}/{} services healthy", sum(results), len(services)
+                )
 
             except asyncio.CancelledError:
                 break
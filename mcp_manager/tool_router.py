@@ -1,13 +1,20 @@
 """
 工具路由器 - 智能选择需要加载的工具
 """
+import itertools
 import re
-from typing import List, Dict, Any, Optional
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
 from loguru import logger
 
 from database import DatabaseManager
+from utils.cache import TTLCache
 
 
+# 英文关键词的单词边界匹配模板（允许 s/es 复数后缀）
+_ASCII_WORD_RE = re.compile(r"[a-z0-9_]+")
+_INTENT_WORD_TEMPLATE = r"(?<![a-z0-9_]){}(?:e?s)?(?![a-z0-9_])"
+
 class ToolRouter:
     """工具路由器"""
 
@@ -31,8 +38,14 @@ class ToolRouter:
         # L3高风险工具
         self.high_risk_tools = self.config.get("L3_high_risk_tools", [])
 
+        # L1核心工具列表缓存（每次路由都会加载，服务注册时失效）
+        self._core_tools_cache = TTLCache(max_size=1, ttl=self.config.get("core_tools_cache_ttl", 60))
+
+        # 全部活跃工具的 名称 -> 工具 索引（显式指定/用户偏好工具查找用，与L1缓存同步失效）
+        self._name_index_cache = TTLCache(max_size=1, ttl=self.config.get("core_tools_cache_ttl", 60))
+
         # 意图关键词映射
-        self.intent_keywords = {
+        intent_keywords = {
             "weather": ["天气", "weather", "温度", "temperature", "forecast"],
             "email": ["邮件", "email", "发送", "send", "mail"],
             "file": ["文件", "file", "目录", "directory", "folder"],
@@ -40,9 +53,36 @@ class ToolRouter:
             "network": ["网络", "network", "请求", "request", "api", "http"],
             "calculation": ["计算", "calculate", "数学", "math"],
         }
+        # 初始化时统一转小写，匹配时不再重复处理
+        self.intent_keywords = {
+            intent: tuple(kw.lower() for kw in keywords)
+            for intent, keywords in intent_keywords.items()
+        }
+        self._intent_names = list(self.intent_keywords)
+        self._intent_re = self._compile_intent_pattern(self.intent_keywords)
 
         logger.info("Tool router initialized")
 
+    @staticmethod
+    def _compile_intent_pattern(intent_keywords: Dict[str, Tuple[str, ...]]) -> "re.Pattern":
+        """
+        将所有意图关键词编译为单个正则，每个意图一个命名分支（_i0、_i1...）
+
+        分支包在前瞻中，finditer在每个位置零宽匹配，一次扫描即可找出所有意图，
+        从不同位置开始、互相重叠的关键词也不会漏检。
+        英文关键词按单词边界匹配（允许复数后缀），避免 "api" 命中 "rapid"；
+        中文关键词没有分词边界，仍按子串匹配。
+        """
+        branches = []
+        for i, keywords in enumerate(intent_keywords.values()):
+            # 长关键词优先，避免被其前缀抢先匹配
+            alternation = "|".join(
+                _INTENT_WORD_TEMPLATE.format(re.escape(kw)) if _ASCII_WORD_RE.fullmatch(kw) else re.escape(kw)
+                for kw in sorted(keywords, key=len, reverse=True)
+            )
+            branches.append(f"(?P<_i{i}>{alternation})")
+        return re.compile(f"(?=(?:{'|'.join(branches)}))")
+
     async def route_tools(
         self,
         user_question: str,
@@ -60,7 +100,7 @@ class ToolRouter:
         Returns:
             路由结果，包含工具列表和元数据
         """
-        logger.debug(f"Routing tools for question: {user_question[:50]}...")
+        logger.debug("Routing tools for question: {:.50}...", user_question)
 
         result = {
             "core_tools": [],
@@ -82,10 +122,12 @@ class ToolRouter:
             intents = self._detect_intent(user_question)
             result["detected_intents"] = intents
 
+            # 一次查询L2服务，按领域分桶
+            buckets = await self._get_domain_tools_bulk(intents)
             for intent in intents:
-                domain_tools = await self._get_domain_tools(intent)
-                result["domain_tools"].extend(domain_tools)
+                domain_tools = buckets.get(intent)
                 if domain_tools:
+                    result["domain_tools"].extend(domain_tools)
                     result["active_domains"].append(intent)
 
         # 4. 检查用户偏好（如果有用户ID）
@@ -93,18 +135,14 @@ class ToolRouter:
             user_tools = await self._get_user_preferred_tools(user_id)
             result["domain_tools"].extend(user_tools)
 
-        # 5. 合并所有工具
-        all_tools = result["core_tools"] + result["domain_tools"]
-
-        # 去重
-        seen_names = set()
-        unique_tools = []
-        for tool in all_tools:
-            tool_name = tool.get("name") or tool.get("function", {}).get("name")
-            if tool_name and tool_name not in seen_names:
-                seen_names.add(tool_name)
-                unique_tools.append(tool)
+        # 5. 合并所有工具，按名称去重（dict保持首次出现的顺序）
+        unique = {}
+        for tool in itertools.chain(result["core_tools"], result["domain_tools"]):
+            tool_name = tool.get("name") or (tool.get("function") or {}).get("name")
+            if tool_name and tool_name not in unique:
+                unique[tool_name] = tool
 
+        unique_tools = list(unique.values())
         result["total_tools"] = unique_tools
 
         logger.info(
@@ -124,24 +162,26 @@ class ToolRouter:
         Returns:
             检测到的意图列表
         """
-        question_lower = user_question.lower()
-        detected = []
-
-        for intent, keywords in self.intent_keywords.items():
-            for keyword in keywords:
-                if keyword.lower() in question_lower:
-                    detected.append(intent)
-                    break
+        hits = {
+            int(match.lastgroup[2:])
+            for match in self._intent_re.finditer(user_question.lower())
+        }
+        # 按意图定义顺序返回
+        detected = [self._intent_names[i] for i in sorted(hits)]
 
         # 如果没有检测到任何意图，返回通用意图
         if not detected:
             detected.append("general")
 
-        logger.debug(f"Detected intents: {detected}")
+        logger.debug("Detected intents: {}", detected)
         return detected
 
     async def _get_core_tools(self) -> List[Dict[str, Any]]:
-        """获取L1核心工具"""
+        """获取L1核心工具（优先读取缓存）"""
+        tools = self._core_tools_cache.get("L1")
+        if tools is not None:
+            return tools
+
         tools = []
 
         # 获取L1层的服务
@@ -151,30 +191,53 @@ class ToolRouter:
             if service.tools:
                 tools.extend(service.tools)
 
-        logger.debug(f"Loaded {len(tools)} core tools")
+        self._core_tools_cache.set("L1", tools)
+        logger.debug("Loaded {} core tools", len(tools))
         return tools
 
-    async def _get_domain_tools(self, domain: str) -> List[Dict[str, Any]]:
+    def invalidate_core_cache(self):
+        """使L1核心工具缓存和工具名称索引失效（服务注册或变更后调用）"""
+        self._core_tools_cache.clear()
+        self._name_index_cache.clear()
+
+    async def _get_name_index(self) -> Dict[str, Dict[str, Any]]:
+        """获取全部活跃工具的名称索引（优先读取缓存），同名工具保留首次出现的"""
+        index = self._name_index_cache.get("all")
+        if index is not None:
+            return index
+
+        index = {}
+        services = await self.db.get_active_services()
+        for service in services:
+            for tool in service.tools or ():
+                tool_name = tool.get("name") or (tool.get("function") or {}).get("name")
+                if tool_name and tool_name not in index:
+                    index[tool_name] = tool
+
+        self._name_index_cache.set("all", index)
+        logger.debug("Built tool name index with {} tools", len(index))
+        return index
+
+    async def _get_domain_tools_bulk(self, domains: List[str]) -> Dict[str, List[Dict[str, Any]]]:
         """
-        获取特定领域的工具
+        一次获取多个领域的工具
 
         Args:
-            domain: 领域名称
+            domains: 领域名称列表
 
         Returns:
-            工具列表
+            {domain: 工具列表}，没有工具的领域不出现
         """
-        tools = []
+        wanted = set(domains)
+        by_domain: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
 
-        # 从L2层获取特定领域的服务
         services = await self.db.get_active_services(layer="L2")
-
         for service in services:
-            if service.domain == domain and service.tools:
-                tools.extend(service.tools)
+            if service.domain in wanted and service.tools:
+                by_domain[service.domain].extend(service.tools)
 
-        logger.debug(f"Loaded {len(tools)} tools for domain '{domain}'")
-        return tools
+        logger.debug("Loaded domain tools for {}", list(by_domain))
+        return by_domain
 
     async def _get_explicit_tools(self, tool_names: List[str]) -> List[Dict[str, Any]]:
         """
@@ -186,21 +249,12 @@ class ToolRouter:
         Returns:
             工具列表
         """
-        tools = []
+        index = await self._get_name_index()
 
-        # 获取所有活跃服务
-        services = await self.db.get_active_services()
+        # 按请求的名称顺序查找（去重）
+        tools = [index[name] for name in dict.fromkeys(tool_names) if name in index]
 
-        for service in services:
-            if not service.tools:
-                continue
-
-            for tool in service.tools:
-                tool_name = tool.get("name") or tool.get("function", {}).get("name")
-                if tool_name in tool_names:
-                    tools.append(tool)
-
-        logger.debug(f"Loaded {len(tools)} explicit tools")
+        logger.debug("Loaded {} explicit tools", len(tools))
         return tools
 
     async def _get_user_preferred_tools(self, user_id: str) -> List[Dict[str, Any]]:
@@ -221,33 +275,47 @@ class ToolRouter:
         # 获取偏好的工具
         tools = await self._get_explicit_tools(preference.preferred_tools)
 
-        logger.debug(f"Loaded {len(tools)} user preferred tools")
+        logger.debug("Loaded {} user preferred tools", len(tools))
         return tools
 
     def simplify_tool_description(self, tool: Dict[str, Any]) -> Dict[str, Any]:
         """
         精简工具描述（减少prompt长度）
 
+        不修改传入的工具定义：只有确实需要截断时才复制被改动的那一层字典，
+        无需截断时直接返回原对象。
+
         Args:
             tool: 工具定义
 
         Returns:
             精简后的工具定义
         """
-        simplified = tool.copy()
-
-        # 简化函数描述
-        if "function" in simplified:
-            func = simplified["function"]
-
-            # 截断过长的描述
-            if "description" in func and len(func["description"]) > 200:
-                func["description"] = func["description"][:200] + "..."
-
-            # 简化参数描述
-            if "parameters" in func and "properties" in func["parameters"]:
-                for param_name, param_def in func["parameters"]["properties"].items():
-                    if "description" in param_def and len(param_def["description"]) > 100:
-                        param_def["description"] = param_def["description"][:100] + "..."
-
-        return simplified
+        func = tool.get("function")
+        if not func:
+            return tool
+
+        new_func = None
+
+        # 截断过长的描述
+        description = func.get("description")
+        if description and len(description) > 200:
+            new_func = dict(func, description=description[:200] + "...")
+
+        # 简化参数描述
+        parameters = func.get("parameters") or {}
+        properties = parameters.get("properties") or {}
+        long_params = [
+            name for name, param_def in properties.items()
+            if len(param_def.get("description") or "") > 100
+        ]
+        if long_params:
+            new_properties = dict(properties)
+            for name in long_params:
+                param_def = properties[name]
+                new_properties[name] = dict(param_def, description=param_def["description"][:100] + "...")
+            new_func = dict(new_func or func, parameters=dict(parameters, properties=new_properties))
+
+        if new_func is None:
+            return tool
+        return dict(tool, function=new_func)
@@ -1,12 +1,13 @@
 """
 模型模块初始化
 """
-from models.base_model import BaseModel, Message, ToolDefinition, ModelResponse
+from models.base_model import BaseModel, Message, MessageListAdapter, ToolDefinition, ModelResponse
 from models.openai_adapter import OpenAIAdapter
 
 __all__ = [
     "BaseModel",
     "Message",
+    "MessageListAdapter",
     "ToolDefinition",
     "ModelResponse",
     "OpenAIAdapter"
@@ -1,9 +1,10 @@
 """
 模型基类定义
 """
+import asyncio
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional, AsyncGenerator
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, TypeAdapter
 
 
 class Message(BaseModel):
@@ -15,11 +16,24 @@ class Message(BaseModel):
     tool_call_id: Optional[str] = Field(None, description="工具调用ID")
 
 
+# 消息列表的预编译校验/序列化适配器（避免逐条构造和model_dump）
+MessageListAdapter = TypeAdapter(List[Message])
+
+
 class ToolDefinition(BaseModel):
     """工具定义模型"""
     type: str = Field(default="function", description="工具类型")
     function: Dict[str, Any] = Field(..., description="函数定义")
 
+    # model_dump 结果缓存（工具定义在编排器中被缓存复用，创建后不再修改）
+    _dumped: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """获取工具定义的字典形式（首次调用时序列化，之后复用）"""
+        if self._dumped is None:
+            self._dumped = self.model_dump()
+        return self._dumped
+
 
 class ModelResponse(BaseModel):
     """模型响应模型"""
@@ -100,6 +114,45 @@ class BaseModel(ABC):
         """
         raise NotImplementedError("Subclass must implement generate_stream method")
 
+    async def generate_stream_events(
+        self,
+        messages: List[Message],
+        tools: Optional[List[ToolDefinition]] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        流式生成结构化事件（可选实现）
+
+        事件类型：
+        - {"type": "content_delta", "content": str}: 文本片段
+        - {"type": "tool_call_delta", "index": int, ...}: 工具调用片段
+        - {"type": "done", "response": ModelResponse}: 结束，附带完整响应（含工具调用）
+
+        默认实现调用一次 generate 并整体返回；支持流式工具调用的子类应覆盖此方法。
+
+        Args:
+            messages: 对话历史消息列表
+            tools: 可用工具列表
+            temperature: 温度参数
+            max_tokens: 最大生成token数
+            **kwargs: 其他模型特定参数
+
+        Yields:
+            Dict[str, Any]: 流式事件
+        """
+        response = await self.generate(
+            messages=messages,
+            tools=tools,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+        if response.content:
+            yield {"type": "content_delta", "content": response.content}
+        yield {"type": "done", "response": response}
+
     @abstractmethod
     async def get_embedding(self, text: str) -> List[float]:
         """
@@ -116,6 +169,20 @@ class BaseModel(ABC):
         """
         raise NotImplementedError("Subclass must implement get_embedding method")
 
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量获取文本的向量嵌入（可选实现）
+
+        默认逐条并发调用 get_embedding，支持批量接口的子类应覆盖此方法。
+
+        Args:
+            texts: 输入文本列表
+
+        Returns:
+            List[List[float]]: 与输入顺序一致的向量嵌入列表
+        """
+        return list(await asyncio.gather(*(self.get_embedding(text) for text in texts)))
+
     def validate_config(self) -> bool:
         """
         验证配置是否有效（可选实现）
@@ -3,13 +3,13 @@ OpenAI兼容格式的模型适配器
 支持所有兼容OpenAI API格式的模型服务
 """
 from typing import List, Dict, Any, Optional, AsyncGenerator
-import json
 from openai import AsyncOpenAI
 from loguru import logger
 
 from models.base_model import (
     BaseModel,
     Message,
+    MessageListAdapter,
     ToolDefinition,
     ModelResponse
 )
@@ -40,6 +40,13 @@ class OpenAIAdapter(BaseModel):
         self.default_temperature = openai_config.get("temperature", 0.7)
         self.default_max_tokens = openai_config.get("max_tokens", 2000)
 
+        # 请求参数模板（每次调用在其副本上覆盖本次参数）
+        self._base_params = {
+            "model": self.model_name,
+            "temperature": self.default_temperature,
+            "max_tokens": self.default_max_tokens
+        }
+
         # 初始化OpenAI客户端
         self.client = AsyncOpenAI(
             base_url=self.api_base,
@@ -52,36 +59,41 @@ class OpenAIAdapter(BaseModel):
         self.embedding_api_key = embedding_config.get("api_key", self.api_key)
         self.embedding_model = embedding_config.get("model_name", "text-embedding-ada-002")
 
-        # 初始化Embedding客户端
-        self.embedding_client = AsyncOpenAI(
-            base_url=self.embedding_api_base,
-            api_key=self.embedding_api_key
-        )
+        # 初始化Embedding客户端（与对话服务同一端点和密钥时复用同一客户端及其连接池）
+        if self.embedding_api_base == self.api_base and self.embedding_api_key == self.api_key:
+            self.embedding_client = self.client
+        else:
+            self.embedding_client = AsyncOpenAI(
+                base_url=self.embedding_api_base,
+                api_key=self.embedding_api_key
+            )
 
         logger.info(f"OpenAI adapter initialized: {self.api_base}, model={self.model_name}")
 
     def _convert_messages(self, messages: List[Message]) -> List[Dict[str, Any]]:
-        """将Message对象转换为OpenAI格式"""
-        result = []
-        for msg in messages:
-            msg_dict = {"role": msg.role, "content": msg.content}
-
-            if msg.name:
-                msg_dict["name"] = msg.name
-
-            if msg.tool_calls:
-                msg_dict["tool_calls"] = msg.tool_calls
-
-            if msg.tool_call_id:
-                msg_dict["tool_call_id"] = msg.tool_call_id
-
-            result.append(msg_dict)
-
-        return result
+        """将Message对象转换为OpenAI格式（一次序列化整个列表，省略为None的字段）"""
+        return MessageListAdapter.dump_python(messages, exclude_none=True)
 
     def _convert_tools(self, tools: List[ToolDefinition]) -> List[Dict[str, Any]]:
         """将ToolDefinition对象转换为OpenAI格式"""
-        return [tool.model_dump() for tool in tools]
+        return [tool.to_dict() for tool in tools]
+
+    def _build_params(
+        self,
+        openai_messages: List[Dict[str, Any]],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        extra: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """基于参数模板构建请求参数，仅在调用方显式传入时覆盖默认温度/最大token数"""
+        params = {**self._base_params, "messages": openai_messages}
+        if temperature is not None:
+            params["temperature"] = temperature
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        if extra:
+            params.update(extra)
+        return params
 
     async def generate(
         self,
@@ -109,13 +121,7 @@ class OpenAIAdapter(BaseModel):
             openai_messages = self._convert_messages(messages)
 
             # 构建请求参数
-            request_params = {
-                "model": self.model_name,
-                "messages": openai_messages,
-                "temperature": temperature or self.default_temperature,
-                "max_tokens": max_tokens or self.default_max_tokens,
-                **kwargs
-            }
+            request_params = self._build_params(openai_messages, temperature, max_tokens, kwargs)
 
             # 添加工具定义
             if tools:
@@ -123,7 +129,7 @@ class OpenAIAdapter(BaseModel):
                 request_params["tool_choice"] = "auto"
 
             # 调用API
-            logger.debug(f"Calling OpenAI API with {len(openai_messages)} messages")
+            logger.debug("Calling OpenAI API with {} messages", len(openai_messages))
             response = await self.client.chat.completions.create(**request_params)
 
             # 解析响应
@@ -132,17 +138,16 @@ class OpenAIAdapter(BaseModel):
 
             # 提取工具调用
             tool_calls = None
-            if hasattr(message, 'tool_calls') and message.tool_calls:
+            raw_tool_calls = getattr(message, "tool_calls", None)
+            if raw_tool_calls:
                 tool_calls = [
                     {
                         "id": tc.id,
                         "type": tc.type,
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
-                        }
+                        "function": {"name": fn.name, "arguments": fn.arguments}
                     }
-                    for tc in message.tool_calls
+                    for tc in raw_tool_calls
+                    for fn in (tc.function,)
                 ]
 
             # 构建响应
@@ -158,9 +163,8 @@ class OpenAIAdapter(BaseModel):
             )
 
             logger.info(
-                f"Generated response: finish_reason={choice.finish_reason}, "
-                f"tokens={response.usage.total_tokens}, "
-                f"has_tool_calls={tool_calls is not None}"
+                "Generated response: finish_reason={}, tokens={}, has_tool_calls={}",
+                choice.finish_reason, response.usage.total_tokens, tool_calls is not None
             )
 
             return model_response
@@ -190,19 +194,44 @@ class OpenAIAdapter(BaseModel):
         Yields:
             str: 生成的文本片段
         """
+        async for event in self.generate_stream_events(
+            messages=messages,
+            tools=tools,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        ):
+            if event["type"] == "content_delta":
+                yield event["content"]
+
+    async def generate_stream_events(
+        self,
+        messages: List[Message],
+        tools: Optional[List[ToolDefinition]] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        流式生成结构化事件，从流中的 delta.tool_calls 拼装工具调用
+
+        Args:
+            messages: 对话历史消息列表
+            tools: 可用工具列表
+            temperature: 温度参数
+            max_tokens: 最大生成token数
+            **kwargs: 其他参数
+
+        Yields:
+            Dict[str, Any]: content_delta / tool_call_delta / done 事件
+        """
         try:
             # 转换消息格式
             openai_messages = self._convert_messages(messages)
 
             # 构建请求参数
-            request_params = {
-                "model": self.model_name,
-                "messages": openai_messages,
-                "temperature": temperature or self.default_temperature,
-                "max_tokens": max_tokens or self.default_max_tokens,
-                "stream": True,
-                **kwargs
-            }
+            request_params = self._build_params(openai_messages, temperature, max_tokens, kwargs)
+            request_params["stream"] = True
 
             # 添加工具定义
             if tools:
@@ -210,15 +239,62 @@ class OpenAIAdapter(BaseModel):
                 request_params["tool_choice"] = "auto"
 
             # 调用API
-            logger.debug(f"Calling OpenAI API (stream) with {len(openai_messages)} messages")
+            logger.debug("Calling OpenAI API (stream) with {} messages", len(openai_messages))
             stream = await self.client.chat.completions.create(**request_params)
 
-            # 流式返回
+            content_parts = []
+            tool_calls_buf: Dict[int, Dict[str, Any]] = {}
+            finish_reason = None
+
             async for chunk in stream:
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if delta.content:
-                        yield delta.content
+                if not chunk.choices:
+                    continue
+
+                choice = chunk.choices[0]
+                delta = choice.delta
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield {"type": "content_delta", "content": delta.content}
+
+                # 工具调用按index分片到达：id/name出现在首个分片，arguments逐段拼接
+                for tc in getattr(delta, "tool_calls", None) or ():
+                    buf = tool_calls_buf.setdefault(tc.index, {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
+                    })
+                    if tc.id:
+                        buf["id"] = tc.id
+                    name = tc.function.name if tc.function else None
+                    arguments = tc.function.arguments if tc.function else None
+                    if name:
+                        buf["function"]["name"] += name
+                    if arguments:
+                        buf["function"]["arguments"] += arguments
+                    yield {
+                        "type": "tool_call_delta",
+                        "index": tc.index,
+                        "id": tc.id,
+                        "name": name,
+                        "arguments": arguments
+                    }
+
+            tool_calls = [tool_calls_buf[i] for i in sorted(tool_calls_buf)] or None
+            response = ModelResponse(
+                content="".join(content_parts) or None,
+                tool_calls=tool_calls,
+                finish_reason=finish_reason or ("tool_calls" if tool_calls else "stop")
+            )
+
+            logger.info(
+                "Generated stream response: finish_reason={}, has_tool_calls={}",
+                response.finish_reason, tool_calls is not None
+            )
+
+            yield {"type": "done", "response": response}
 
         except Exception as e:
             logger.error(f"Error in stream generation: {e}")
@@ -235,7 +311,7 @@ class OpenAIAdapter(BaseModel):
             List[float]: 向量嵌入
         """
         try:
-            logger.debug(f"Getting embedding for text (length={len(text)})")
+            logger.debug("Getting embedding for text (length={})", len(text))
 
             response = await self.embedding_client.embeddings.create(
                 model=self.embedding_model,
@@ -243,7 +319,7 @@ class OpenAIAdapter(BaseModel):
             )
 
             embedding = response.data[0].embedding
-            logger.debug(f"Got embedding with dimension {len(embedding)}")
+            logger.debug("Got embedding with dimension {}", len(embedding))
 
             return embedding
 
@@ -251,6 +327,31 @@ class OpenAIAdapter(BaseModel):
             logger.error(f"Error getting embedding: {e}")
             raise
 
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量获取文本的向量嵌入（单次API调用）
+
+        Args:
+            texts: 输入文本列表
+
+        Returns:
+            List[List[float]]: 与输入顺序一致的向量嵌入列表
+        """
+        try:
+            logger.debug("Getting embeddings for {} texts", len(texts))
+
+            response = await self.embedding_client.embeddings.create(
+                model=self.embedding_model,
+                input=texts
+            )
+
+            data = sorted(response.data, key=lambda d: d.index)
+            return [d.embedding for d in data]
+
+        except Exception as e:
+            logger.error(f"Error getting embeddings: {e}")
+            raise
+
     async def health_check(self) -> bool:
         """
         健康检查
@@ -4,6 +4,8 @@
 import sys
 import platform
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
 from pathlib import Path
 
 
@@ -31,12 +33,8 @@ def check_platform():
 
 
 def check_package(package_name):
-    """检查Python包是否已安装"""
-    try:
-        __import__(package_name)
-        return True
-    except ImportError:
-        return False
+    """检查Python包是否已安装（只查找模块，不执行导入，避免加载faiss等重型原生库）"""
+    return find_spec(package_name) is not None
 
 
 def check_dependencies():
@@ -52,9 +50,13 @@ def check_dependencies():
         "uvicorn": "Uvicorn",
     }
 
+    # 并发探测，结果按依赖顺序输出
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        installed = list(executor.map(check_package, dependencies))
+
     missing = []
-    for package, name in dependencies.items():
-        if check_package(package):
+    for (package, name), ok in zip(dependencies.items(), installed):
+        if ok:
             print(f"  ✓ {name}")
         else:
             print(f"  ❌ {name} 未安装")
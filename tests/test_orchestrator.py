@@ -0,0 +1,68 @@
+"""
+编排器测试（工具参数解析、工具调用并发处理）
+"""
+import asyncio
+
+import pytest
+
+from core.orchestrator import MCPOrchestrator
+
+
+@pytest.mark.parametrize("arguments, expected", [
+    ('{"path": "/tmp"}', {"path": "/tmp"}),
+    (b'{"path": "/tmp"}', {"path": "/tmp"}),
+    ({"path": "/tmp"}, {"path": "/tmp"}),
+    ("not json", {}),
+    (None, {}),
+    ("[1]", {}),
+    ("5", {}),
+    ('"x"', {}),
+    ([1], {}),
+])
+def test_parse_tool_arguments_returns_dict(arguments, expected):
+    assert MCPOrchestrator._parse_tool_arguments(arguments) == expected
+
+
+def make_orchestrator(process_tool_call):
+    orchestrator = MCPOrchestrator.__new__(MCPOrchestrator)
+    orchestrator._tool_semaphore = asyncio.Semaphore(8)
+    orchestrator._process_tool_call = process_tool_call
+    return orchestrator
+
+
+def process_tool_calls(orchestrator):
+    tool_calls = [
+        {"id": "c1", "function": {"name": "ok", "arguments": "{}"}},
+        {"id": "c2", "function": {"name": "bad", "arguments": "{}"}},
+    ]
+    return orchestrator._process_tool_calls(
+        request_id="req",
+        user_id="u",
+        user_question="q",
+        tool_calls=tool_calls,
+        similar_cases=[],
+        historical_analysis={}
+    )
+
+
+def test_failed_tool_call_becomes_error_result():
+    async def process_tool_call(tool_call, **kwargs):
+        if tool_call["function"]["name"] == "bad":
+            raise ValueError("boom")
+        return {"tool_name": "ok", "requires_confirmation": False, "risk_score": 0.1}
+
+    results = asyncio.run(process_tool_calls(make_orchestrator(process_tool_call)))
+
+    assert results[0]["tool_name"] == "ok"
+    assert results[1]["error"] == "boom"
+    assert results[1]["record_id"] == "req:1"
+
+
+def test_cancelled_tool_call_is_not_swallowed():
+    async def process_tool_call(tool_call, **kwargs):
+        if tool_call["function"]["name"] == "bad":
+            raise asyncio.CancelledError()
+        return {"tool_name": "ok", "requires_confirmation": False, "risk_score": 0.1}
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(process_tool_calls(make_orchestrator(process_tool_call)))
@@ -0,0 +1,92 @@
+"""
+规则引擎工具名称匹配测试
+"""
+import orjson
+
+from core.rule_engine import RuleEngine
+
+
+def make_engine(tmp_path, rules):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_bytes(orjson.dumps({"rules": rules}))
+    blacklist_file = tmp_path / "blacklist.json"
+    blacklist_file.write_bytes(orjson.dumps({"blocked_tools": [], "blocked_parameters": []}))
+    return RuleEngine({"rule_engine": {
+        "rules_file": str(rules_file),
+        "blacklist_file": str(blacklist_file)
+    }})
+
+
+def rule(rule_id, pattern):
+    return {
+        "rule_id": rule_id,
+        "name": rule_id,
+        "condition": {"tool_name_pattern": pattern},
+        "action": "force_confirm",
+        "risk_score": 0.5
+    }
+
+
+def matched_ids(engine, tool_name):
+    result = engine.check_tool_call(tool_name, {})
+    return [r["rule_id"] for r in result["matched_rules"]]
+
+
+def test_backreference_pattern_matches_its_own_group(tmp_path):
+    engine = make_engine(tmp_path, [
+        rule("R_GROUP", "(foo|bar)_tool"),
+        rule("R_BACKREF", r"(get)_\1"),
+        rule("R_PLAIN", "delete"),
+    ])
+
+    assert matched_ids(engine, "get_get") == ["R_BACKREF"]
+    assert matched_ids(engine, "get_set") == []
+    assert matched_ids(engine, "foo_tool_delete") == ["R_GROUP", "R_PLAIN"]
+
+
+def test_only_plain_patterns_are_combined(tmp_path):
+    engine = make_engine(tmp_path, [
+        rule("R_GROUP", "(foo)"),
+        rule("R_FLAGS", "(?i)foo"),
+        rule("R_SCOPED", "x(?i:foo)"),
+        rule("R_PLAIN", "(?:foo|bar)baz"),
+    ])
+
+    combined = {group for _, group in engine._rule_name_groups}
+    assert len(combined) == 1
+    assert matched_ids(engine, "xfoobarbaz") == ["R_GROUP", "R_FLAGS", "R_SCOPED", "R_PLAIN"]
+
+
+def make_blacklist_engine(tmp_path, blocked_tools=(), blocked_parameters=()):
+    engine_dir = tmp_path / "blacklist"
+    engine_dir.mkdir()
+    (engine_dir / "rules.json").write_bytes(orjson.dumps({"rules": []}))
+    (engine_dir / "blacklist.json").write_bytes(orjson.dumps({
+        "blocked_tools": list(blocked_tools),
+        "blocked_parameters": list(blocked_parameters)
+    }))
+    return RuleEngine({"rule_engine": {
+        "rules_file": str(engine_dir / "rules.json"),
+        "blacklist_file": str(engine_dir / "blacklist.json")
+    }})
+
+
+def test_blacklist_backreference_patterns_still_block(tmp_path):
+    engine = make_blacklist_engine(
+        tmp_path,
+        blocked_tools=[{"tool_name": "(x)y"}, {"tool_name": r"(rm)_\1"}],
+        blocked_parameters=[{"pattern": "(p)q"}, {"pattern": r"(token)=\1"}]
+    )
+
+    assert engine.check_tool_call("rm_rm", {})["blocked"] is True
+    assert engine.check_tool_call("run", {"token": "token"})["blocked"] is True
+    assert engine.check_tool_call("rm_ls", {"token": "other"})["blocked"] is False
+
+
+def test_combined_scan_keeps_dot_from_matching_newline(tmp_path):
+    engine = make_engine(tmp_path, [rule("R_DOT", "a.b"), rule("R_PLAIN", "delete")])
+
+    assert engine._rule_name_groups
+    assert matched_ids(engine, "a\nb") == []
+    assert matched_ids(engine, "axb") == ["R_DOT"]
+    assert matched_ids(engine, "x\ndelete") == ["R_PLAIN"]
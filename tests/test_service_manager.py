@@ -0,0 +1,57 @@
+"""
+熔断器进程内状态与数据库同步测试（数据库以内存假实现替代）
+"""
+import asyncio
+from types import SimpleNamespace
+
+from mcp_manager.service_manager import MCPServiceManager
+
+
+class FakeDB:
+    """只实现熔断器相关方法，状态保存在内存中"""
+
+    def __init__(self, state="closed"):
+        self.service = SimpleNamespace(circuit_breaker_state=state, circuit_breaker_opened_at=None)
+
+    async def get_circuit_breaker_state(self, service_name):
+        return self.service.circuit_breaker_state or "closed", self.service.circuit_breaker_opened_at
+
+    async def transition_circuit_breaker(self, service_name, from_state, to_state, health_status=None):
+        if (self.service.circuit_breaker_state or "closed") != from_state:
+            return False
+        self.service.circuit_breaker_state = to_state
+        return True
+
+
+def make_manager(db, failure_threshold=2):
+    return MCPServiceManager(db, {"mcp_services": {
+        "circuit_breaker": {"failure_threshold": failure_threshold, "timeout_duration": 60}
+    }})
+
+
+def test_breaker_opens_after_threshold_failures():
+    db = FakeDB()
+    manager = make_manager(db)
+
+    async def run():
+        await manager.update_circuit_breaker("svc", False)
+        await manager.update_circuit_breaker("svc", False)
+
+    asyncio.run(run())
+    assert db.service.circuit_breaker_state == "open"
+    assert manager._breaker_states["svc"] == "open"
+
+
+def test_lost_transition_reloads_persisted_state():
+    db = FakeDB()
+    manager = make_manager(db)
+
+    async def run():
+        await manager.update_circuit_breaker("svc", False)
+        # 另一个worker先把熔断器切到 half_open
+        db.service.circuit_breaker_state = "half_open"
+        await manager.update_circuit_breaker("svc", False)
+
+    asyncio.run(run())
+    assert db.service.circuit_breaker_state == "half_open"
+    assert manager._breaker_states["svc"] == "half_open"
@@ -0,0 +1,89 @@
+"""
+工具调用历史批量写入测试（无需PostgreSQL，会话以内存假实现替代）
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from sqlalchemy.exc import IntegrityError
+
+from core.orchestrator import MCPOrchestrator
+from database.postgresql import PostgreSQLManager
+
+
+class FakeSession:
+    """模拟 request_id 唯一约束的会话：任一行冲突时整条语句失败"""
+
+    def __init__(self, store):
+        self.store = store
+
+    async def execute(self, stmt, rows=None):
+        if rows is None:
+            rows = [stmt.compile().params]
+        keys = [row["request_id"] for row in rows]
+        if len(set(keys)) != len(keys) or any(key in self.store for key in keys):
+            raise IntegrityError(str(stmt), rows, Exception("duplicate key value violates unique constraint"))
+        ids = []
+        for key in keys:
+            self.store[key] = len(self.store) + 1
+            ids.append(self.store[key])
+        return FakeResult(ids)
+
+
+class FakeResult:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.ids
+
+    def scalar_one(self):
+        return self.ids[0]
+
+
+def make_manager(store):
+    # 创建引擎不会连接数据库
+    manager = PostgreSQLManager({"postgresql": {
+        "host": "localhost", "port": 5432, "database": "test", "user": "test", "password": ""
+    }})
+
+    @asynccontextmanager
+    async def get_session():
+        # 语句失败时不提交，与真实会话的回滚一致
+        pending = dict(store)
+        yield FakeSession(pending)
+        store.update(pending)
+
+    manager.get_session = get_session
+    return manager
+
+
+def history_row(request_id):
+    return {"request_id": request_id, "user_id": "u", "user_question": "q", "tool_name": "t"}
+
+
+def test_tool_calls_of_one_request_get_distinct_record_ids():
+    record_ids = [MCPOrchestrator._tool_call_record_id("req", i) for i in range(3)]
+    assert record_ids == ["req", "req:1", "req:2"]
+
+    store = {}
+    manager = make_manager(store)
+    ids = asyncio.run(manager.create_tool_call_histories_bulk([history_row(r) for r in record_ids]))
+
+    assert None not in ids
+    assert set(store) == set(record_ids)
+
+
+def test_duplicate_request_id_in_batch_only_drops_conflicting_row():
+    store = {}
+    manager = make_manager(store)
+    rows = [history_row("other-1"), history_row("req"), history_row("req"), history_row("other-2")]
+
+    ids = asyncio.run(manager.create_tool_call_histories_bulk(rows))
+
+    assert len(ids) == len(rows)
+    assert ids[2] is None
+    assert None not in (ids[0], ids[1], ids[3])
+    assert set(store) == {"other-1", "req", "other-2"}
@@ -1,15 +1,26 @@
 """
 配置加载工具
 """
+import functools
 import yaml
 from typing import Dict, Any
 from pathlib import Path
 from loguru import logger
 
+# 优先使用libyaml的C实现解析器，未编译libyaml时回退到纯Python实现
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 
+# 配置文件必须包含的顶层键
+_REQUIRED_KEYS = frozenset({"database", "model", "risk_assessment"})
+
+
+@functools.lru_cache(maxsize=None)
 def load_config(config_path: str = "config/config.yaml") -> Dict[str, Any]:
     """
-    加载配置文件
+    加载配置文件（每个路径只解析一次，进程内共享同一配置对象，调用方不应修改）
 
     Args:
         config_path: 配置文件路径
@@ -19,7 +30,7 @@ def load_config(config_path: str = "config/config.yaml") -> Dict[str, Any]:
     """
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
+            config = yaml.load(f, Loader=_YamlLoader)
         logger.info(f"Loaded configuration from {config_path}")
         return config
     except Exception as e:
@@ -37,11 +48,9 @@ def validate_config(config: Dict[str, Any]) -> bool:
     Returns:
         是否有效
     """
-    required_keys = ["database", "model", "risk_assessment"]
-
-    for key in required_keys:
-        if key not in config:
-            logger.error(f"Missing required config key: {key}")
-            return False
+    missing = _REQUIRED_KEYS - config.keys()
+    if missing:
+        logger.error(f"Missing required config keys: {sorted(missing)}")
+        return False
 
     return True
@@ -0,0 +1,74 @@
+"""
+Prometheus指标 - 请求与主流程各阶段耗时
+"""
+import time
+from typing import Awaitable, TypeVar
+
+from prometheus_client import Histogram
+
+
+T = TypeVar("T")
+
+# 主流程各阶段耗时（对应 process_query 中的编号步骤）
+ROUTING_SECONDS = Histogram("mcp_routing_seconds", "Tool routing latency")
+MODEL_SECONDS = Histogram("mcp_model_seconds", "Model generation latency")
+RAG_SECONDS = Histogram("mcp_rag_seconds", "RAG retrieval latency")
+RULES_SECONDS = Histogram("mcp_rules_seconds", "Rule checking latency")
+RISK_SECONDS = Histogram("mcp_risk_seconds", "Risk assessment latency")
+DB_WRITE_SECONDS = Histogram("mcp_db_write_seconds", "Tool call history batch write latency")
+
+# HTTP请求耗时（按路由模板区分，避免路径参数导致标签膨胀）
+HTTP_REQUEST_SECONDS = Histogram(
+    "mcp_http_request_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"]
+)
+
+
+async def observe_async(histogram: Histogram, awaitable: Awaitable[T]) -> T:
+    """
+    等待协程并记录耗时
+
+    Args:
+        histogram: 目标直方图
+        awaitable: 待等待的协程
+
+    Returns:
+        协程结果
+    """
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """记录每个HTTP请求耗时的ASGI中间件（流式响应计到发送完毕）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status)
+            ).observe(time.perf_counter() - start)
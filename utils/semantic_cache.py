@@ -0,0 +1,147 @@
+"""
+语义缓存 - 基于LSH随机超平面的近似匹配缓存
+"""
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    基于LSH（随机超平面）的语义缓存
+
+    按向量方向分桶，查询时只比较同桶条目的余弦相似度，
+    使措辞不同但语义相近的查询命中同一缓存结果。
+    条目带 scope（如用户ID），只有 scope 相同的条目才会命中。
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        num_tables: int = 4,
+        num_bits: int = 12,
+        threshold: float = 0.95,
+        ttl: Optional[float] = 60.0,
+        seed: int = 0
+    ):
+        """
+        初始化语义缓存
+
+        Args:
+            max_size: 最大条目数
+            num_tables: 哈希表数量（L），越多召回越高
+            num_bits: 每个哈希表的超平面数量（K），越多分桶越细
+            threshold: 命中所需的最小余弦相似度
+            ttl: 条目有效期（秒），None表示永不过期
+            seed: 超平面随机种子
+        """
+        self.max_size = max_size
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.threshold = threshold
+        self.ttl = ttl
+        self.seed = seed
+
+        # 超平面在首次写入时按向量维度生成
+        self._planes: Optional[np.ndarray] = None
+        self._bit_weights = 1 << np.arange(num_bits, dtype=np.int64)
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(num_tables)]
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    def _normalize(self, vector: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
+    def _bucket_keys(self, v: np.ndarray) -> List[int]:
+        """计算向量在每个哈希表中的桶编号（超平面符号位）"""
+        bits = (self._planes @ v >= 0).reshape(self.num_tables, self.num_bits)
+        return (bits @ self._bit_weights).tolist()
+
+    def get(self, vector: Sequence[float], scope: Hashable = None) -> Any:
+        """查找语义相近的缓存结果，未命中返回None"""
+        if self._planes is None:
+            self.misses += 1
+            return None
+
+        v = self._normalize(vector)
+        if v.shape[0] != self._planes.shape[1]:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        best_id, best_sim = None, self.threshold
+        for table, key in zip(self._tables, self._bucket_keys(v)):
+            for entry_id in table.get(key, ()):
+                expires_at, entry_scope, entry_vec, _, _ = self._entries[entry_id]
+                if entry_scope != scope or expires_at < now:
+                    continue
+                sim = float(entry_vec @ v)
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+
+        if best_id is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(best_id)
+        self.hits += 1
+        return self._entries[best_id][3]
+
+    def set(self, vector: Sequence[float], value: Any, scope: Hashable = None):
+        """写入缓存"""
+        v = self._normalize(vector)
+        if self._planes is None or v.shape[0] != self._planes.shape[1]:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal(
+                (self.num_tables * self.num_bits, v.shape[0])
+            ).astype(np.float32)
+            self.clear()
+
+        keys = self._bucket_keys(v)
+        entry_id = next(self._ids)
+        expires_at = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[entry_id] = (expires_at, scope, v, value, keys)
+        for table, key in zip(self._tables, keys):
+            table.setdefault(key, []).append(entry_id)
+
+        while len(self._entries) > self.max_size:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, entry_id: int):
+        """删除条目及其桶索引"""
+        keys = self._entries.pop(entry_id)[4]
+        for table, key in zip(self._tables, keys):
+            bucket = table.get(key)
+            if bucket:
+                bucket.remove(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def clear(self):
+        """清空缓存（保留超平面）"""
+        self._entries.clear()
+        for table in self._tables:
+            table.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }